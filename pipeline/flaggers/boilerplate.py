@@ -3,6 +3,8 @@
 # Your class must implement the Flagger interface.
 # To that end, your class must implement the flag method.
 # Your flag method must return a list of flags. Flags are defined in flagger.py.
+# For speed, you may also override flag_frame to flag a whole DataFrame at once;
+# see docs/flaggers.md.
 # You must append one instance of your class to flaggers.
 
 from .flagger import Flagger, Flags, flaggers
@@ -0,0 +1,67 @@
+from .flagger import Flagger, Flags, flaggers, float_values
+import numpy as np
+import pandas as pd
+
+#Class that implements bounds check:
+#That is a value lies outside the min/max bounds of its column in config's "columns".
+class Bounds(Flagger):
+	name = 'Bounds'
+
+	# column name: (below min flag, above max flag)
+	bound_flags = {
+		member.name[:-len('_BELOW_MIN')].lower(): (member, Flags[member.name[:-len('_BELOW_MIN')] + '_ABOVE_MAX'])
+		for member in Flags if member.name.endswith('_BELOW_MIN')
+	}
+
+	def flag(self, data, config):
+		"""
+		Checks a single row; see flag_frame().
+
+		Returns:
+			list: the bounds flags of the row
+		"""
+
+		return [flag for flag, mask in self.flag_frame(pd.DataFrame([data]), config).items()
+				if mask[0]]
+
+	def flag_frame(self, data, config):
+		"""
+		Compares every bounded column against its min and max in one pass.
+		The bounds are parsed into NumPy scalars once by config.typed_bounds();
+		columns with date bounds are compared as datetime64 and all others as
+		float64. Null values are never out of bounds.
+
+		Args:
+			data (pandas.DataFrame): rows fetched from the db
+			config (Object): contains config vars
+
+		Returns:
+			dict: the <COLUMN>_BELOW_MIN and <COLUMN>_ABOVE_MAX flags of every
+				bounded column, mapped to boolean numpy arrays
+		"""
+
+		masks = {}
+		for col, (col_min, col_max) in config.typed_bounds().items():
+			if col not in data or col not in self.bound_flags:
+				continue
+			below_min, above_max = self.bound_flags[col]
+
+			values = self._typed_values(data[col], col_min, col_max)
+			if col_min is not None:
+				masks[below_min] = values < col_min
+			if col_max is not None:
+				masks[above_max] = values > col_max
+
+		return masks
+
+	def read_columns(self, config):
+		return [col for col in config.typed_bounds() if col in self.bound_flags]
+
+	def _typed_values(self, column, col_min, col_max):
+		bound = col_min if col_min is not None else col_max
+		if isinstance(bound, np.datetime64):
+			# NaT compares False against everything.
+			return pd.to_datetime(column, errors='coerce').values.astype('datetime64[ns]')
+		return float_values(column)
+
+flaggers.append(Bounds())
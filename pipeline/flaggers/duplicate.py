@@ -1,8 +1,17 @@
+import datetime
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_datetime64_any_dtype,
+                              is_numeric_dtype)
+from pandas.util import hash_pandas_object
+
 from .flagger import Flagger, Flags, flaggers
 
 # Class implements duplicate check
 class Duplicate(Flagger):
     name = 'Duplicate'
+    # Duplicates may differ in any column that is not a key column.
+    partitionable = False
 
     def flag(self, data, config):
         """
@@ -30,4 +39,102 @@ class Duplicate(Flagger):
             raise ValueError('Duplicate.flag() received a pandas.DataFrame without a "service_date" field.')
         return duplicates
 
+    def flag_frame(self, data, config):
+        """
+        Batch version of flag(): marks every row that has an identical twin
+        somewhere else in data. Rows are compared on config's
+        "duplicate_key_columns", or on every column if that is unset.
+
+        Rather than comparing whole rows, each row is reduced to a 64-bit
+        fingerprint and only rows sharing a fingerprint are compared column
+        by column, so hash collisions are never flagged.
+
+        Args:
+            data (Pandas.DataFrame): The dataset to find duplicates in.
+            config (Object): contains config vars
+
+        Returns:
+            dict: Flags.DUPLICATE mapped to a boolean numpy array, one entry
+                    per row of data.
+        """
+
+        columns = key_columns(data, config)
+        hashes = fingerprint(data, columns)
+        candidates = hashes.duplicated(keep=False).values
+
+        mask = np.zeros(len(data.index), dtype=bool)
+        if candidates.any():
+            verified = data.iloc[np.flatnonzero(candidates)][columns].duplicated(keep=False)
+            mask[np.flatnonzero(candidates)] = verified.values
+        return {Flags.DUPLICATE: mask}
+
+    def read_columns(self, config):
+        # Without "duplicate_key_columns", rows are compared on every column.
+        return config.get_value("duplicate_key_columns") or None
+
+
+def key_columns(data, config, cross_day=False):
+    # The columns rows are compared on: config's "duplicate_key_columns" if set,
+    # otherwise every column of data. With cross_day, the default leaves out
+    # service_date and row_id, since rows of two different runs always differ
+    # in those and could otherwise never match.
+    columns = config.get_value("duplicate_key_columns")
+    if not columns:
+        if cross_day:
+            return [col for col in data.columns if col not in ("service_date", "row_id")]
+        return list(data.columns)
+
+    missing = [col for col in columns if col not in data]
+    if missing:
+        raise ValueError("duplicate_key_columns are not in the data: " + ", ".join(missing))
+    return list(columns)
+
+
+def fingerprint(data, columns):
+    """
+    Computes a stable 64-bit hash of every row of data over columns.
+
+    Columns are first converted to a canonical type so that a row hashes the
+    same whether it was read as Python objects or as typed columns: numbers
+    become float64, dates and datetimes become nanoseconds since the epoch,
+    and everything else becomes a string.
+
+    Args:
+        data (pandas.DataFrame): the rows to hash.
+        columns (list): the names of the columns to hash, in order.
+
+    Returns:
+        pandas.Series: uint64 hashes, indexed like data.
+    """
+
+    canonical = pd.DataFrame(
+        {col: _canonical_column(data[col]) for col in columns},
+        index=data.index)
+    return hash_pandas_object(canonical, index=False)
+
+
+def _canonical_column(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+
+    if is_datetime64_any_dtype(column.dtype):
+        return _datetime_ns(column)
+    if is_numeric_dtype(column.dtype) or is_bool_dtype(column.dtype):
+        return column.astype("float64")
+
+    sample = column.dropna()
+    if not sample.empty and isinstance(sample.iloc[0], (datetime.date, pd.Timestamp)):
+        return _datetime_ns(pd.to_datetime(column))
+
+    try:
+        return pd.to_numeric(column).astype("float64")
+    except (ValueError, TypeError):
+        return column.astype(object).where(column.notna(), None).astype(str)
+
+
+def _datetime_ns(column):
+    if getattr(column.dt, "tz", None) is not None:
+        column = column.dt.tz_convert(None)
+    return column.astype("datetime64[ns]").values.view("int64")
+
 flaggers.append(Duplicate())
@@ -1,5 +1,8 @@
 import abc
 from enum import IntEnum, auto
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype
 
 class Flags(IntEnum):
   ###################################################
@@ -44,17 +47,274 @@ class Flags(IntEnum):
   #Duplicate flag
   DUPLICATE = auto()
 
+  #Near duplicate flag
+  NEAR_DUPLICATE = auto()
+
+  #Bounds flags, for the columns bounded in assets/config.json. Bounding
+  #another column takes a new pair here and in flag_descriptions.
+  SERVICE_DATE_BELOW_MIN = auto()
+  SERVICE_DATE_ABOVE_MAX = auto()
+  VEHICLE_NUMBER_BELOW_MIN = auto()
+  VEHICLE_NUMBER_ABOVE_MAX = auto()
+  MAXIMUM_SPEED_BELOW_MIN = auto()
+  MAXIMUM_SPEED_ABOVE_MAX = auto()
+
 class Flagger(abc.ABC):
   # Name must be overwritten
   @property
   def name(self):
     raise NotImplementedError
 
+  # Whether the flagger gives the same result when the rows are split into
+  # vehicle days (see src/parallel) and flagged separately. Flaggers that
+  # compare rows of different vehicles or days must set this to False; they
+  # then always see the whole frame.
+  partitionable = True
+
   @abc.abstractmethod
   def flag(self, data):
     # Child classes must return a lit of flags.
     pass
 
+  def flag_frame(self, data, config):
+    # Batch interface used by the pipeline. data is the whole pandas.DataFrame
+    # being processed; this returns a dict mapping Flags to boolean numpy
+    # arrays with one entry per row of data.
+    # Flaggers that can work on whole columns should override this. The
+    # default falls back to calling flag() on every row, so flaggers that only
+    # implement flag() keep working.
+    masks = {}
+    for i, (_, row) in enumerate(data.iterrows()):
+      for flag in self.flag(row, config):
+        if flag not in masks:
+          masks[flag] = np.zeros(len(data.index), dtype=bool)
+        masks[flag][i] = True
+    return masks
+
+  def read_columns(self, config):
+    # The names of the columns of data that flag_frame() reads with this
+    # config. The pipeline only queries the columns its flaggers read, so
+    # flaggers should override this with what they actually use. The default,
+    # None, means any column may be read and every column is queried.
+    return None
+
+
+def float_values(column):
+  # column as a float64 numpy array with NaN for nulls and for values that are
+  # not numbers. column may hold Python objects with None for nulls or a
+  # pandas nullable dtype (Int32, Int16, ...) with pd.NA for nulls.
+  return pd.to_numeric(column, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def sort_key(data, name):
+  # The named column as float64 for sorting and grouping rows: numbers as they
+  # are and anything else (such as dates) by rank. Nulls are NaN. A missing
+  # column is all 0 so that it never splits rows apart.
+  if name not in data:
+    return np.zeros(len(data.index))
+  try:
+    if is_datetime64_any_dtype(data[name].dtype):
+      raise TypeError
+    return pd.to_numeric(data[name]).to_numpy(dtype=float, na_value=np.nan)
+  except (ValueError, TypeError):
+    codes = pd.factorize(data[name], sort=True)[0].astype(float)
+    codes[codes == -1] = np.nan
+    return codes
+
+
+class TripIndex:
+  # The frame sorted once by (service_date, vehicle_number, trip_id,
+  # arrive_time), with the offsets of every (service_date, vehicle_number,
+  # trip_id) group. Rows of group g are
+  # positions offsets[g]:offsets[g+1] of the sorted order. Group flaggers use
+  # this to look at neighbouring stops without sorting or grouping themselves.
+  # All per-row arrays returned here are in sorted order; unsort() maps a
+  # sorted mask back to the row order of the frame.
+
+  sort_columns = ['service_date', 'vehicle_number', 'trip_id', 'arrive_time']
+
+  def __init__(self, data):
+    self.data = data
+    self._columns = {}
+    date, vehicle, trip, arrive = [sort_key(data, col) for col in self.sort_columns]
+
+    # np.lexsort sorts by its last key first.
+    self.order = np.lexsort((arrive, trip, vehicle, date))
+    date, vehicle, trip = date[self.order], vehicle[self.order], trip[self.order]
+
+    n = len(self.order)
+    # Rows with a null service_date, vehicle_number or trip_id never join a
+    # group.
+    starts = np.flatnonzero((date[1:] != date[:-1])
+                            | (vehicle[1:] != vehicle[:-1])
+                            | (trip[1:] != trip[:-1])) + 1
+    self.offsets = np.concatenate(([0], starts, [n])) if n else np.zeros(1, dtype=np.int64)
+    self.group_ids = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+    self.group_starts = self.offsets[self.group_ids]
+
+  def column(self, name):
+    # The named column as float64 in sorted order; nulls and missing columns
+    # are NaN.
+    if name not in self._columns:
+      self._columns[name] = self._numeric(name)[self.order]
+    return self._columns[name]
+
+  def shift(self, name, periods=1):
+    # The value periods rows earlier in the same group, NaN if there is none.
+    values = self.column(name)
+    shifted = np.full(len(values), np.nan)
+    positions = np.arange(periods, len(values))
+    same = positions - periods >= self.group_starts[positions]
+    shifted[positions[same]] = values[positions[same] - periods]
+    return shifted
+
+  def diff(self, name, periods=1):
+    # The change from the value periods rows earlier in the same group.
+    return self.column(name) - self.shift(name, periods)
+
+  def cumsum(self, name):
+    # Running total within each group; nulls count as 0.
+    totals = self._running_totals(name)
+    return totals[1:] - totals[self.group_starts]
+
+  def rolling_sum(self, name, window):
+    # Sum of the last window values of each group, up to and including the
+    # current row; nulls count as 0.
+    totals = self._running_totals(name)
+    positions = np.arange(len(self.order))
+    window_starts = np.maximum(positions - window + 1, self.group_starts)
+    return totals[positions + 1] - totals[window_starts]
+
+  def unsort(self, sorted_mask):
+    mask = np.zeros(len(self.order), dtype=bool)
+    mask[self.order] = sorted_mask
+    return mask
+
+  def _running_totals(self, name):
+    return np.concatenate(([0.0], np.cumsum(np.nan_to_num(self.column(name)))))
+
+  def _numeric(self, name):
+    if name not in self.data:
+      return np.full(len(self.data.index), np.nan)
+    return float_values(self.data[name])
+
+
+class GroupFlagger(Flagger):
+  # A flagger that needs the context of a row's trip (previous stop, running
+  # totals, ...). Child classes implement flag_groups instead of flag.
+
+  @abc.abstractmethod
+  def flag_groups(self, index, config):
+    # index is a TripIndex. Child classes must return a dict mapping Flags to
+    # boolean numpy arrays in the index's sorted order.
+    pass
+
+  def flag(self, data, config):
+    # A single row has no trip context.
+    return []
+
+  def group_columns(self, config):
+    # The columns flag_groups() reads through the index, as for read_columns().
+    # Child classes override this instead of read_columns.
+    return None
+
+  def read_columns(self, config):
+    # The TripIndex always sorts and groups on its sort columns, so they are
+    # read along with the flagger's own columns.
+    columns = self.group_columns(config)
+    if columns is None:
+      return None
+    return list(columns) + [col for col in TripIndex.sort_columns if col not in columns]
+
+  def flag_frame(self, data, config, index=None):
+    # The pipeline passes one shared TripIndex to every group flagger; one is
+    # built here when flag_frame is called on its own.
+    if index is None:
+      index = TripIndex(data)
+    return {flag: index.unsort(np.asarray(mask, dtype=bool))
+            for flag, mask in self.flag_groups(index, config).items()}
+
+
+def unpack_bitmask(bits, bit_flags):
+  # bits is a numpy array of packed flags, one integer per row, where bit i
+  # stands for bit_flags[i]. This returns the flag_frame() form of bits: a
+  # dict mapping each flag that is set on at least one row to its boolean
+  # mask.
+  masks = {}
+  for i, flag in enumerate(bit_flags):
+    mask = ((bits >> i) & 1).astype(bool)
+    if mask.any():
+      masks[flag] = mask
+  return masks
+
+
+# Override keys in increasing order of precedence: a route-wide override is
+# replaced by a stop override, which is replaced by a route-and-stop override.
+_override_keys = (
+  ("route_number",),
+  ("location_id",),
+  ("route_number", "location_id"),
+)
+
+def threshold_values(data, config, name, default):
+  # Returns a float numpy array holding the threshold called name for every row
+  # of data. The base value is config's name (or default if unset). Rows are
+  # then matched against config's "threshold_overrides", a list of
+  # {"route_number", "location_id", "name", "value"} records where either key
+  # may be left out, with a left merge per key combination.
+  base = config.get_value(name)
+  if base is None:
+    base = default
+  thresholds = np.full(len(data.index), float(base))
+
+  overrides = config.get_value("threshold_overrides")
+  if not overrides:
+    return thresholds
+
+  table = pd.DataFrame(overrides, columns=["route_number", "location_id", "name", "value"])
+  table = table[table["name"] == name]
+  for keys in _override_keys:
+    keys = list(keys)
+    if not set(keys).issubset(data.columns):
+      continue
+    other_keys = [k for k in ("route_number", "location_id") if k not in keys]
+    rows = table[table[keys].notna().all(axis=1) & table[other_keys].isna().all(axis=1)]
+    if rows.empty:
+      continue
+
+    # Keys that are not numbers would match rows with null keys, so they are
+    # dropped; invalid_overrides() reports them.
+    rows = rows[keys + ["value"]].apply(pd.to_numeric, errors="coerce")
+    rows = rows.dropna(subset=keys).drop_duplicates(keys, keep="last")
+    left = pd.DataFrame({key: float_values(data[key]) for key in keys})
+    values = left.merge(rows, how="left", on=keys)["value"].values
+    matched = ~np.isnan(values)
+    thresholds[matched] = values[matched]
+
+  return thresholds
+
+
+def invalid_overrides(config):
+  # The "threshold_overrides" records threshold_values() skips: those whose
+  # route_number or location_id is given but is not a number, or whose value
+  # is not a number.
+  invalid = []
+  for override in config.get_value("threshold_overrides") or []:
+    keys = [override.get(key) for key in ("route_number", "location_id")]
+    numbers = [pd.to_numeric(v, errors="coerce") for v in keys if not pd.isna(v)]
+    numbers.append(pd.to_numeric(override.get("value"), errors="coerce"))
+    if any(pd.isna(number) for number in numbers):
+      invalid.append(override)
+  return invalid
+
+
+def threshold_columns(config):
+  # The columns threshold_values() reads with this config: the override keys,
+  # if there are any overrides.
+  if not config.get_value("threshold_overrides"):
+    return []
+  return ["route_number", "location_id"]
+
 
 class FlagInfo:
     def __init__(self, name="", desc=""):
@@ -93,6 +353,19 @@ flag_descriptions = {
   Flags.UNOBSERVED_STOP: FlagInfo("unobserved-stop", "UNOBSERVED_STOP"),
   Flags.UNOPENED_DOOR: FlagInfo("unopened-door", "UNOPENED_DOOR"),
   Flags.DUPLICATE: FlagInfo("duplicate", "DUPLICATE"),
+  Flags.NEAR_DUPLICATE: FlagInfo("near-duplicate", "NEAR_DUPLICATE"),
+  Flags.SERVICE_DATE_BELOW_MIN: FlagInfo("min-service-date", "SERVICE_DATE_BELOW_MIN"),
+  Flags.SERVICE_DATE_ABOVE_MAX: FlagInfo("max-service-date", "SERVICE_DATE_ABOVE_MAX"),
+  Flags.VEHICLE_NUMBER_BELOW_MIN: FlagInfo("min-vehicle-number", "VEHICLE_NUMBER_BELOW_MIN"),
+  Flags.VEHICLE_NUMBER_ABOVE_MAX: FlagInfo("max-vehicle-number", "VEHICLE_NUMBER_ABOVE_MAX"),
+  Flags.MAXIMUM_SPEED_BELOW_MIN: FlagInfo("min-maximum-speed", "MAXIMUM_SPEED_BELOW_MIN"),
+  Flags.MAXIMUM_SPEED_ABOVE_MAX: FlagInfo("max-maximum-speed", "MAXIMUM_SPEED_ABOVE_MAX"),
 }
 
+
+def flag_rows():
+  # The Flags members as [flag_id, description, name] rows for the flags table.
+  return [[flag.value, flag_descriptions[flag].desc, flag_descriptions[flag].name]
+          for flag in Flags]
+
 flaggers = []
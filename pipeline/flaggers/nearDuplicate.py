@@ -0,0 +1,77 @@
+from .flagger import Flagger, Flags, flaggers, float_values, sort_key
+import numpy as np
+
+#Class that implements near duplicate check:
+#That is the same vehicle reporting the same stop of the same trip twice, a few seconds apart.
+class NearDuplicate(Flagger):
+	name = 'Near Duplicate'
+
+	# service_date is optional; arrive_time only compares within a day.
+	sort_columns = ['service_date', 'vehicle_number', 'trip_id', 'location_id', 'arrive_time']
+	required_columns = ['vehicle_number', 'trip_id', 'location_id', 'arrive_time', 'location_distance']
+
+	def flag(self, data, config):
+		"""
+		A single row cannot be a near duplicate on its own, see flag_frame().
+
+		Returns:
+			list: always empty
+		"""
+
+		return []
+
+	def flag_frame(self, data, config):
+		"""
+		Flags rows with the same service_date, vehicle_number, trip_id and location_id whose
+		arrive_time is at most "near_duplicate_seconds" apart (default 10) and
+		whose location_distance is at most "near_duplicate_feet" apart
+		(default 20). Both rows of such a pair are flagged.
+
+		The frame is sorted once by (service_date, vehicle_number, trip_id,
+		location_id, arrive_time), which puts the closest candidate for every row right
+		next to it, so only adjacent rows have to be compared.
+
+		Args:
+			data (pandas.DataFrame): rows fetched from the db
+			config (Object): contains config vars
+
+		Returns:
+			dict: Flags.NEAR_DUPLICATE mapped to a boolean numpy array
+		"""
+
+		if not set(self.required_columns).issubset(data.columns):
+			return {}
+
+		max_seconds = config.get_value("near_duplicate_seconds")
+		if max_seconds is None: max_seconds = 10
+		max_feet = config.get_value("near_duplicate_feet")
+		if max_feet is None: max_feet = 20
+
+		keys = [sort_key(data, col) for col in self.sort_columns]
+		distance = float_values(data['location_distance'])
+
+		# np.lexsort sorts by its last key first.
+		order = np.lexsort(keys[::-1])
+		date, vehicle, trip, location, arrive = [key[order] for key in keys]
+		distance = distance[order]
+
+		# NaN never compares equal, so rows with null keys are never paired.
+		pair = ((date[1:] == date[:-1])
+				& (vehicle[1:] == vehicle[:-1])
+				& (trip[1:] == trip[:-1])
+				& (location[1:] == location[:-1])
+				& (arrive[1:] - arrive[:-1] <= max_seconds)
+				& (np.abs(distance[1:] - distance[:-1]) <= max_feet))
+
+		sorted_mask = np.zeros(len(data.index), dtype=bool)
+		sorted_mask[1:] |= pair
+		sorted_mask[:-1] |= pair
+
+		mask = np.zeros(len(data.index), dtype=bool)
+		mask[order] = sorted_mask
+		return {Flags.NEAR_DUPLICATE: mask}
+
+	def read_columns(self, config):
+		return self.sort_columns + ['location_distance']
+
+flaggers.append(NearDuplicate())
@@ -1,4 +1,5 @@
-from .flagger import Flagger, Flags, flaggers
+from .flagger import Flagger, Flags, flaggers, unpack_bitmask
+import numpy as np
 import pandas as pd
 
 #data is a row of data from the db: parsed JSON
@@ -34,6 +35,9 @@ class Null(Flagger):
     'trip_id' : Flags.TRIP_ID_NULL
   }
 
+  # Bit i of a null bitmask is set when the column of bit_flags[i] is null.
+  bit_flags = tuple(columns_flag_dict.values())
+
   def flag(self, data, config):
     #all null flags will be appended to the list
     null_flags = []
@@ -42,5 +46,34 @@ class Null(Flagger):
         null_flags.append(self.columns_flag_dict[col])
 
     return null_flags
+
+  def read_columns(self, config):
+    return list(self.columns_flag_dict)
+
+  def flag_frame(self, data, config):
+    return unpack_bitmask(self.null_bitmask(data), self.bit_flags)
+
+  def null_bitmask(self, data):
+    """
+    Computes every null flag of every row at once.
+
+    Args:
+      data (pandas.DataFrame): the rows to check. Columns of
+          columns_flag_dict that are missing from data are never flagged.
+
+    Returns:
+      numpy.ndarray: one uint32 per row of data, with bit i set when the
+          column of bit_flags[i] is null (None, NaN or NaT) in that row.
+    """
+
+    bits = np.zeros(len(data.index), dtype=np.uint32)
+    cols = list(self.columns_flag_dict)
+    positions = [i for i, col in enumerate(cols) if col in data]
+    if not positions:
+      return bits
+
+    weights = np.left_shift(np.uint32(1), np.array(positions, dtype=np.uint32))
+    is_null = data[[cols[i] for i in positions]].isna().values
+    return np.bitwise_or.reduce(is_null * weights, axis=1).astype(np.uint32)
      
 flaggers.append(Null())
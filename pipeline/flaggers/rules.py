@@ -0,0 +1,231 @@
+import ast
+import functools
+import numpy as np
+import pandas as pd
+
+from .flagger import Flagger, flaggers, float_values
+from .null import Null
+
+# Rule flag_ids start here so they never collide with the Flags enum.
+RULE_FLAG_ID_START = 1000
+
+# Columns a rule may reference. service_date and service_key are not numbers.
+rule_columns = [col for col in Null.columns_flag_dict
+                if col not in ('service_date', 'service_key')]
+
+_bool_ops = {ast.And: np.logical_and, ast.Or: np.logical_or}
+_compare_ops = {
+  ast.Eq: np.equal,
+  ast.NotEq: np.not_equal,
+  ast.Lt: np.less,
+  ast.LtE: np.less_equal,
+  ast.Gt: np.greater,
+  ast.GtE: np.greater_equal,
+}
+_arith_ops = {
+  ast.Add: np.add,
+  ast.Sub: np.subtract,
+  ast.Mult: np.multiply,
+  ast.Div: np.true_divide,
+  ast.Mod: np.mod,
+}
+
+
+class Rule:
+  def __init__(self, flag_id, name, description, expression):
+    self.flag_id = flag_id
+    self.name = name
+    self.description = description
+    self.expression = expression
+    self.evaluate, self.columns = compile_rule(expression)
+
+
+#Class that implements the flag rules declared in config's "rules" list.
+class Rules(Flagger):
+  name = 'Rules'
+
+  def __init__(self):
+    self.rules = None
+
+  def load(self, config):
+    """
+    Parses, validates and compiles every rule in config's "rules" list. Each
+    rule is {"flag_id", "name", "expression"} plus an optional "description",
+    e.g. {"flag_id": 1000, "name": "long-closed-dwell",
+    "expression": "dwell > 600 and door == 0"}.
+
+    Args:
+      config (Object): contains config vars
+
+    Raises:
+      ValueError: when a rule is malformed; no rules are loaded.
+    """
+
+    rules = []
+    flag_ids = set()
+    for entry in config.get_value("rules") or []:
+      try:
+        flag_id = int(entry["flag_id"])
+        name = str(entry["name"])
+        expression = str(entry["expression"])
+      except (KeyError, TypeError, ValueError):
+        raise ValueError("Rules need an integer flag_id, a name and an expression: {}".format(entry))
+
+      if flag_id < RULE_FLAG_ID_START or flag_id in flag_ids:
+        raise ValueError("Rule {} needs a unique flag_id of at least {}.".format(name, RULE_FLAG_ID_START))
+      if not name or len(name) > 30:
+        raise ValueError("Rule names must be 1 to 30 characters long: {}".format(name))
+
+      description = str(entry.get("description", expression))[:200]
+      rules.append(Rule(flag_id, name, description, expression))
+      flag_ids.add(flag_id)
+
+    self.rules = rules
+
+  def flag(self, data, config):
+    return [flag for flag, mask in self.flag_frame(pd.DataFrame([data]), config).items()
+            if mask[0]]
+
+  def flag_frame(self, data, config):
+    """
+    Evaluates every rule over the whole frame.
+
+    Returns:
+      dict: each rule's flag_id mapped to a boolean numpy array
+    """
+
+    if self.rules is None:
+      self.load(config)
+
+    columns = {}
+    for rule in self.rules:
+      for col in rule.columns:
+        if col not in columns:
+          columns[col] = _numeric_column(data, col)
+
+    return {rule.flag_id: rule.evaluate(columns) for rule in self.rules}
+
+  def read_columns(self, config):
+    if self.rules is None:
+      self.load(config)
+    return sorted(set(col for rule in self.rules for col in rule.columns))
+
+  def flag_rows(self):
+    # The rules as [flag_id, description, name] rows for the flags table.
+    return [[rule.flag_id, rule.description, rule.name] for rule in self.rules or []]
+
+
+def compile_rule(expression):
+  """
+  Compiles a rule expression into a function over whole columns.
+
+  Expressions are Python syntax limited to column names, numbers, + - * / %,
+  comparisons, and, or and not, e.g. "dwell > 600 and door == 0". A
+  comparison involving a null is false.
+
+  Args:
+    expression (String): the rule to compile.
+
+  Returns:
+    (function, list): the evaluator, which takes a dict of column name to
+        float numpy array and returns a boolean numpy array, and the names
+        of the columns it reads.
+
+  Raises:
+    ValueError: when the expression is not a valid rule.
+  """
+
+  try:
+    tree = ast.parse(expression, mode="eval")
+  except SyntaxError as err:
+    raise ValueError("Rule \"{}\" is not valid: {}".format(expression, err.msg))
+
+  names = set()
+  evaluate, is_bool = _compile(tree.body, names, expression)
+  if not is_bool:
+    raise ValueError("Rule \"{}\" must be a condition.".format(expression))
+  if not names:
+    raise ValueError("Rule \"{}\" must use at least one column.".format(expression))
+  return evaluate, sorted(names)
+
+
+# Returns (function, is_bool) for node, collecting column names into names.
+def _compile(node, names, expression):
+  if isinstance(node, ast.BoolOp):
+    op = _bool_ops[type(node.op)]
+    parts = [_compile_bool(value, names, expression) for value in node.values]
+    return (lambda cols: functools.reduce(op, [part(cols) for part in parts])), True
+
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+    part = _compile_bool(node.operand, names, expression)
+    return (lambda cols: np.logical_not(part(cols))), True
+
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+    part = _compile_number(node.operand, names, expression)
+    return (lambda cols: np.negative(part(cols))), False
+
+  if isinstance(node, ast.Compare):
+    operands = [_compile_number(value, names, expression)
+                for value in [node.left] + node.comparators]
+    ops = []
+    for op in node.ops:
+      if type(op) not in _compare_ops:
+        raise ValueError("Rule \"{}\" uses an unsupported comparison.".format(expression))
+      ops.append(_compare_ops[type(op)])
+
+    def compare(cols):
+      values = [operand(cols) for operand in operands]
+      result = True
+      for op, left, right in zip(ops, values[:-1], values[1:]):
+        with np.errstate(invalid='ignore'):
+          result = result & op(left, right) & ~np.isnan(left) & ~np.isnan(right)
+      return result
+    return compare, True
+
+  if isinstance(node, ast.BinOp) and type(node.op) in _arith_ops:
+    op = _arith_ops[type(node.op)]
+    left = _compile_number(node.left, names, expression)
+    right = _compile_number(node.right, names, expression)
+    def arith(cols):
+      with np.errstate(divide='ignore', invalid='ignore'):
+        return op(left(cols), right(cols))
+    return arith, False
+
+  if isinstance(node, ast.Name):
+    if node.id not in rule_columns:
+      raise ValueError("Rule \"{}\" uses unknown column {}.".format(expression, node.id))
+    names.add(node.id)
+    return (lambda cols: cols[node.id]), False
+
+  # Python 3.7 parses numbers as ast.Num rather than ast.Constant.
+  if isinstance(node, ast.Constant) or type(node).__name__ == 'Num':
+    value = node.value if isinstance(node, ast.Constant) else node.n
+    if type(value) in (int, float):
+      value = float(value)
+      return (lambda cols: value), False
+
+  raise ValueError("Rule \"{}\" uses unsupported syntax.".format(expression))
+
+
+def _compile_bool(node, names, expression):
+  part, is_bool = _compile(node, names, expression)
+  if not is_bool:
+    raise ValueError("Rule \"{}\" combines a value where a condition is needed.".format(expression))
+  return part
+
+
+def _compile_number(node, names, expression):
+  part, is_bool = _compile(node, names, expression)
+  if is_bool:
+    raise ValueError("Rule \"{}\" compares a condition where a value is needed.".format(expression))
+  return part
+
+
+def _numeric_column(data, col):
+  if col not in data:
+    return np.full(len(data.index), np.nan)
+  return float_values(data[col])
+
+
+rules_flagger = Rules()
+flaggers.append(rules_flagger)
@@ -1,4 +1,5 @@
-from .flagger import Flagger, Flags, flaggers
+from .flagger import Flagger, Flags, flaggers, float_values, threshold_columns, threshold_values
+import pandas as pd
 
 #Class that implements unobserved stop check:
 #That is is bus stops at a certain distance away from the stop, we mark it as an unobserved stop.
@@ -13,6 +14,8 @@ class UnobservedStop(Flagger):
 							BDS and the location of the scheduled stop. The unit
 							of the measure is feet and the number is stored as a
 							floating-point value.
+		The row is checked by flag_frame(), so it uses the same threshold and
+		overrides.
 
 		Args:
 			data (Object): data row from full dataset fetched from the db
@@ -23,15 +26,33 @@ class UnobservedStop(Flagger):
 
 		"""
 
-		#maxDistance specifies max distance away from the stop at which we start marking stop as an unobserved
-		max_distance = config.get_value("unobserved_stop_distance")
-		if max_distance == None: max_distance = 50
+		return [flag for flag, mask in self.flag_frame(pd.DataFrame([data]), config).items()
+				if mask[0]]
 
-		flag = []
+	def flag_frame(self, data, config):
+		"""
+		Batch version of flag(). The distance threshold can be overridden per
+		route and/or stop through config's "threshold_overrides" under the name
+		"unobserved_stop_distance".
+
+		Args:
+			data (pandas.DataFrame): rows fetched from the db
+			config (Object): contains config vars
+
+		Returns:
+			dict: Flags.UNOBSERVED_STOP mapped to a boolean numpy array
+		"""
+
+		if 'location_distance' not in data:
+			return {}
+
+		max_distance = threshold_values(data, config, "unobserved_stop_distance", 50)
+		distance = float_values(data['location_distance'])
 
-		if ('location_distance' in data) and (data['location_distance'] != None) and (data['location_distance'] > max_distance):
-			flag.append(Flags.UNOBSERVED_STOP);
+		# NaN compares False, so null distances are left to the Null flagger.
+		return {Flags.UNOBSERVED_STOP: distance > max_distance}
 
-		return flag
+	def read_columns(self, config):
+		return ['location_distance'] + threshold_columns(config)
 
 flaggers.append(UnobservedStop())
\ No newline at end of file
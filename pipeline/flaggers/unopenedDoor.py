@@ -1,4 +1,5 @@
-from .flagger import Flagger, Flags, flaggers
+from .flagger import Flagger, Flags, flaggers, float_values, threshold_columns, threshold_values
+import pandas as pd
 
 #Class that implements unopened door check:
 #That is if the bus stopped but door hasn't been opened
@@ -10,19 +11,44 @@ class UnopenedDoor(Flagger):
 		Checks if bus had stopped but door haven't opened (perhaps no passengers getting on/off?).
 		To check, we check door field:
 		door: The number of times the door was opened at the stop.
+		The row is checked by flag_frame(), so it uses the same threshold and
+		overrides.
 
 		Args:
 			data (Object): data row from full dataset fetched from the db
+			config (Object): contains config vars
 
 		Returns: 
 			list: either empty or containing UNOPENED_DOOR Flag
 		"""
 
-		flag = []
+		return [flag for flag, mask in self.flag_frame(pd.DataFrame([data]), config).items()
+				if mask[0]]
 
-		if('door' in data) and (data['door'] == 0):
-			flag.append(Flags.UNOPENED_DOOR)
+	def flag_frame(self, data, config):
+		"""
+		Batch version of flag(). A stop is flagged when the door opened fewer
+		than "unopened_door_min_openings" times (1 unless set). Setting it to 0
+		through config's "threshold_overrides" for a route and/or stop turns the
+		flag off there, e.g. for timepoints that are not served.
+
+		Args:
+			data (pandas.DataFrame): rows fetched from the db
+			config (Object): contains config vars
+
+		Returns:
+			dict: Flags.UNOPENED_DOOR mapped to a boolean numpy array
+		"""
+
+		if 'door' not in data:
+			return {}
+
+		min_openings = threshold_values(data, config, "unopened_door_min_openings", 1)
+		door = float_values(data['door'])
+
+		return {Flags.UNOPENED_DOOR: door < min_openings}
 
-		return flag
+	def read_columns(self, config):
+		return ['door'] + threshold_columns(config)
 
 flaggers.append(UnopenedDoor())
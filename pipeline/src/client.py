@@ -1,22 +1,32 @@
 import os
 import sys
+import time
 from collections import namedtuple
 from datetime import datetime
 from datetime import timedelta
+import numpy as np
+import pandas
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from progress.bar import Bar
 
 from src.ios import ios
 from src.tables import CTran_Data
+from src.tables import CTran_Files
 from src.tables import Flagged_Data
 from src.tables import Flags
 from src.tables import Service_Periods
+from src.tables import Fingerprints
+from src.tables import ReadGovernor
+from src.tables import DayCache
 from src.config import config
 from src.restarter import restarter
 from src.interface import ArgInterface
-from flaggers.flagger import flaggers, FlagInfo
+from src.parallel import flag_partitions, flagging_pool, merge_masks, run_flaggers
+from flaggers.flagger import flaggers, flag_rows, invalid_overrides, FlagInfo
 from flaggers.flagger import Flags as flag_enums
+from flaggers.duplicate import fingerprint, key_columns
+from flaggers.rules import rules_flagger
 
 
 class _Option():
@@ -44,11 +54,14 @@ class _Client():
         self._ios = ios
         self._ios.log_and_print("The client is starting initialization.")
         self._flag_lookup = None
+        self._flagging_pool = None
         self.config = config
         self.config.load(read_env_data=read_env_data)
 
         self._output_path = config.get_value("output_path")
         self._output_type = config.get_value("output_type")
+        self._load_rules()
+        self._check_overrides()
 
         portal_user = config.get_value("portal_user")
         portal_passwd = config.get_value("portal_passwd")
@@ -64,6 +77,20 @@ class _Client():
             print("Please enter credentials for Portals database with the C-Tran table.")
             self.ctran = CTran_Data()
         self._portal_engine = self.ctran.get_engine()
+        self.ctran.set_typed(config.get_value("typed_ingestion"))
+        read_backend = config.get_value("read_backend") or "sql"
+        if not self.ctran.set_reader(read_backend):
+            self._ios.log_and_print(
+                "Unknown read_backend {}, using sql.".format(read_backend),
+                self._ios.Severity.WARNING)
+        self.ctran.set_governor(self._build_read_governor())
+        self.ctran.set_replicas(config.get_value("portal_replicas"))
+        self._day_cache = self._build_day_cache()
+        self.ctran.set_day_cache(self._day_cache)
+        self._files = None
+        if config.get_value("source_path"):
+            self._files = CTran_Files(
+                config.get_value("source_path"), self.ctran, config.get_value("parallel_readers"))
         pipe_user = config.get_value("pipeline_user")
         pipe_passwd = config.get_value("pipeline_passwd")
         pipe_hostname = config.get_value("pipeline_hostname")
@@ -76,6 +103,8 @@ class _Client():
                 engine_url = self._hive_engine.url
                 self.flags = Flags(schema=pipe_schema, engine=engine_url)
                 self.service_periods = Service_Periods(schema=pipe_schema, engine=engine_url)
+                self.fingerprints = Fingerprints(schema=pipe_schema, engine=engine_url)
+                self.flagged.set_replicas(config.get_value("pipeline_replicas"))
                 self._ios.log_and_print("The client has finished initializing.")
                 return
             else:
@@ -88,6 +117,8 @@ class _Client():
         engine_url = self._hive_engine.url
         self.flags = Flags(engine=engine_url)
         self.service_periods = Service_Periods(engine=engine_url)
+        self.fingerprints = Fingerprints(engine=engine_url)
+        self.flagged.set_replicas(config.get_value("pipeline_replicas"))
         self._ios.log_and_print("The client has finished initializing.")
 
     #######################################################
@@ -129,50 +160,50 @@ class _Client():
         self.flags.create_table()
         self.service_periods.create_table()
         self.flagged.create_table()
+        self.fingerprints.create_table()
+        self._register_flags()
 
     ###########################################################
 
     # Process data between start_date and end_date, inclusive. These parameters
     # can be Date instances or strings in format "YYYY/MM/DD". If no dates are
-    # supplied, this will prompt the user for them.
+    # supplied, this will prompt the user for them. With "chunk_rows" or
+    # "parallel_readers" set, the range is read, flagged, and written a chunk
+    # at a time instead of whole. With "source_path" set, the range is read
+    # whole from the extract files there instead of from ctran_data. With
+    # "backfill_mode" set, flagged_data's foreign keys and secondary indexes
+    # are dropped for the run and rebuilt after it (see _begin_backfill()).
+    # With "flagging_workers" above 1, the worker processes are started once,
+    # before anything is read, and flag every chunk of the run.
     def process_data(self, start_date=None, end_date=None, restart=False):
         self._ios.log_and_print("Starting data processing pipeline.")
-        ctran_df = self._build_ctran_df(start_date, end_date)
-        if ctran_df is None:
+        if not self._begin_backfill():
             return False
-        flagged_rows = []
-        skipped_rows = 0
-        csv_service_keys = []
-        duplicate = None
-
-        self._ios.log_and_print("Processing the queried data.")
-        progress_bar = Bar("", max=len(ctran_df.index))
-        for row_id, row in ctran_df.iterrows():
-
-            self._csv_update(csv_service_keys, row)
-            service_key = self.service_periods.query_or_insert(row.service_date)
-            self._should_pipeline_restart(restart, skipped_rows)
+        self._start_flagging_pool()
+        try:
+            return self._process_data(start_date, end_date, restart)
+        finally:
+            self._stop_flagging_pool()
+            self._end_backfill()
 
-            # If this fails, it's very likely a sqlalchemy error.
-            if not service_key:
-                self._ios.log_and_print(
-                    "Cannot find or create new service_key, skipping.",
-                    self._ios.Severity.WARNING)
-                skipped_rows +=1
-                continue
+    ###########################################################
 
-            flags = set()
-            for flagger in flaggers:
-                result = self._flag_row(flagger, row, flags)
-                if result is not None:
-                    duplicate = result
+    # Helper to process_data()
+    def _process_data(self, start_date, end_date, restart):
+        readers = config.get_value("parallel_readers")
+        if self._files is None and (config.get_value("chunk_rows") or (readers and readers > 1)):
+            return self._process_chunks(start_date, end_date, restart)
 
-            self._updated_flagged_rows(flags, flagged_rows, row, row_id, service_key)
-            progress_bar.next()
+        ctran_df = self._build_ctran_df(start_date, end_date)
+        if ctran_df is None:
+            return False
 
-        progress_bar.finish()
-        self._check_duplicated_rows(flagged_rows, duplicate, ctran_df)
-        self._save_output(flagged_rows, csv_service_keys)
+        self._ios.log_and_print("Processing the queried data.")
+        flagged_rows, _, failed_dates = self._process_frame(ctran_df, restart)
+        self._save_csv(flagged_rows, self._csv_service_dates(ctran_df))
+        if failed_dates:
+            self._report_failed_dates(failed_dates)
+            return False
         self._ios.log_and_print("Done executing the pipeline.")
         return True
 
@@ -229,13 +260,16 @@ class _Client():
             start_date = datetime.min
         if end_date is None:
             end_date = datetime.max
+        if not self._delete_fingerprints(start_date, end_date):
+            return False
         return self.flagged.delete_date_range(start_date, end_date)
 
     ###########################################################
 
     def reprocess(self, start_date=None, end_date=None):
         start_date, end_date = self._get_date_range(start_date, end_date)
-        if not self.flagged.delete_date_range(start_date, end_date):
+        if not self._delete_fingerprints(start_date, end_date) or \
+                not self.flagged.delete_date_range(start_date, end_date):
             msg = "".join([
                 "An error occured while attempting to delete the data in the ",
                 "supplied range [", str(start_date), ", ", str(end_date), "]. ",
@@ -252,6 +286,87 @@ class _Client():
 
     ###########################################################
 
+    # The portal database is shared with production reporting, so reads from
+    # it can be throttled with the "portal_max_rows_per_second",
+    # "portal_max_concurrent_queries", "portal_statement_timeout" (ms) and
+    # "portal_adaptive_reads" settings. Returns None if none are set.
+    def _build_read_governor(self):
+        max_rows_per_second = config.get_value("portal_max_rows_per_second")
+        max_concurrent = config.get_value("portal_max_concurrent_queries")
+        statement_timeout = config.get_value("portal_statement_timeout")
+        adaptive = config.get_value("portal_adaptive_reads")
+        if not (max_rows_per_second or max_concurrent or statement_timeout or adaptive):
+            return None
+        return ReadGovernor(max_rows_per_second, max_concurrent, statement_timeout, adaptive)
+
+    ###########################################################
+
+    # Portal days can be cached locally, in "day_cache_path", up to
+    # "day_cache_max_mb" megabytes. Returns None if the cache is off (0) or
+    # pyarrow, which it needs, is not installed.
+    def _build_day_cache(self):
+        max_mb = config.get_value("day_cache_max_mb")
+        if not max_mb:
+            return None
+        if not DayCache.available():
+            self._ios.log_and_print(
+                "day_cache_max_mb is set, but pyarrow is not installed; not caching days.",
+                self._ios.Severity.WARNING)
+            return None
+        return DayCache(config.get_value("day_cache_path"), int(max_mb * 1024 * 1024))
+
+    ###########################################################
+
+    # Deletes the cached portal days from start_date to end_date, so they are
+    # read from the portal again, e.g. after ctran_data was corrected. Empty
+    # dates, when prompted, stand for the beginning and end of time. Returns
+    # the number of days deleted, or False if there is no day cache.
+    def invalidate_day_cache(self, start_date=None, end_date=None):
+        if self._day_cache is None:
+            self._ios.log_and_print("There is no day cache to invalidate.", self._ios.Severity.WARNING)
+            return False
+        if start_date is None:
+            self._ios.print(
+                "Please input a date range. Empty fields are treated as the"\
+                " beginning or end of time. Dates are INCLUSIVE.")
+        start_date, end_date = self._get_date_range(start_date, end_date, allow_empty=True)
+        deleted = self._day_cache.invalidate(start_date, end_date)
+        self._ios.log_and_print("Deleted {} cached days.".format(deleted))
+        return deleted
+
+    ###########################################################
+
+    # Compiles the flag rules of the config once, at startup. Invalid rules
+    # are logged and disable every rule rather than stopping the pipeline.
+    def _load_rules(self):
+        try:
+            rules_flagger.load(config)
+        except ValueError as err:
+            self._ios.log_and_print(
+                "Invalid flag rule, rules are disabled.\n{}".format(err),
+                self._ios.Severity.ERROR)
+            rules_flagger.rules = []
+
+    ###########################################################
+
+    # Threshold overrides with keys or values that are not numbers are
+    # skipped by the flaggers; they are logged once, at startup.
+    def _check_overrides(self):
+        for override in invalid_overrides(config):
+            self._ios.log_and_print(
+                "Invalid threshold override, skipping it: {}".format(override),
+                self._ios.Severity.WARNING)
+
+    ###########################################################
+
+    # The Flags enum and the rule flags are added to the flags table whenever
+    # they may be referenced by flagged_data, so flags added since the table
+    # was created are there before the first write. Existing flags are kept.
+    def _register_flags(self):
+        self.flags.write_table(flag_rows() + rules_flagger.flag_rows(), update=False)
+
+    ###########################################################
+
     def lookup_flag_id(self, flag_name):
         if self._flag_lookup is None:
             self._init_flag_dict()
@@ -302,7 +417,8 @@ class _Client():
     # parent just needs to exit.
     def _build_ctran_df(self, start_date, end_date):
         start_date, end_date = self._get_date_range(start_date, end_date)
-        ctran_df = self.ctran.query_date_range(start_date, end_date)
+        source = self.ctran if self._files is None else self._files
+        ctran_df = source.query_date_range(start_date, end_date, self._read_columns())
         if ctran_df is None or ctran_df.empty:
             self._ios.log_and_print(
                 "The supplied dates were unable to be gathered from CTran data.",
@@ -313,10 +429,71 @@ class _Client():
     #######################################################
 
     # Helper to process_data()
-    def _csv_update(self, csv_service_keys, row):
+    # The flaggers enabled by config's "enabled_flaggers", a list of flagger
+    # names; every flagger if it is unset or empty.
+    def _enabled_flaggers(self):
+        names = config.get_value("enabled_flaggers")
+        if not names:
+            return list(flaggers)
+        return [flagger for flagger in flaggers if flagger.name in names]
+
+    #######################################################
+
+    # Helper to process_data()
+    # The ctran_data columns the pipeline needs: those read by the enabled
+    # flaggers and the cross-day duplicate check, plus service_date and
+    # vehicle_number, which rows are keyed, partitioned and chunked on. None
+    # means every column is needed.
+    def _read_columns(self):
+        columns = set(["service_date", "vehicle_number"])
+        for flagger in self._enabled_flaggers():
+            needed = flagger.read_columns(config)
+            if needed is None:
+                return None
+            columns.update(needed)
+
+        if config.get_value("cross_day_duplicates"):
+            needed = config.get_value("duplicate_key_columns")
+            if not needed:
+                return None
+            columns.update(needed)
+
+        self._ios.log_and_print(
+            "Reading {} columns: {}".format(len(columns), ", ".join(sorted(columns))))
+        return sorted(columns)
+
+    #######################################################
+
+    # Helper to process_data()
+    # Returns the distinct service dates in ctran_df if csv output is enabled.
+    def _csv_service_dates(self, ctran_df):
         if self._output_type == "csv" or self._output_type == "both":
-            if not row.service_date in csv_service_keys:
-                csv_service_keys.append(row.service_date)
+            return ctran_df["service_date"].dropna().drop_duplicates().tolist()
+        return []
+
+    #######################################################
+
+    # Helper to process_data()
+    # Service keys are looked up once per distinct service date rather than
+    # once per row. This returns: service_keys, date_codes, skipped_rows
+    # where service_keys[date_codes[i]] is the service key of row i. Rows
+    # whose service_key could not be found or created have a date code of -1.
+    def _build_service_keys(self, ctran_df):
+        date_codes, dates = pandas.factorize(ctran_df["service_date"])
+        service_keys = []
+        for i, date in enumerate(dates):
+            service_key = self.service_periods.query_or_insert(date)
+
+            # If this fails, it's very likely a sqlalchemy error.
+            if not service_key:
+                self._ios.log_and_print(
+                    "Cannot find or create new service_key for {}, skipping.".format(date),
+                    self._ios.Severity.WARNING)
+                date_codes[date_codes == i] = -1
+            service_keys.append(service_key)
+
+        skipped_rows = int(np.count_nonzero(date_codes == -1))
+        return service_keys, date_codes, skipped_rows
 
     #######################################################
 
@@ -340,98 +517,361 @@ class _Client():
     #######################################################
 
     # Helper to process_data()
-    def _flag_row(self, flagger, row, flags):
-        duplicate = None
+    # Runs every enabled flagger over ctran_df and returns the OR of their
+    # masks. With "flagging_workers" above 1, partitionable flaggers run in
+    # that many worker processes; otherwise, or for debugging, everything runs
+    # here.
+    def _flag_rows(self, ctran_df):
+        enabled = self._enabled_flaggers()
+        workers = config.get_value("flagging_workers")
+        if not workers or workers <= 1:
+            progress_bar = Bar("", max=len(enabled))
+            flag_masks, errors = run_flaggers(enabled, ctran_df, config, progress_bar)
+            progress_bar.finish()
+            self._log_flagger_errors(errors)
+            return flag_masks
+
+        whole = [flagger for flagger in enabled if not flagger.partitionable]
+
+        self._ios.log_and_print(
+            "Flagging with {} worker processes.".format(workers))
+        partitions_per_worker = config.get_value("partitions_per_worker") or 4
+        progress_bar = Bar("")
+        flag_masks, errors = flag_partitions(
+            ctran_df, self._partitioned_flagger_ids(), config, workers,
+            partitions_per_worker, progress_bar, self._flagging_pool)
+        progress_bar.finish()
+        self._log_flagger_errors(errors)
+
+        whole_masks, errors = run_flaggers(whole, ctran_df, config)
+        self._log_flagger_errors(errors)
+        merge_masks(flag_masks, whole_masks)
+        return flag_masks
+
+    #######################################################
+
+    # Helper to _flag_rows()
+    # The positions in the flaggers list of the enabled flaggers that run in
+    # the worker processes.
+    def _partitioned_flagger_ids(self):
+        enabled = self._enabled_flaggers()
+        return [i for i, flagger in enumerate(flaggers)
+                if flagger in enabled and flagger.partitionable]
+
+    #######################################################
+
+    # Helper to process_data()
+    # Forking while the shard readers' threads run could copy a lock they
+    # hold into a worker, so the pool is started before they are.
+    def _start_flagging_pool(self):
+        workers = config.get_value("flagging_workers")
+        if workers and workers > 1:
+            self._flagging_pool = flagging_pool(
+                self._partitioned_flagger_ids(), config, workers)
+
+    #######################################################
+
+    # Helper to process_data()
+    def _stop_flagging_pool(self):
+        if self._flagging_pool is not None:
+            self._flagging_pool.close()
+            self._flagging_pool.join()
+            self._flagging_pool = None
+
+    #######################################################
+
+    # Helper to _flag_rows()
+    def _log_flagger_errors(self, errors):
+        for error in errors:
+            self._ios.log_and_print(error, self._ios.Severity.WARNING)
+
+    #######################################################
+
+    # Helper to process_data()
+    # When "cross_day_duplicates" is enabled, rows whose fingerprint is already
+    # in the fingerprint index under another row_id (i.e. a row processed by an
+    # earlier run) are flagged as duplicates, as are rows whose fingerprint
+    # appears on an earlier service date of ctran_df, so a range processed at
+    # once is flagged as it would be a day at a time. This returns the
+    # fingerprints of ctran_df so they can be added to the index, or None if
+    # disabled.
+    def _flag_cross_day_duplicates(self, ctran_df, flag_masks):
+        if not config.get_value("cross_day_duplicates"):
+            return None
+
+        self._ios.log_and_print("Checking for duplicates of earlier runs.")
         try:
-            # Duplicate flagger requires a special call later on,
-            # independent of this loop.
-            if flagger.name == "Duplicate":
-                duplicate = flagger
-            else:
-                flags.update(flagger.flag(row, config))
+            hashes = fingerprint(ctran_df, key_columns(ctran_df, config, cross_day=True)).values
+        except ValueError as err:
+            self._ios.log_and_print(
+                "Cannot fingerprint rows, skipping cross-day duplicates.\n{}".format(err),
+                self._ios.Severity.WARNING)
+            return None
+
+        # Rows repeating a row of an earlier day of this frame.
+        days = pandas.DataFrame({
+            "fingerprint": hashes,
+            "service_date": pandas.to_datetime(ctran_df["service_date"]).values,
+        })
+        first_day = days.groupby("fingerprint")["service_date"].transform("min")
+        mask = (days["service_date"] > first_day).values
+
+        history = self.fingerprints.query_fingerprints(hashes)
+        if history is None:
+            self._ios.log_and_print(
+                "Cannot read the fingerprint index, skipping duplicates of earlier runs.",
+                self._ios.Severity.WARNING)
+            merge_masks(flag_masks, {flag_enums.DUPLICATE: mask})
+            return hashes
+
+        # A row matching itself happens when a day is processed twice.
+        matches = pandas.DataFrame({"fingerprint": hashes, "row_id": ctran_df.index.values})
+        matches = matches.merge(history[["fingerprint", "row_id"]],
+                                on="fingerprint", how="inner", suffixes=("", "_seen"))
+        matches = matches[matches["row_id"] != matches["row_id_seen"]]
+        mask |= np.isin(ctran_df.index.values, matches["row_id"].values)
 
-        except Exception as e:
+        merge_masks(flag_masks, {flag_enums.DUPLICATE: mask})
+        return hashes
+
+    #######################################################
+
+    # Helper to process_data()
+    # Adds this run's row fingerprints to the fingerprint index, except for the
+    # service dates in failed_dates, whose flags were not written.
+    def _save_fingerprints(self, ctran_df, row_fingerprints, date_codes, failed_dates=()):
+        if row_fingerprints is None:
+            return
+
+        date_strs = np.array(self._format_service_dates(ctran_df), dtype=object)
+        # The trailing False is picked by date code -1, rows without a service key.
+        written = np.array([date not in failed_dates for date in date_strs] + [False])
+        valid = np.flatnonzero(written[date_codes])
+        if not self.fingerprints.write_table(
+                row_fingerprints[valid],
+                ctran_df.index.values[valid].tolist(),
+                date_strs[date_codes[valid]].tolist()):
             self._ios.log_and_print(
-                "Error in flagger {}. Skipping.\n{}".format(flagger.name, e),
+                "Failed to update the fingerprint index.",
                 self._ios.Severity.WARNING)
 
-        return duplicate
+    #######################################################
+
+    # Helper to reprocess() and delete_flagged_range()
+    # Keeps the fingerprint index in step with deleted flagged rows.
+    def _delete_fingerprints(self, start_date, end_date):
+        if not config.get_value("cross_day_duplicates"):
+            return True
+        return self.fingerprints.delete_date_range(start_date, end_date)
 
     #######################################################
 
     # Helper to process_data()
-    def _updated_flagged_rows(self, flags, flagged_rows, row, row_id, service_key):
-        date = row["service_date"]
-        date = "".join([str(date.year), "/", str(date.month), "/", str(date.day)])
-        for flag in flags:
-            flagged_rows.append([
-                row_id,
-                service_key,
-                int(flag),
-                date
-            ])
+    # Turns the per-flag row masks into flagged_data rows, which are lists of
+    # [row_id, service_key, flag_id, service_date].
+    def _build_flagged_rows(self, ctran_df, flag_masks, service_keys, date_codes):
+        valid = date_codes != -1
+        date_strs = self._format_service_dates(ctran_df)
+        row_ids = ctran_df.index.values
+
+        flagged_rows = []
+        for flag, mask in flag_masks.items():
+            rows = np.flatnonzero(mask & valid)
+            flag_id = int(flag)
+            for row_id, code in zip(row_ids[rows].tolist(), date_codes[rows].tolist()):
+                flagged_rows.append([
+                    row_id,
+                    service_keys[code],
+                    flag_id,
+                    date_strs[code]
+                ])
+
+        return flagged_rows
 
     #######################################################
 
     # Helper to process_data()
-    # Duplicate flagger requires a special call later on, independent of the
-    # primary loop.
-    def _check_duplicated_rows(self, flagged_rows, duplicate, ctran_df):
-        if duplicate is not None:
-            self._ios.log_and_print("Checking for duplicates.")
-            flagged_rows.extend(self._flag_duplicates(ctran_df, duplicate))
+    # Formats each distinct service date once, in date code order.
+    def _format_service_dates(self, ctran_df):
+        dates = pandas.factorize(ctran_df["service_date"])[1]
+        return ["".join([str(date.year), "/", str(date.month), "/", str(date.day)])
+                for date in dates]
+
+    ###########################################################
+
+    # Helper to process_data()
+    # Flags ctran_df and writes its flagged rows and fingerprints to aperture.
+    # skipped_before counts rows skipped in earlier chunks, so the restart
+    # check sees the running total.
+    # Returns: flagged_rows, skipped_rows, the service dates not written
+    def _process_frame(self, ctran_df, restart, skipped_before=0):
+        service_keys, date_codes, skipped_rows = self._build_service_keys(ctran_df)
+        self._should_pipeline_restart(restart, skipped_before + skipped_rows)
+
+        flag_masks = self._flag_rows(ctran_df)
+        row_fingerprints = self._flag_cross_day_duplicates(ctran_df, flag_masks)
+        flagged_rows = self._build_flagged_rows(
+            ctran_df, flag_masks, service_keys, date_codes)
+        failed_dates = self._save_aperture(flagged_rows)
+        self._save_fingerprints(ctran_df, row_fingerprints, date_codes, failed_dates)
+        return flagged_rows, skipped_rows, failed_dates
+
+    #######################################################
+
+    # Helper to process_data()
+    # Reads the date range a chunk at a time, flagging and writing each chunk
+    # before the next is read: a service day per chunk, read ahead over
+    # "parallel_readers" connections from one snapshot, if that is above 1, and
+    # "chunk_rows" rows per chunk otherwise. A vehicle's service day never
+    # spans two chunks, so flaggers see the same rows together as in a
+    # whole-range run. CSV output is still written once at the end, since
+    # those files are rewritten rather than appended to.
+    def _process_chunks(self, start_date, end_date, restart):
+        start_date, end_date = self._get_date_range(start_date, end_date)
+        columns = self._read_columns()
+        readers = config.get_value("parallel_readers")
+        if readers and readers > 1:
+            self._ios.log_and_print(
+                "Processing the queried data a day at a time over {} connections.".format(readers))
+            chunk_frames = self.ctran.query_date_range_shards(start_date, end_date, readers, columns)
         else:
+            chunk_rows = config.get_value("chunk_rows")
             self._ios.log_and_print(
-                "This run is not checking for duplicates.",
-                self._ios.Severity.WARNING)
+                "Processing the queried data in chunks of {} rows.".format(chunk_rows))
+            chunk_frames = self.ctran.query_date_range_chunks(start_date, end_date, chunk_rows, columns)
+
+        keep_csv = self._output_type == "csv" or self._output_type == "both"
+        csv_rows = []
+        csv_service_keys = []
+        failed_dates = []
+        chunks = total_rows = total_flags = skipped_rows = 0
+        for ctran_df in chunk_frames:
+            if ctran_df is None:
+                self._ios.log_and_print(
+                    "Failed to read chunk {}; chunks before it were saved.".format(chunks + 1),
+                    self._ios.Severity.ERROR)
+                return False
+            if ctran_df.empty:
+                continue
+
+            chunks += 1
+            flagged_rows, skipped, failed = self._process_frame(ctran_df, restart, skipped_rows)
+            skipped_rows += skipped
+            failed_dates.extend(failed)
+            total_rows += len(ctran_df.index)
+            total_flags += len(flagged_rows)
+            if keep_csv:
+                csv_rows.extend(flagged_rows)
+                csv_service_keys.extend(date for date in self._csv_service_dates(ctran_df)
+                                        if date not in csv_service_keys)
+
+            self._ios.log_and_print(
+                "Chunk {}: {} rows, {} flags ({} rows, {} flags so far).".format(
+                    chunks, len(ctran_df.index), len(flagged_rows), total_rows, total_flags))
+
+        if chunks == 0:
+            self._ios.log_and_print(
+                "The supplied dates were unable to be gathered from CTran data.",
+                self._ios.Severity.ERROR)
+            return False
+
+        self._save_csv(csv_rows, csv_service_keys)
+        if failed_dates:
+            self._report_failed_dates(failed_dates)
+            return False
+        self._ios.log_and_print("Done executing the pipeline.")
+        return True
 
     ###########################################################
 
     # Helper to process_data()
-    def _save_output(self, flagged_rows, csv_service_keys):
-        if self._output_type == "aperture" or self._output_type == "both":
-            self.flagged.write_table(flagged_rows)
+    # Logs the service dates whose flags could not be written. The other days
+    # were written, and conflicts are skipped, so rerunning the range writes
+    # only what is missing.
+    def _report_failed_dates(self, failed_dates):
+        self._ios.log_and_print(
+            "Flags were not written for these service dates; process them again: " +
+            ", ".join(str(date) for date in failed_dates),
+            self._ios.Severity.ERROR)
 
-        if self._output_type == "csv" or self._output_type == "both":
-            self.flags.write_csv(self._output_path)
-            self.flagged.write_csv(self._output_path, flagged_rows)
-            self.service_periods.write_csv(self._output_path, csv_service_keys)
+    ###########################################################
 
-    #######################################################
+    # Helper to process_data()
+    # Constraints left suspended by a run that crashed are rebuilt first, so
+    # flagged_data is never without them for longer than until the next run.
+    # In "backfill_mode", its foreign keys and secondary indexes are then
+    # suspended: they are validated and rebuilt once, in bulk, after the run
+    # instead of per row. The flags are registered here, once per run, before
+    # any flagged row is written. Returns False if the run should not go ahead.
+    def _begin_backfill(self):
+        if self._output_type != "aperture" and self._output_type != "both":
+            return True
+        self._register_flags()
+        if not self.flagged.restore_constraints():
+            self._ios.log_and_print(
+                "Could not restore the suspended constraints of flagged_data.",
+                self._ios.Severity.ERROR)
+            return False
+        if config.get_value("backfill_mode"):
+            self._ios.log_and_print("Backfill mode: suspending the constraints of flagged_data.")
+            return self.flagged.suspend_constraints()
+        return True
 
-    def _flag_duplicates(self, df, duplicate_instance):
-        """ Order of fields.
-            index:  row_id
-            field0: service_key
-            field1: date
-            field2: flag
-        """
-        dup_df = None
-        try:
-            dup_df = duplicate_instance.flag(df, config)
-        except ValueError as err:
-            self._ios.log_and_print("", self._ios.Severity.ERROR, err)
-            return []
+    ###########################################################
 
-        dup_df.insert(0, "service_key", 0)
-        dup_df["service_key"] = dup_df["service_date"].apply(
-            lambda date: self.service_periods.query_or_insert(date))
+    # Helper to process_data()
+    def _end_backfill(self):
+        if self._output_type != "aperture" and self._output_type != "both":
+            return
+        if config.get_value("backfill_mode"):
+            self._ios.log_and_print("Backfill mode: rebuilding the constraints of flagged_data.")
+            self.flagged.restore_constraints()
 
-        dup_df.insert(1, "flag_id", 1)
-        dup_df["flag_id"] = flag_enums.DUPLICATE
+    ###########################################################
 
-        dup_df["service_date"] = dup_df["service_date"].apply(
-            lambda date: "".join([str(date.year), "/", str(date.month), "/", str(date.day)]))
+    # Helper to process_data()
+    # With "write_streams" above 1, each service day is written in its own
+    # transaction over that many connections at once. The write runs with the
+    # Postgres settings of "bulk_load_profile" (e.g. synchronous_commit off)
+    # and, with "bulk_load_unlogged_staging", an unlogged staging table; both
+    # are reverted afterwards. The write is timed either way, so runs with and
+    # without the profile can be compared in the log. Returns the service
+    # dates of flagged_rows that were not written.
+    def _save_aperture(self, flagged_rows):
+        failed_dates = []
+        if (self._output_type == "aperture" or self._output_type == "both") and flagged_rows:
+            streams = config.get_value("write_streams") or 1
+            profile = config.get_value("bulk_load_profile") or {}
+            if not self.flagged.set_write_settings(profile):
+                profile = {}
+            if config.get_value("bulk_load_unlogged_staging"):
+                self.flagged.set_staging("unlogged")
+
+            started = time.monotonic()
+            try:
+                if streams > 1:
+                    failed_dates = self.flagged.write_table_days(flagged_rows, streams)
+                elif not self.flagged.write_table(flagged_rows):
+                    failed_dates = sorted(set(row[3] for row in flagged_rows))
+            finally:
+                self.flagged.set_write_settings({})
+                self.flagged.set_staging("temporary")
+
+            self._ios.log_and_print("Wrote {} flags in {:.2f} s ({}).".format(
+                len(flagged_rows), time.monotonic() - started,
+                "bulk-load profile: " + ", ".join(
+                    "{}={}".format(name, value) for name, value in profile.items())
+                if profile else "default settings"))
+        return failed_dates
 
-        indices = dup_df.index.tolist()
-        values = dup_df.values.tolist()
-        dup_list = []
-        for i in range(len(indices)):
-            temp = [indices[i]]
-            temp.extend(values[i])
-            dup_list.append(temp)
+    ###########################################################
 
-        return dup_list
+    # Helper to process_data()
+    def _save_csv(self, flagged_rows, csv_service_keys):
+        if self._output_type == "csv" or self._output_type == "both":
+            self.flags.write_csv(self._output_path)
+            self.flagged.write_csv(self._output_path, flagged_rows)
+            self.service_periods.write_csv(self._output_path, csv_service_keys)
 
     ###########################################################
 
@@ -457,7 +897,8 @@ class _Client():
             _Option("Create service_periods table.", self.service_periods.create_table),
             _Option("Delete flagged_data table.", self.flagged.delete_table),
             _Option("Delete service_periods table.", self.flags.delete_table),
-            _Option("Query ctran_data and print ctran_data.info().", ctran_info)
+            _Option("Query ctran_data and print ctran_data.info().", ctran_info),
+            _Option("Invalidate cached ctran_data days.", self.invalidate_day_cache)
         ]
 
         return self._menu("This is the Database Operations sub-menu.", options)
@@ -4,6 +4,7 @@ import os
 from datetime import datetime
 from dateutil.parser import parse, ParserError
 from enum import Enum
+import numpy as np
 
 CONFIG_FILENAME = "./assets/config.json"
 
@@ -15,8 +16,10 @@ class BoundsResult(Enum):
 class Config:
     def __init__(self):
         self._data = {}
+        self._typed_bounds = None
     def load(self, filename=CONFIG_FILENAME, read_env_data=False, debug=False):
         self._filename = filename
+        self._typed_bounds = None
 
         try:
             with open(self._filename) as f:
@@ -89,11 +92,31 @@ class Config:
 
     def set_bounds(self, column_name, min, max):
         self._data['columns'][column_name] = {'min' : min, 'max' : max}
+        self._typed_bounds = None
 
     def get_bounds(self, column_name):
         if column_name in self._data['columns']:
             return self._data['columns'][column_name]
 
+    def typed_bounds(self):
+        # Returns {column_name: (min, max)} for every bounded column, with date
+        # bounds as numpy.datetime64, other bounds as numpy.float64, and "NA"
+        # or missing bounds as None. The bounds are parsed once and cached
+        # until they change.
+        if self._typed_bounds is None:
+            self._typed_bounds = {}
+            for column_name, col in self._data.get('columns', {}).items():
+                self._typed_bounds[column_name] = (
+                    self._typed_bound(col, 'min'), self._typed_bound(col, 'max'))
+        return self._typed_bounds
+
+    def _typed_bound(self, col, key):
+        if key not in col or self._is_na(col[key]):
+            return None
+        if self._is_date(col[key]):
+            return np.datetime64(parse(col[key]), 'ns')
+        return np.float64(col[key])
+
     def check_bounds(self, column_name, val):
         if column_name in self._data["columns"]:
             col = self._data["columns"][column_name]
@@ -0,0 +1,5 @@
+from .parallel import flag_partitions
+from .parallel import flagging_pool
+from .parallel import merge_masks
+from .parallel import partition_positions
+from .parallel import run_flaggers
@@ -0,0 +1,137 @@
+from multiprocessing import Pool
+import numpy as np
+
+from flaggers.flagger import flaggers, GroupFlagger, TripIndex
+from flaggers.duplicate import fingerprint
+
+# Rows are partitioned on these columns, so every partition holds whole
+# vehicle days and flaggers that look at a vehicle's trips see all of them.
+PARTITION_COLUMNS = ["service_date", "vehicle_number"]
+
+# State each worker process is initialized with; see _init_worker().
+_worker = {}
+
+
+"""
+Runs flagger_list over data, the way process_data does sequentially.
+
+:argument   flagger_list: the flaggers to run
+            data: the pandas.DataFrame to flag
+            config: contains config vars
+            progress_bar: optional, ticked once per flagger
+:returns    masks, errors: the OR of every flagger's masks, and a message for
+            each flagger that raised and was skipped.
+"""
+def run_flaggers(flagger_list, data, config, progress_bar=None):
+    masks = {}
+    errors = []
+    trip_index = None
+    for flagger in flagger_list:
+        try:
+            # The trip index is only built if a group flagger is enabled.
+            if isinstance(flagger, GroupFlagger):
+                if trip_index is None:
+                    trip_index = TripIndex(data)
+                result = flagger.flag_frame(data, config, trip_index)
+            else:
+                result = flagger.flag_frame(data, config)
+        except Exception as e:
+            errors.append("Error in flagger {}. Skipping.\n{}".format(flagger.name, e))
+            result = {}
+
+        merge_masks(masks, result)
+        if progress_bar is not None:
+            progress_bar.next()
+
+    return masks, errors
+
+
+# ORs the masks of result into masks.
+def merge_masks(masks, result):
+    for flag, mask in result.items():
+        mask = np.asarray(mask, dtype=bool)
+        if flag in masks:
+            masks[flag] = masks[flag] | mask
+        else:
+            masks[flag] = mask
+
+
+# Splits the rows of data into at most partitions groups by a hash of
+# PARTITION_COLUMNS. Returns a list of arrays of row positions, each sorted.
+def partition_positions(data, partitions):
+    columns = [col for col in PARTITION_COLUMNS if col in data]
+    if columns:
+        buckets = fingerprint(data, columns).values % np.uint64(partitions)
+    else:
+        buckets = np.zeros(len(data.index), dtype=np.uint64)
+
+    order = np.argsort(buckets, kind="stable")
+    splits = np.searchsorted(buckets[order], np.arange(1, partitions, dtype=np.uint64))
+    return [positions for positions in np.split(order, splits) if len(positions)]
+
+
+# Starts the worker processes that flag_partitions() runs the flaggers at
+# flagger_ids (positions in flaggers.flagger.flaggers) in. The processes are
+# forked here, all at once, so a pool made before any reader threads start
+# never forks while they run. The caller must close() and join() it.
+def flagging_pool(flagger_ids, config, workers):
+    return Pool(processes=workers, initializer=_init_worker, initargs=(flagger_ids, config))
+
+
+"""
+Runs the flaggers at flagger_ids (positions in flaggers.flagger.flaggers) over
+data in a pool of worker processes, one partition of vehicle days at a time.
+
+The rows of each partition are sent to a worker and only the positions of
+flagged rows travel back. Partition results are merged in partition order, so
+the outcome does not depend on which worker finishes first.
+
+:argument   data: the pandas.DataFrame to flag
+            flagger_ids: positions in the flaggers list of the flaggers to run
+            config: contains config vars
+            workers: the number of worker processes
+            partitions_per_worker: partitions are made smaller than one per
+                worker so that uneven partitions even out
+            progress_bar: optional, ticked once per partition; its max is set
+                to the number of partitions
+            pool: optional, a flagging_pool() of flagger_ids and config to run
+                in. Without it a pool is started for this call only.
+:returns    masks, errors: as for run_flaggers()
+"""
+def flag_partitions(data, flagger_ids, config, workers, partitions_per_worker=4,
+                    progress_bar=None, pool=None):
+    if pool is None:
+        with flagging_pool(flagger_ids, config, workers) as pool:
+            return flag_partitions(data, flagger_ids, config, workers,
+                                   partitions_per_worker, progress_bar, pool)
+
+    masks = {}
+    errors = []
+    partitions = partition_positions(data, workers * partitions_per_worker)
+    if progress_bar is not None:
+        progress_bar.max = len(partitions)
+
+    frames = (data.iloc[positions] for positions in partitions)
+    for positions, (flagged, partition_errors) in zip(
+            partitions, pool.imap(_flag_partition, frames)):
+        for flag, rows in flagged.items():
+            if flag not in masks:
+                masks[flag] = np.zeros(len(data.index), dtype=bool)
+            masks[flag][positions[rows]] = True
+        errors.extend(e for e in partition_errors if e not in errors)
+        if progress_bar is not None:
+            progress_bar.next()
+
+    return masks, errors
+
+
+def _init_worker(flagger_ids, config):
+    _worker["flaggers"] = [flaggers[i] for i in flagger_ids]
+    _worker["config"] = config
+
+
+# Returns, for every flag, the positions within the partition of the flagged
+# rows, along with any flagger errors.
+def _flag_partition(data):
+    masks, errors = run_flaggers(_worker["flaggers"], data, _worker["config"])
+    return {flag: np.flatnonzero(mask) for flag, mask in masks.items()}, errors
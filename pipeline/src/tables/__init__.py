@@ -1,5 +1,9 @@
-from .table import Table
+from .table import Table, WriteCounts
 from .ctran_data import CTran_Data
+from .ctran_files import CTran_Files
 from .flagged_data import Flagged_Data
 from .flags import Flags
 from .service_periods import Service_Periods
+from .fingerprints import Fingerprints
+from .governor import ReadGovernor
+from .day_cache import DayCache
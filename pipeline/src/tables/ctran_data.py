@@ -1,5 +1,6 @@
 import sys
 import pandas
+from datetime import timedelta
 from .table import Table
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.engine.base import Engine
@@ -41,6 +42,35 @@ class CTran_Data(Table):
             "schedule_status",
             "trip_id"
         ]
+        # The nullable pandas dtype of each column of _creation_sql.
+        self._dtypes = {
+            "service_date": "datetime64[ns]",
+            "vehicle_number": "Int32",
+            "leave_time": "Int32",
+            "train": "Int32",
+            "route_number": "Int32",
+            "direction": "Int16",
+            "service_key": "category",
+            "trip_number": "Int32",
+            "stop_time": "Int32",
+            "arrive_time": "Int32",
+            "dwell": "Int32",
+            "location_id": "Int32",
+            "door": "Int32",
+            "lift": "Int32",
+            "ons": "Int32",
+            "offs": "Int32",
+            "estimated_load": "Int32",
+            "maximum_speed": "Int32",
+            "train_mileage": "float64",
+            "pattern_distance": "float64",
+            "location_distance": "float64",
+            "x_coordinate": "float64",
+            "y_coordinate": "float64",
+            "data_source": "Int32",
+            "schedule_status": "Int32",
+            "trip_id": "Int32"
+        }
 
         self._creation_sql = "".join(["""
             CREATE TABLE IF NOT EXISTS """, self._schema, ".", self._table_name, """
@@ -73,6 +103,35 @@ class CTran_Data(Table):
                 schedule_status INTEGER,
                 trip_id INTEGER
             );"""])
+        self._day_cache = None
+
+    #######################################################
+
+    # Serves query_date_range from cache, a DayCache (src/tables/day_cache.py)
+    # or None to read every day from the database.
+    def set_day_cache(self, cache):
+        self._day_cache = cache
+
+    #######################################################
+
+    # Return the latest service day (as date) stored, None if no days are
+    # stored or an error occurred.
+    def get_latest_day(self):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("Invalid engine.", self._ios.Severity.ERROR)
+            return None
+
+        sql = "".join(["SELECT MAX(service_date) ",
+                       "FROM ", self._schema, ".", self._table_name,
+                       ";"])
+        try:
+            self._ios.log_and_print(sql)
+            with self._engine.connect() as conn:
+                return conn.execute(sql).scalar()
+        except SQLAlchemyError as error:
+            self._ios.log_and_print(
+                "SQLAlchemyError: " + str(error), self._ios.Severity.ERROR)
+            return None
 
     #######################################################
 
@@ -112,10 +171,17 @@ class CTran_Data(Table):
 
     #######################################################
 
-    # Query all data between date_from and date_to, dates
+    # Query all data between date_from and date_to, dates. If columns is given,
+    # only those columns (and row_id) are read.
+    # With a day cache (see set_day_cache()), cached days are not read again.
     # NOTE: if there is no ctran_data table, this will not work, obviously.
-    def query_date_range(self, date_from, date_to):
-        sql = "".join(["SELECT * FROM ",
+    def query_date_range(self, date_from, date_to, columns=None):
+        if self._day_cache is not None and date_from <= date_to:
+            return self._query_cached_range(date_from, date_to, columns)
+
+        sql = "".join(["SELECT ",
+                       self._select_list(columns),
+                       " FROM ",
                        self._schema,
                        ".",
                        self._table_name,
@@ -125,11 +191,123 @@ class CTran_Data(Table):
                        date_to.strftime("%Y-%m-%d"),
                        "';"])
 
-        return self._query_table(sql)
+        return self._query_table(sql, columns)
+
+    #######################################################
+
+    # Like query_date_range, but yields the data in DataFrames of about
+    # chunksize rows (see Table._query_table_chunks). Rows are ordered by
+    # service_date and vehicle_number, and a vehicle's day is never split
+    # across chunks, so flaggers that look at a vehicle's trips still see all
+    # of them. columns is as for query_date_range, and must include
+    # service_date and vehicle_number. Yields None if an error occurred.
+    def query_date_range_chunks(self, date_from, date_to, chunksize, columns=None):
+        sql = "".join(["SELECT ",
+                       self._select_list(columns),
+                       " FROM ",
+                       self._schema,
+                       ".",
+                       self._table_name,
+                       " WHERE service_date BETWEEN '",
+                       date_from.strftime("%Y-%m-%d"),
+                       "' AND '",
+                       date_to.strftime("%Y-%m-%d"),
+                       "' ORDER BY service_date, vehicle_number, ",
+                       self._index_col,
+                       ";"])
+
+        return self._query_table_chunks(
+            sql, chunksize, group_columns=["service_date", "vehicle_number"], columns=columns)
+
+    #######################################################
+
+    # Like query_date_range, but yields the data a page of page_size rows at a
+    # time in row_id order (see Table._query_table_keyset). after is the last
+    # row_id already read, so an interrupted scan can be resumed from it.
+    # columns is as for query_date_range. Yields None if an error occurred.
+    def query_date_range_pages(self, date_from, date_to, page_size, after=None, retries=2, columns=None):
+        where = "".join(["service_date BETWEEN '",
+                         date_from.strftime("%Y-%m-%d"),
+                         "' AND '",
+                         date_to.strftime("%Y-%m-%d"),
+                         "'"])
+
+        return self._query_table_keyset(where, page_size, after, retries, columns)
+
+    #######################################################
+
+    # Like query_date_range, but reads every service day of the range as its
+    # own shard, over readers connections in parallel, and yields the days in
+    # order as they arrive (see Table._query_table_shards). All days are read
+    # from one snapshot, so the range is consistent even while ctran_data is
+    # being loaded. Yields None if an error occurred.
+    def query_date_range_shards(self, date_from, date_to, readers, columns=None):
+        sqls = []
+        day = date_from
+        while day <= date_to:
+            sqls.append("".join(["SELECT ",
+                                 self._select_list(columns),
+                                 " FROM ",
+                                 self._schema,
+                                 ".",
+                                 self._table_name,
+                                 " WHERE service_date = '",
+                                 day.strftime("%Y-%m-%d"),
+                                 "';"]))
+            day += timedelta(days=1)
+
+        return self._query_table_shards(sqls, readers, columns)
 
     ###########################################################################
     # Private Methods
 
+    # Helper to query_date_range()
+    # Reads the days of the range that are not in the day cache in one query,
+    # with every column, and caches those before the latest day in the table.
+    # The result is the cached and read days, in date order, projected to
+    # columns.
+    def _query_cached_range(self, date_from, date_to, columns):
+        days = []
+        day = date_from
+        while day <= date_to:
+            days.append(day)
+            day += timedelta(days=1)
+
+        projection = self._projection(columns)
+        frames = {day: self._day_cache.get(day, self._index_col, projection) for day in days}
+        missing = [day for day in days if frames[day] is None]
+        if missing:
+            sql = "".join(["SELECT * FROM ",
+                           self._schema,
+                           ".",
+                           self._table_name,
+                           " WHERE service_date IN (",
+                           ", ".join(["'" + day.strftime("%Y-%m-%d") + "'" for day in missing]),
+                           ");"])
+            df = self._fetch_table(sql)
+            if df is None:
+                return None
+
+            # The latest day may still be loading, so only the days before it
+            # are complete. Nothing is cached if it cannot be read.
+            latest = self.get_latest_day()
+            df_days = pandas.to_datetime(df["service_date"]).dt.strftime("%Y-%m-%d")
+            for day in missing:
+                day_df = df[df_days == day.strftime("%Y-%m-%d")]
+                if latest is not None and day < latest and not day_df.empty:
+                    self._day_cache.put(day, day_df)
+                frames[day] = day_df if projection is None else day_df[projection]
+
+        df = pandas.concat([frames[day] for day in days])
+        if not self._check_cols(df, columns):
+            self._ios.log_and_print(
+                "the columns of cached data does not match the specified columns",
+                self._ios.Severity.ERROR)
+            return None
+        return self._clean_frame(df)
+
+    #######################################################
+
     def _create_table_helper(self, sample_data, exists_action="append"):
         try:
             conn = self._engine.connect()
@@ -0,0 +1,119 @@
+import os
+import re
+import pandas
+from concurrent.futures import ThreadPoolExecutor
+
+from ..ios import ios
+
+
+""" CTran_Files
+Reads C-Tran rows from a directory of extract files (.csv, .csv.gz or
+.parquet) instead of the ctran_data table, e.g. to backfill history that was
+never loaded into the portal. Files are parsed over workers threads, and only
+the rows of the queried date range are kept. Files named with a YYYY-MM-DD
+date outside the range are not read at all. Rows are checked and typed by
+table, a CTran_Data, exactly as its own query results are, so every file must
+hold its columns, including row_id. Parquet files need pyarrow.
+For more, see docs/db_ops.md
+"""
+class CTran_Files():
+
+    extensions = (".csv", ".csv.gz", ".parquet")
+
+    def __init__(self, path, table, workers=1):
+        self._ios = ios
+        self.path = path
+        self.workers = max(1, workers or 1)
+        self._table = table
+
+    #######################################################
+
+    # Like CTran_Data.query_date_range, but reads the files. Returns None if a
+    # file could not be read or does not hold the columns.
+    def query_date_range(self, date_from, date_to, columns=None):
+        files = self._files(date_from, date_to)
+        if not files:
+            self._ios.log_and_print(
+                "No extract files in " + str(self.path), self._ios.Severity.ERROR)
+            return None
+
+        self._ios.log_and_print("Reading {} extract files over {} threads.".format(
+            len(files), self.workers))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            frames = list(pool.map(
+                lambda file_path: self._read_file(file_path, date_from, date_to, columns),
+                files))
+        if any(df is None for df in frames):
+            return None
+
+        df = pandas.concat(frames)
+        if not self._table._check_cols(df, columns):
+            self._ios.log_and_print(
+                "the columns of the extract files do not match the specified columns",
+                self._ios.Severity.ERROR)
+            return None
+        return self._table._clean_frame(df)
+
+    #######################################################
+
+    # Helper to query_date_range()
+    # The extract files that may hold rows from date_from to date_to.
+    def _files(self, date_from, date_to):
+        try:
+            names = sorted(os.listdir(self.path))
+        except OSError as error:
+            self._ios.log_and_print(str(error), self._ios.Severity.ERROR)
+            return []
+
+        first = date_from.strftime("%Y-%m-%d")
+        last = date_to.strftime("%Y-%m-%d")
+        files = []
+        for name in names:
+            if not name.endswith(self.extensions):
+                continue
+            day = re.search(r"\d{4}-\d{2}-\d{2}", name)
+            if day is not None and not first <= day.group() <= last:
+                continue
+            files.append(os.path.join(self.path, name))
+        return files
+
+    #######################################################
+
+    # Helper to query_date_range()
+    # Reads the rows of file_path from date_from to date_to, with columns (see
+    # Table._select_list), or None if an error occurred.
+    def _read_file(self, file_path, date_from, date_to, columns):
+        projection = self._table._projection(columns)
+        usecols = None
+        if projection is not None:
+            usecols = [self._table._index_col] + \
+                [col for col in ["service_date"] if col not in projection] + projection
+
+        try:
+            if file_path.endswith(".parquet"):
+                df = self._read_parquet(file_path, usecols)
+            else:
+                header = pandas.read_csv(file_path, nrows=0).columns.tolist()
+                df = self._table._read_csv_frame(file_path, header, usecols)
+        except (OSError, ValueError, KeyError, ImportError) as error:
+            self._ios.log_and_print(
+                "Cannot read {}: {}".format(file_path, error), self._ios.Severity.ERROR)
+            return None
+
+        service_dates = pandas.to_datetime(df["service_date"])
+        df = df[(service_dates >= pandas.Timestamp(date_from.strftime("%Y-%m-%d"))) &
+                (service_dates <= pandas.Timestamp(date_to.strftime("%Y-%m-%d")))]
+        return df if projection is None else df[projection]
+
+    #######################################################
+
+    # Helper to _read_file()
+    def _read_parquet(self, file_path, usecols):
+        df = pandas.read_parquet(file_path)
+        if self._table._index_col in df.columns:
+            df = df.set_index(self._table._index_col)
+        if usecols is not None:
+            df = df[usecols[1:]]
+        if not self._table._typed:
+            df = df.assign(service_date=pandas.to_datetime(df["service_date"]).dt.date)
+        return df
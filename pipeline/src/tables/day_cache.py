@@ -0,0 +1,120 @@
+import glob
+import os
+
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    pyarrow = None
+    feather = None
+
+from ..ios import ios
+
+
+""" DayCache
+A local cache of a table's rows, one uncompressed Arrow IPC (Feather) file per
+service day, so that days that were read before need not be read from the
+database again. Files are memory-mapped on read, so numeric columns load
+without being copied. When the files grow past max_bytes, the least recently
+read days are evicted. Needs pyarrow; see available().
+For more, see docs/db_ops.md
+"""
+class DayCache():
+
+    def __init__(self, path, max_bytes):
+        self._ios = ios
+        self.path = path
+        self.max_bytes = max_bytes
+
+    #######################################################
+
+    # Whether pyarrow, which the cache needs, is installed.
+    @staticmethod
+    def available():
+        return feather is not None
+
+    #######################################################
+
+    # Returns the rows of day (a date) with the given columns (every column if
+    # None), indexed by index_col, or None if day is not cached.
+    def get(self, day, index_col, columns=None):
+        file_path = self._file(day)
+        if not os.path.exists(file_path):
+            return None
+
+        read_columns = None if columns is None else [index_col] + list(columns)
+        try:
+            table = feather.read_table(file_path, columns=read_columns, memory_map=True)
+        except (pyarrow.ArrowException, OSError, ValueError) as error:
+            self._ios.log_and_print(
+                "Cannot read cached day {}: {}".format(day, error),
+                self._ios.Severity.WARNING)
+            return None
+
+        # Mark the day as recently used for eviction.
+        os.utime(file_path)
+        return table.to_pandas().set_index(index_col)
+
+    #######################################################
+
+    # Caches df, the rows of day indexed by their index, then evicts the least
+    # recently used days until the cache fits in max_bytes. Returns whether df
+    # was cached.
+    def put(self, day, df):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file(day)
+        temp_path = file_path + ".tmp"
+        try:
+            # Uncompressed, so that reads can be memory-mapped.
+            feather.write_feather(df.reset_index(), temp_path, compression="uncompressed")
+            os.replace(temp_path, file_path)
+        except (pyarrow.ArrowException, OSError, ValueError, TypeError) as error:
+            self._ios.log_and_print(
+                "Cannot cache day {}: {}".format(day, error),
+                self._ios.Severity.WARNING)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        self._evict()
+        return True
+
+    #######################################################
+
+    # Deletes the cached days from start to end, inclusive, or every cached day
+    # if both are None. Returns the number of days deleted.
+    def invalidate(self, start=None, end=None):
+        deleted = 0
+        for file_path in self._files():
+            day = os.path.basename(file_path)[:-len(".arrow")]
+            if start is not None and day < start.strftime("%Y-%m-%d"):
+                continue
+            if end is not None and day > end.strftime("%Y-%m-%d"):
+                continue
+            os.remove(file_path)
+            deleted += 1
+        return deleted
+
+    #######################################################
+
+    # Helper to put()
+    def _evict(self):
+        files = sorted(self._files(), key=os.path.getmtime)
+        sizes = [os.path.getsize(file_path) for file_path in files]
+        total = sum(sizes)
+        for file_path, size in zip(files, sizes):
+            if total <= self.max_bytes:
+                break
+            os.remove(file_path)
+            total -= size
+            self._ios.log_and_print("Evicted cached day " + os.path.basename(file_path))
+
+    #######################################################
+
+    def _file(self, day):
+        return os.path.join(self.path, day.strftime("%Y-%m-%d") + ".arrow")
+
+    #######################################################
+
+    def _files(self):
+        return glob.glob(os.path.join(self.path, "*.arrow"))
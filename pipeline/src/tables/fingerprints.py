@@ -0,0 +1,107 @@
+import numpy as np
+import pandas
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from .table import Table
+
+
+class Fingerprints(Table):
+    # Persistent index of row fingerprints (see flaggers/duplicate.py), used to
+    # find duplicates of rows that were processed by an earlier run.
+
+    def __init__(self, user=None, passwd=None, hostname=None, db_name=None, schema="hive", engine=None):
+        super().__init__(user, passwd, hostname, db_name, schema, engine)
+        self._table_name = "row_fingerprints"
+        self._index_col = None
+        self._lookup_chunksize = 10000
+        self._expected_cols = [
+            "fingerprint",
+            "row_id",
+            "service_date"
+        ]
+        # fingerprint is the uint64 row hash stored as a signed BIGINT.
+        self._creation_sql = "".join(["""
+            CREATE TABLE IF NOT EXISTS """, self._schema, ".", self._table_name, """
+            (
+                fingerprint BIGINT NOT NULL,
+                row_id BIGINT NOT NULL,
+                service_date DATE NOT NULL,
+                PRIMARY KEY (fingerprint, row_id)
+            );
+            CREATE INDEX IF NOT EXISTS """, self._table_name, """_service_date_idx
+                ON """, self._schema, ".", self._table_name, """ (service_date);"""])
+
+    #######################################################
+
+    # fingerprints is an array of uint64 row hashes; row_ids and service_dates
+    # are the matching row ids and "YYYY/MM/DD" service date strings.
+    def write_table(self, fingerprints, row_ids, service_dates):
+        if len(fingerprints) == 0:
+            return True
+
+        df = pandas.DataFrame({
+            "fingerprint": np.asarray(fingerprints, dtype=np.uint64).view(np.int64).tolist(),
+            "row_id": list(row_ids),
+            "service_date": list(service_dates),
+        })
+        return self._write_table(df, conflict_columns=["fingerprint", "row_id"])
+
+    #######################################################
+
+    # Look up which of the uint64 fingerprints are already in the index. This
+    # returns a DataFrame of the matching fingerprint (as uint64), row_id and
+    # service_date, or None if an error occurred. Each lookup is an index scan,
+    # so the cost grows with the number of fingerprints rather than the size
+    # of the index.
+    def query_fingerprints(self, fingerprints):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("Invalid engine.", self._ios.Severity.ERROR)
+            return None
+
+        signed = np.unique(np.asarray(fingerprints, dtype=np.uint64)).view(np.int64)
+        sql = "".join(["SELECT fingerprint, row_id, service_date FROM ",
+                       self._schema, ".", self._table_name,
+                       " WHERE fingerprint = ANY(%(fingerprints)s);"])
+        self._ios.log_and_print(sql)
+
+        results = []
+        try:
+            for start in range(0, len(signed), self._lookup_chunksize):
+                chunk = signed[start:start + self._lookup_chunksize].tolist()
+                results.append(pandas.read_sql(
+                    sql, self._engine, params={"fingerprints": chunk}))
+        except SQLAlchemyError as error:
+            self._ios.log_and_print("SQLAlchemy: " + str(error), self._ios.Severity.ERROR)
+            return None
+
+        if not results:
+            return pandas.DataFrame(columns=self._expected_cols)
+
+        df = pandas.concat(results, ignore_index=True)
+        df["fingerprint"] = df["fingerprint"].values.astype(np.int64).view(np.uint64)
+        return df
+
+    #######################################################
+
+    # Remove the fingerprints of rows in [start_date, end_date], which are
+    # datetimes, so that reprocessing those days does not match itself.
+    def delete_date_range(self, start_date, end_date):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("Invalid engine.", self._ios.Severity.ERROR)
+            return False
+
+        sql = "".join(["DELETE FROM ", self._schema, ".", self._table_name,
+                       " WHERE service_date BETWEEN ",
+                       start_date.strftime("'%Y-%m-%d'"), " AND ",
+                       end_date.strftime("'%Y-%m-%d'"), ";"])
+        try:
+            self._ios.log_and_print(sql)
+            with self._engine.connect() as conn:
+                conn.execute(sql)
+        except SQLAlchemyError as error:
+            self._ios.log_and_print(
+                "SQLAlchemyError: " + str(error), self._ios.Severity.ERROR)
+            return False
+
+        return True
@@ -33,22 +33,44 @@ class Flagged_Data(Table):
 
     #######################################################
 
-    def write_table(self, data):
-        # data is list of [row_id, flag_id, service_key].
+    def write_table(self, data, streams=1):
+        # data is list of [row_id, service_key, flag_id, service_date].
+        # With streams above 1, each service date is written in its own
+        # transaction, streams at a time (see Table._write_table_streams).
         if data == []:
             self._ios.log_and_print(
                 "write_table recieved no data to write, cancelling.",
                 self._ios.Severity.ERROR)
             return False
             
-        df = pandas.DataFrame(data, columns=[
+        if streams > 1:
+            return self.write_table_days(data, streams) == []
+        return self._write_table(self._flagged_frame(data),
+                 conflict_columns=["row_id", "flag_id", "service_key"])
+
+    #######################################################
+
+    # Like write_table with streams, but returns the service dates (as given
+    # in data) whose rows could not be written, so that they can be written
+    # again: an empty list if everything was written.
+    def write_table_days(self, data, streams):
+        df = self._flagged_frame(data)
+        failed = self._write_table_streams(df, "service_date", streams,
+                 conflict_columns=["row_id", "flag_id", "service_key"])
+        if failed is None:
+            return sorted(set(df["service_date"]))
+        return failed
+
+    #######################################################
+
+    # Helper to write_table()
+    def _flagged_frame(self, data):
+        return pandas.DataFrame(data, columns=[
             "row_id",
             "service_key",
             "flag_id",
             "service_date",
             ])
-        return self._write_table(df, 
-                 conflict_columns=["row_id", "flag_id", "service_key"])
 
     #######################################################
 
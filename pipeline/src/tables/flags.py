@@ -3,6 +3,7 @@ import pandas
 from .table import Table
 
 import flaggers.flagger as flagger
+from flaggers.rules import rules_flagger
 
 class Flags(Table):
 
@@ -27,23 +28,21 @@ class Flags(Table):
             );"""])
 
 
-    def write_table(self, flags):
-        # flags is a list of [flag_id, flag_name]
+    def write_table(self, flags, update=False):
+        # flags is a list of [flag_id, description, name]. With update, flags
+        # that already exist get the given description and name.
+        # Returns the WriteCounts of the write, or None if it failed.
         df = pandas.DataFrame(flags, columns=self._expected_cols)
-        return self._write_table(df, conflict_columns=["flag_id"])
+        return self._upsert_table(df, ["flag_id"], update)
 
 
     def create_table(self):
-        # Flags are written into the database on creation.
+        # Flags are written into the database on creation. Flags that already
+        # exist are updated in place, so changed descriptions are picked up.
         if not super().create_table():
             return False
 
-        flags = []
-        for flag in flagger.Flags:
-            fd = flagger.flag_descriptions[flag]
-            flags.append([flag.value, fd.desc, fd.name])
-
-        self.write_table(flags)
+        self.write_table(flagger.flag_rows(), update=True)
         return 
 
     def write_csv(self, path):
@@ -62,9 +61,9 @@ class Flags(Table):
         #Append expected cols first to create header row in the csv file
         flags.append(self._expected_cols)
 
-        #Create list with all flag data
-        for flag in flagger.Flags:
-            flags.append([flag.value, flagger.flag_descriptions[flag]])
+        #Create list with all flag data, rule flags included
+        flags.extend(flagger.flag_rows())
+        flags.extend(rules_flagger.flag_rows())
 
         #Create pandas DataFrame from the list
         df = pandas.DataFrame(flags)
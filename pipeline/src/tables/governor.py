@@ -0,0 +1,110 @@
+import contextlib
+import threading
+import time
+
+from ..ios import ios
+
+
+""" ReadGovernor
+Keeps a table's reads from crowding out other users of its database. Reads
+are throttled to max_rows_per_second, at most max_concurrent queries run at
+once, and every connection gets a statement_timeout (in milliseconds). In
+adaptive mode, reads slow down further whenever their latency per row rises
+well above the best seen so far, and speed back up as it recovers.
+For more, see docs/db_ops.md
+"""
+class ReadGovernor():
+
+    # In adaptive mode, a read is slow when its seconds per row exceed the
+    # best seen by this factor. Each slow read halves the read rate, down to
+    # min_speed of what it would be otherwise; each other read raises it again
+    # by recovery.
+    slow_factor = 2.0
+    min_speed = 1.0 / 16
+    recovery = 1.25
+
+    def __init__(self, max_rows_per_second=None, max_concurrent=None,
+                 statement_timeout=None, adaptive=False,
+                 clock=time.monotonic, sleep=time.sleep):
+        self._ios = ios
+        self.max_rows_per_second = max_rows_per_second or None
+        self.statement_timeout = statement_timeout or None
+        self.adaptive = bool(adaptive)
+        self.speed = 1.0
+        self._best = None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    #######################################################
+
+    # Holds one of the max_concurrent query slots for the duration of the
+    # with block.
+    @contextlib.contextmanager
+    def query(self):
+        if self._slots is None:
+            yield
+            return
+
+        self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    #######################################################
+
+    # Wraps an iterator of DataFrames so that every DataFrame is recorded as a
+    # read, timed from when it was asked for to when it arrived.
+    def chunks(self, frames):
+        frames = iter(frames)
+        while True:
+            started = self._clock()
+            try:
+                df = next(frames)
+            except StopIteration:
+                return
+            self.record(len(df.index), self._clock() - started)
+            yield df
+
+    #######################################################
+
+    # Records a read of rows rows that took seconds, then sleeps for as long
+    # as is needed to keep to max_rows_per_second and the adaptive speed.
+    def record(self, rows, seconds):
+        with self._lock:
+            if self.adaptive and rows:
+                self._adapt(seconds / rows)
+            speed = self.speed
+
+        target = seconds
+        if self.max_rows_per_second:
+            target = max(target, rows / float(self.max_rows_per_second))
+        delay = target / speed - seconds
+        if delay > 0:
+            self._sleep(delay)
+
+    #######################################################
+
+    # The SQL every new connection runs, or None.
+    def session_sql(self):
+        if not self.statement_timeout:
+            return None
+        return "SET statement_timeout = {};".format(int(self.statement_timeout))
+
+    #######################################################
+
+    # Helper to record()
+    def _adapt(self, seconds_per_row):
+        if self._best is None or seconds_per_row < self._best:
+            self._best = seconds_per_row
+
+        if seconds_per_row > self._best * self.slow_factor:
+            if self.speed > self.min_speed:
+                self.speed = max(self.min_speed, self.speed / 2)
+                self._ios.log_and_print(
+                    "Reads are slowing down; backing off to {:.0%} speed.".format(self.speed),
+                    self._ios.Severity.WARNING)
+        else:
+            self.speed = min(1.0, self.speed * self.recovery)
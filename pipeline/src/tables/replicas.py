@@ -0,0 +1,65 @@
+import threading
+import time
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..ios import ios
+
+
+""" Replicas
+The read-only replicas of a table's database, which heavy reads are spread
+over round-robin. A replica that fails is left out for recheck_seconds, after
+which it is health checked with SELECT 1 before it is used again.
+For more, see docs/db_ops.md
+"""
+class Replicas():
+
+    def __init__(self, engines, recheck_seconds=30, clock=time.monotonic):
+        self._ios = ios
+        self.engines = list(engines)
+        self.recheck_seconds = recheck_seconds
+        self._clock = clock
+        self._down = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    #######################################################
+
+    # Returns the next healthy replica's engine, or None if none are healthy.
+    def engine(self):
+        with self._lock:
+            for _ in range(len(self.engines)):
+                i = self._next
+                self._next = (i + 1) % len(self.engines)
+                if i in self._down:
+                    if self._clock() - self._down[i] < self.recheck_seconds:
+                        continue
+                    if not self._healthy(self.engines[i]):
+                        self._down[i] = self._clock()
+                        continue
+                    del self._down[i]
+                return self.engines[i]
+        return None
+
+    #######################################################
+
+    # Leaves engine out until it passes a health check recheck_seconds from
+    # now.
+    def mark_down(self, engine):
+        with self._lock:
+            for i, replica in enumerate(self.engines):
+                if replica is engine:
+                    self._down[i] = self._clock()
+                    self._ios.log_and_print(
+                        "Replica {} is down.".format(engine.url.host),
+                        self._ios.Severity.WARNING)
+
+    #######################################################
+
+    # Helper to engine()
+    def _healthy(self, engine):
+        try:
+            with engine.connect() as conn:
+                conn.execute("SELECT 1;")
+        except SQLAlchemyError:
+            return False
+        return True
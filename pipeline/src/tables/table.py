@@ -1,15 +1,30 @@
 import abc
+import collections
+import contextlib
+import copy
+import csv
+import io
+import re
 import sys
 import getpass
+import time
+import numpy as np
 import pandas
-from sqlalchemy import create_engine
+import psycopg2
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.engine.base import Engine
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 from ..ios import ios
+from .replicas import Replicas
 
 
+# The rows a write inserted, updated, and skipped (as duplicates, or rows that
+# were already there).
+WriteCounts = collections.namedtuple("WriteCounts", ["inserted", "updated", "skipped"])
+
 
 """ Extending Table
 Subclasses should not alter self._engine in any capacity.
@@ -26,6 +41,20 @@ class Table(abc.ABC):
         self._table_name = None
         self._index_col = None
         self._chunksize = 1000
+        # Rows per COPY batch of _write_table(), see set_writer().
+        self._write_batch_rows = 50000
+        # Column name: pandas dtype for typed ingestion, see set_typed().
+        self._dtypes = {}
+        self._typed = False
+        self._reader = "sql"
+        self._writer = "copy"
+        self._staging = "temporary"
+        # Setting name: value, SET LOCAL in every COPY write, see set_write_settings().
+        self._write_settings = {}
+        self._governor = None
+        # The "connect" listener that applies the governor's session settings.
+        self._session_listener = None
+        self._replicas = None
 
         if schema is None:
             self._schema = self._ios.prompt("Enter the table's schema: ")
@@ -63,11 +92,14 @@ class Table(abc.ABC):
         sql = "".join(["SELECT * FROM ", self._schema, ".", self._table_name, ";"])
         self._ios.log_and_print(sql)
         try:
-            df = pandas.read_sql(sql, self._engine, index_col=self._index_col)
+            df = self._read_frame(sql)
 
         except SQLAlchemyError as error:
             self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
             return None
+        except psycopg2.Error as error:
+            self._ios.log_and_print("psycopg2: " + str(error), ios.Severity.ERROR)
+            return None
         except (KeyError, ValueError) as error:
             self._ios.log_and_print("Pandas: " + str(error), ios.Severity.ERROR)
             return None
@@ -80,6 +112,147 @@ class Table(abc.ABC):
 
     #######################################################
 
+    # With typed set, query results keep compact typed columns (the dtypes in
+    # self._dtypes, such as Int32 or category) with pd.NA/NaT for nulls,
+    # instead of object columns with None for nulls. Returns whether the
+    # table supports typed ingestion.
+    def set_typed(self, typed):
+        self._typed = bool(typed) and bool(self._dtypes)
+        return self._typed == bool(typed)
+
+    #######################################################
+
+    # Chooses how get_full_table() and _query_table() read query results:
+    # "sql" fetches them row by row with pandas.read_sql, "copy" streams them
+    # as CSV with COPY (...) TO STDOUT and parses that with pandas.read_csv,
+    # which is much faster for large results. "copy" needs the table's dtypes
+    # to parse dates back. Returns whether the reader was set.
+    def set_reader(self, reader):
+        if reader not in ("sql", "copy") or (reader == "copy" and not self._dtypes):
+            return False
+        self._reader = reader
+        return True
+
+    #######################################################
+
+    # Chooses how _write_table() writes rows: "copy", the default, streams
+    # them with COPY ... FROM STDIN as CSV, _write_batch_rows rows at a time;
+    # "insert" sends them all in one INSERT ... VALUES statement. Returns
+    # whether the writer was set.
+    def set_writer(self, writer):
+        if writer not in ("copy", "insert"):
+            return False
+        self._writer = writer
+        return True
+
+    #######################################################
+
+    # Chooses the staging table that conflicting writes are copied into
+    # first: "temporary", the default, is private to the connection and
+    # dropped on commit; "unlogged" is a <table>_staging table that skips the
+    # write-ahead log and is kept for reuse. Returns whether it was set.
+    def set_staging(self, staging):
+        if staging not in ("temporary", "unlogged"):
+            return False
+        self._staging = staging
+        return True
+
+    #######################################################
+
+    # Runs every write of the "copy" writer with the Postgres settings of
+    # settings, a dict such as {"synchronous_commit": "off"}. They are set
+    # with SET LOCAL, so they end with the write's transaction and never
+    # reach other uses of the pooled connection. An empty dict writes with
+    # the defaults again. Returns False, changing nothing, if a setting name
+    # is not a valid identifier.
+    def set_write_settings(self, settings):
+        settings = dict(settings or {})
+        for name in settings:
+            if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", str(name)):
+                self._ios.log_and_print(
+                    "Invalid setting name: " + str(name), ios.Severity.ERROR)
+                return False
+        self._write_settings = settings
+        return True
+
+    #######################################################
+
+    # Puts the table's reads under governor, a ReadGovernor (see
+    # governor.py), or takes them out from under one with None. The
+    # governor's statement_timeout applies to every connection opened from
+    # here on, and replaces that of the previous governor; the pooled
+    # connections are closed so that it applies to all of them.
+    def set_governor(self, governor):
+        self._governor = governor
+        if not isinstance(self._engine, Engine):
+            return
+
+        engines = [self._engine]
+        if self._replicas is not None:
+            engines += self._replicas.engines
+
+        if self._session_listener is not None:
+            for engine in engines:
+                if event.contains(engine, "connect", self._session_listener):
+                    event.remove(engine, "connect", self._session_listener)
+            self._session_listener = None
+
+        session_sql = None if governor is None else governor.session_sql()
+        if session_sql is not None:
+            def configure(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute(session_sql)
+                cursor.close()
+
+            self._session_listener = configure
+            for engine in engines:
+                event.listen(engine, "connect", configure)
+        for engine in engines:
+            engine.dispose()
+
+    #######################################################
+
+    # Routes the table's heavy reads (get_full_table(), _query_table(),
+    # _query_table_chunks() and _query_table_keyset()) to the read-only
+    # replicas at hosts ("hostname" or "hostname:port"), which share the
+    # primary's credentials, database name, port and governor session
+    # settings. Writes, DDL and snapshot reads stay on the primary, as do
+    # reads while no replica is healthy. An empty list routes everything to
+    # the primary again.
+    def set_replicas(self, hosts, recheck_seconds=30):
+        if not hosts or not isinstance(self._engine, Engine):
+            self._replicas = None
+            return
+
+        engines = [self._replica_engine(host) for host in hosts]
+        self._replicas = Replicas(engines, recheck_seconds)
+        self._ios.log_and_print("Reading {} from replicas: {}".format(
+            self._table_name, ", ".join(str(host) for host in hosts)))
+
+    #######################################################
+
+    # Helper to set_replicas()
+    # An engine for the replica at host ("hostname" or "hostname:port"), set up
+    # like the primary's: its URL, with the primary's port if host has none,
+    # and the governor's session settings (see set_governor()).
+    def _replica_engine(self, host):
+        hostname, _, port = str(host).partition(":")
+        port = int(port) if port else self._engine.url.port
+        url = self._engine.url
+        if hasattr(url, "set"):
+            url = url.set(host=hostname, port=port)
+        else:
+            url = copy.copy(url)
+            url.host = hostname
+            url.port = port
+
+        engine = create_engine(url)
+        if self._session_listener is not None:
+            event.listen(engine, "connect", self._session_listener)
+        return engine
+
+    #######################################################
+
     def create_schema(self):
         if not isinstance(self._engine, Engine):
             self._ios.log_and_print("self._engine is not an Engine, cannot continue.", ios.Severity.ERROR)
@@ -158,6 +331,111 @@ class Table(abc.ABC):
 
         return True
 
+    #######################################################
+
+    """
+    Drops the table's foreign keys and its indexes other than those of its
+    primary key and unique constraints, so that a large backfill does not pay
+    for checking and maintaining them row by row. Their definitions are first
+    saved in the schema's suspended_ddl table, in the same transaction as the
+    drops, so they are never lost: restore_constraints() rebuilds them, and
+    should be run after the backfill and again at the start of the next run in
+    case a crash prevented it.
+
+    :argument   None
+    :returns    whether the constraints were suspended.
+    """
+    def suspend_constraints(self):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("self._engine is not an Engine, cannot continue.", ios.Severity.ERROR)
+            return False
+
+        table = "".join([self._schema, ".", self._table_name])
+        try:
+            with self._engine.begin() as conn:
+                conn.execute("".join([
+                    "CREATE TABLE IF NOT EXISTS ", self._schema, ".suspended_ddl ",
+                    "(table_name TEXT, name TEXT, kind TEXT, definition TEXT, ",
+                    "PRIMARY KEY (table_name, name));"]))
+                foreign_keys = conn.execute("".join([
+                    "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint ",
+                    "WHERE conrelid = '", table, "'::regclass AND contype = 'f';"])).fetchall()
+                indexes = conn.execute("".join([
+                    "SELECT i.relname, pg_get_indexdef(x.indexrelid) FROM pg_index x ",
+                    "JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = '", table,
+                    "'::regclass AND NOT EXISTS (SELECT 1 FROM pg_constraint c ",
+                    "WHERE c.conindid = x.indexrelid);"])).fetchall()
+
+                save = text("".join([
+                    "INSERT INTO ", self._schema, ".suspended_ddl VALUES ",
+                    "(:table_name, :name, :kind, :definition) ON CONFLICT DO NOTHING;"]))
+                for kind, rows in (("foreign key", foreign_keys), ("index", indexes)):
+                    for name, definition in rows:
+                        conn.execute(save, table_name=self._table_name, name=name,
+                                     kind=kind, definition=definition)
+                for name, _ in foreign_keys:
+                    conn.execute("".join(["ALTER TABLE ", table, " DROP CONSTRAINT ", name, ";"]))
+                for name, _ in indexes:
+                    conn.execute("".join(["DROP INDEX ", self._schema, ".", name, ";"]))
+
+        except SQLAlchemyError as error:
+            self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
+            return False
+
+        self._ios.log_and_print("Suspended {} foreign keys and {} indexes of {}.".format(
+            len(foreign_keys), len(indexes), table))
+        return True
+
+    #######################################################
+
+    """
+    Rebuilds the constraints and indexes that suspend_constraints() dropped,
+    one at a time, each forgotten only once it is back. Indexes are built with
+    CREATE INDEX CONCURRENTLY, and foreign keys are added NOT VALID and then
+    validated, so every key is checked once in bulk while the table stays
+    writable. Does nothing if nothing is suspended. If a foreign key does not
+    validate, a warning is logged and it stays NOT VALID, still enforced on
+    new rows, and its validation is retried on the next call.
+
+    :argument   None
+    :returns    whether every constraint and index is back in force; a key
+                that is only left NOT VALID counts as back.
+    """
+    def restore_constraints(self):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("self._engine is not an Engine, cannot continue.", ios.Severity.ERROR)
+            return False
+
+        state = "".join([self._schema, ".suspended_ddl"])
+        try:
+            # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+            with self._engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                if conn.execute("".join(["SELECT to_regclass('", state, "');"])).scalar() is None:
+                    return True
+
+                rows = conn.execute(text("".join([
+                    "SELECT name, kind, definition FROM ", state,
+                    " WHERE table_name = :table_name ORDER BY kind DESC, name;"])),
+                    table_name=self._table_name).fetchall()
+                for name, kind, definition in rows:
+                    self._ios.log_and_print("Restoring {} {}.".format(kind, name))
+                    if kind == "index":
+                        self._restore_index(conn, name, definition)
+                    elif not self._restore_foreign_key(conn, name, definition):
+                        continue
+                    conn.execute(text("".join([
+                        "DELETE FROM ", state, " WHERE table_name = :table_name AND name = :name;"])),
+                        table_name=self._table_name, name=name)
+
+        except SQLAlchemyError as error:
+            self._ios.log_and_print(
+                "SQLAlchemy: " + str(error).splitlines()[0] +
+                "; the rest stays in " + state + " for the next restore.",
+                ios.Severity.ERROR)
+            return False
+
+        return True
+
     ###########################################################################
     # Protected Methods
 
@@ -170,13 +448,9 @@ class Table(abc.ABC):
         #   if conflict_columns is None, will not do ON CONFLICT.
         #   ON CONFLICT is always set to DO NOTHING. This is to ensure there
         #   are no errors when inserting a duplicate row.
-        #
-        # TODO: Add an update option to ON CONFLICT.
-        # Currently ON CONFLICT only exists to stop postgres from
-        # throwing a fit whenever there's a duplicate insert. Would be useful
-        # to have an option to overwrite the duplicate data instead.
-        # Will be very useful for updating the flags table without dropping
-        # the whole thing.
+        # The rows are written with the writer chosen by set_writer(), in one
+        # transaction either way. To overwrite duplicate rows instead, see
+        # _upsert_table().
 
         if not self._table_name:
             self._ios.log_and_print(
@@ -194,6 +468,8 @@ class Table(abc.ABC):
             return False
 
         self._ios.log_and_print("Writing to table.")
+        if self._writer == "copy":
+            return self._copy_table(df, conflict_columns) is not None
 
         columns = ", ".join(list(df))
         # (value1, value2, ...), (value1, value2, ...), ...
@@ -227,26 +503,307 @@ class Table(abc.ABC):
 
     #######################################################
 
-    def _check_cols(self, sample_df):
-        # Check the columns of input df to make sure it matches what we expect.
+    # Like _write_table(), but on a conflict on conflict_columns the existing
+    # row is updated to df's row if update is set (and differs from it), and
+    # left as it was otherwise. df is copied into a staging table and merged
+    # from there (see set_staging()), in one transaction. Returns the
+    # WriteCounts of the rows inserted, updated and skipped, or None if an
+    # error occurred.
+    def _upsert_table(self, df, conflict_columns, update=False):
+        if not self._table_name:
+            self._ios.log_and_print(
+                "_upsert_table not called by a subclass.", ios.Severity.ERROR)
+            return None
+
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
+            return None
+
+        if not self._check_cols(df):
+            self._ios.log_and_print(
+                "the columns of data does not match required columns",
+                ios.Severity.ERROR)
+            return None
+
+        counts = self._copy_table(df, conflict_columns, update)
+        if counts is not None:
+            self._ios.log_and_print("{} rows inserted, {} updated, {} skipped.".format(*counts))
+        return counts
+
+    #######################################################
+
+    """
+    Writes df like _write_table(), but over up to streams connections at
+    once: the rows of each value of partition_column (e.g. a service date)
+    are written in their own transaction, so each partition is either written
+    whole or not at all. A partition whose write fails is retried up to
+    retries times. Conflicting writes always stage in temporary tables, as
+    streams cannot share one unlogged staging table. Since a failed partition
+    leaves nothing behind and conflicts are skipped, a partition reported as
+    failed can simply be written again.
+
+    :argument   a well formed DataFrame, the name of the column to split it
+                by, the number of connections, and optionally the conflict
+                columns and number of retries per partition
+    :returns    the list of partition values that could not be written, which
+                is empty if everything was written.
+    """
+    def _write_table_streams(self, df, partition_column, streams, conflict_columns=None, retries=1):
+        if not self._table_name:
+            self._ios.log_and_print(
+                "_write_table_streams not called by a subclass.", ios.Severity.ERROR)
+            return None
+
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
+            return None
+
+        if not self._check_cols(df):
+            self._ios.log_and_print(
+                "the columns of data does not match required columns",
+                ios.Severity.ERROR)
+            return None
+
+        partitions = [(value, part) for value, part in df.groupby(partition_column, sort=True)]
+        self._ios.log_and_print("Writing {} partitions over {} streams.".format(
+            len(partitions), streams))
+
+        def write(partition):
+            value, part = partition
+            for attempt in range(retries + 1):
+                if self._copy_table(part, conflict_columns, staging="temporary") is not None:
+                    return None
+                if attempt < retries:
+                    self._ios.log_and_print(
+                        "Retrying partition {} ({} of {}).".format(value, attempt + 1, retries),
+                        ios.Severity.WARNING)
+            return value
+
+        with ThreadPoolExecutor(max_workers=max(1, streams)) as pool:
+            failed = [value for value in pool.map(write, partitions) if value is not None]
+
+        if failed:
+            self._ios.log_and_print(
+                "Partitions not written: " + ", ".join(str(value) for value in failed),
+                ios.Severity.ERROR)
+        return failed
+
+    #######################################################
+
+    # Helper to _write_table() and _upsert_table()
+    # Streams df into the table with COPY FROM STDIN, _write_batch_rows rows
+    # at a time, so only one batch is ever serialized in memory. COPY cannot
+    # handle conflicts, so with conflict_columns each batch is copied into the
+    # staging table first and merged with INSERT ... SELECT ... ON CONFLICT.
+    # staging overrides the table's staging (see set_staging()). Returns
+    # WriteCounts, or None if an error occurred.
+    def _copy_table(self, df, conflict_columns=None, update=False, staging=None):
+        table = "".join([self._schema, ".", self._table_name])
+        columns = ", ".join(list(df))
+        self._ios.log_and_print("Writing to: " + table)
+
+        try:
+            conn = self._engine.raw_connection()
+        except SQLAlchemyError as error:
+            self._ios.log_and_print(
+                "SQLAlchemyError: " + str(error).splitlines()[0], ios.Severity.ERROR)
+            return None
+
+        inserted = updated = 0
+        try:
+            cursor = conn.cursor()
+            for name, value in self._write_settings.items():
+                cursor.execute("SET LOCAL {} = '{}';".format(name, str(value).replace("'", "''")))
+            target = table
+            if conflict_columns:
+                target = self._create_staging(cursor, staging or self._staging)
+                merge_sql = self._merge_sql(target, list(df), conflict_columns, update)
+
+            copy_sql = "".join(["COPY ", target, " (", columns, ") FROM STDIN WITH (FORMAT csv)"])
+            for start in range(0, len(df.index), self._write_batch_rows):
+                batch = df.iloc[start:start + self._write_batch_rows]
+                buffer = io.StringIO()
+                batch.to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+
+                if not conflict_columns:
+                    inserted += len(batch.index)
+                    continue
+                cursor.execute(merge_sql)
+                batch_inserted, batch_updated = cursor.fetchone()
+                inserted += batch_inserted
+                updated += batch_updated
+                cursor.execute("".join(["TRUNCATE ", target, ";"]))
+
+            cursor.close()
+            conn.commit()
+        except (SQLAlchemyError, psycopg2.Error) as error:
+            conn.rollback()
+            self._ios.log_and_print(
+                "COPY: " + str(error).splitlines()[0], ios.Severity.ERROR)
+            return None
+        finally:
+            conn.close()
+
+        return WriteCounts(inserted, updated, len(df.index) - inserted - updated)
+
+    #######################################################
+
+    # Helper to _copy_table()
+    # Creates the staging table, as named by set_staging(), if need be, and
+    # returns its name. A temporary table is dropped on commit; an unlogged
+    # one is kept, empty, for the next write. Besides the table's columns, it
+    # numbers the staged rows in the order they were copied (_staged_row).
+    def _create_staging(self, cursor, staging):
+        table = "".join([self._schema, ".", self._table_name])
+        if staging == "unlogged":
+            staging = table + "_staging"
+            cursor.execute("".join([
+                "CREATE UNLOGGED TABLE IF NOT EXISTS ", staging, " (LIKE ", table,
+                " INCLUDING DEFAULTS, _staged_row BIGSERIAL);"]))
+            cursor.execute("".join(["TRUNCATE ", staging, ";"]))
+            return staging
+
+        staging = "".join(["_", self._table_name, "_staging"])
+        cursor.execute("".join([
+            "CREATE TEMPORARY TABLE ", staging, " (LIKE ", table,
+            " INCLUDING DEFAULTS, _staged_row BIGSERIAL) ON COMMIT DROP;"]))
+        return staging
+
+    #######################################################
+
+    # Helper to _copy_table()
+    # The SQL that moves the rows of staging into the table and selects how
+    # many were inserted and how many updated. A new row has no xmax. Rows
+    # that would not change are not updated, and with update only the last
+    # staged of the rows that share a key is kept, since a statement cannot
+    # update one row twice. The last is kept so that the batch ends as if its
+    # rows had been written one after another.
+    def _merge_sql(self, staging, columns, conflict_columns, update):
+        values = [col for col in columns if col not in conflict_columns]
+        update = update and bool(values)
+        select = "SELECT "
+        order = ""
+        if update:
+            select = "".join(["SELECT DISTINCT ON (", ", ".join(conflict_columns), ") "])
+            order = "".join([" ORDER BY ", ", ".join(conflict_columns), ", _staged_row DESC"])
+
+        action = "DO NOTHING"
+        if update:
+            action = "".join([
+                "DO UPDATE SET ",
+                ", ".join(["{0} = EXCLUDED.{0}".format(col) for col in values]),
+                " WHERE (", ", ".join(["t." + col for col in values]),
+                ") IS DISTINCT FROM (",
+                ", ".join(["EXCLUDED." + col for col in values]), ")"])
+
+        return "".join([
+            "WITH written AS (INSERT INTO ", self._schema, ".", self._table_name,
+            " AS t (", ", ".join(columns), ") ", select, ", ".join(columns),
+            " FROM ", staging, order, " ON CONFLICT (", ", ".join(conflict_columns), ") ",
+            action, " RETURNING (t.xmax = 0) AS inserted) ",
+            "SELECT count(*) FILTER (WHERE inserted), ",
+            "count(*) FILTER (WHERE NOT inserted) FROM written;"])
+
+    #######################################################
+
+    # Helper to restore_constraints()
+    # A crash during CREATE INDEX CONCURRENTLY leaves an invalid index behind,
+    # which is dropped and built again.
+    def _restore_index(self, conn, name, definition):
+        valid = conn.execute(text("".join([
+            "SELECT x.indisvalid FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid ",
+            "JOIN pg_namespace n ON n.oid = i.relnamespace ",
+            "WHERE n.nspname = :schema AND i.relname = :name;"])),
+            schema=self._schema, name=name).scalar()
+        if valid:
+            return
+        if valid is not None:
+            conn.execute("".join(["DROP INDEX CONCURRENTLY ", self._schema, ".", name, ";"]))
+        conn.execute(re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX CONCURRENTLY ", definition))
+
+    #######################################################
+
+    # Helper to restore_constraints()
+    # Adds the foreign key NOT VALID, if it is not there yet, and validates it.
+    # Returns whether it was validated.
+    def _restore_foreign_key(self, conn, name, definition):
+        table = "".join([self._schema, ".", self._table_name])
+        exists = conn.execute(text("".join([
+            "SELECT 1 FROM pg_constraint WHERE conrelid = '", table,
+            "'::regclass AND conname = :name;"])), name=name).scalar()
+        if exists is None:
+            conn.execute("".join([
+                "ALTER TABLE ", table, " ADD CONSTRAINT ", name, " ", definition, " NOT VALID;"]))
+
+        try:
+            conn.execute("".join(["ALTER TABLE ", table, " VALIDATE CONSTRAINT ", name, ";"]))
+        except SQLAlchemyError as error:
+            self._ios.log_and_print(
+                "Cannot validate " + name + ": " + str(error).splitlines()[0] +
+                "; it stays NOT VALID, enforced on new rows only, until the next restore.",
+                ios.Severity.WARNING)
+            return False
+        return True
+
+    #######################################################
+
+    def _check_cols(self, sample_df, columns=None):
+        # Check the columns of input df to make sure it matches what we expect:
+        # the projection of columns (see _projection()) if given, otherwise
+        # every expected column.
 
         # We may or may not care about the order of the columns. If not, then
         # wrap both sides in set().
-        if set(list(sample_df)) != set(self._expected_cols):
+        expected = self._expected_cols if columns is None else self._projection(columns)
+        if set(list(sample_df)) != set(expected):
             return False
 
         return True
 
     #######################################################
 
+    # The names in columns that are expected columns of the table, in the
+    # table's column order. Other names, such as the index column, are
+    # dropped. None stands for every column.
+    def _projection(self, columns):
+        if columns is None:
+            return None
+        return [col for col in self._expected_cols if col in columns]
+
+    #######################################################
+
+    # The SELECT list of a query that reads the projection of columns (see
+    # _projection()) and the index column: "*" if columns is None.
+    def _select_list(self, columns):
+        if columns is None:
+            return "*"
+        return ", ".join([self._index_col] + self._projection(columns))
+
+    #######################################################
+
     """
-    Queries the C-Tran data table using the given SQL query.
+    Queries the C-Tran data table using the given SQL query. If sql selects
+    only some columns (see _select_list()), columns should name them so the
+    result is checked against them rather than every expected column.
 
-    :argument   a SQL query string
+    :argument   a SQL query string, and optionally the list of columns read
     :returns    a DataFrame containing query results, or
                 None if an exception occurred.
     """
-    def _query_table(self, sql):
+    def _query_table(self, sql, columns=None):
+        df = self._fetch_table(sql, columns)
+        if df is None:
+            return None
+        return self._clean_frame(df)
+
+    #######################################################
+
+    # Helper to _query_table()
+    # Reads and checks the result of sql like _query_table(), but returns it
+    # as read, before _clean_frame(), or None if an exception occurred.
+    def _fetch_table(self, sql, columns=None):
         if not isinstance(self._engine, Engine):
             self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
             return None
@@ -254,23 +811,403 @@ class Table(abc.ABC):
         df = None
         self._ios.log_and_print(sql)
         try:
-            df = pandas.read_sql(sql, self._engine, index_col=self._index_col)
+            df = self._read_frame(sql)
 
         except SQLAlchemyError as error:
             self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
             return None
+        except psycopg2.Error as error:
+            self._ios.log_and_print("psycopg2: " + str(error), ios.Severity.ERROR)
+            return None
         except (ValueError, KeyError) as error:
             self._ios.log_and_print("Pandas: " + str(error), ios.Severity.ERROR)
             return None
 
-        if not self._check_cols(df):
+        if not self._check_cols(df, columns):
             self._ios.log_and_print("the columns of read data does not match the specified columns" , ios.Severity.ERROR)
             return None
 
+        return df
+
+    #######################################################
+
+    # Helper to get_full_table() and _fetch_table()
+    # Reads the result of sql, indexed by the index column, with the reader
+    # chosen by set_reader(), from a replica if there is a healthy one. If the
+    # replica fails, it is marked down and the primary is read instead.
+    # Raises SQLAlchemyError, psycopg2.Error or the errors of pandas.
+    def _read_frame(self, sql):
+        engine = self._read_engine()
+        try:
+            return self._read_frame_from(sql, engine)
+        except (SQLAlchemyError, psycopg2.Error) as error:
+            if engine is self._engine:
+                raise
+            self._replica_failed(engine, error)
+            return self._read_frame_from(sql, self._engine)
+
+    #######################################################
+
+    # Helper to _read_frame()
+    def _read_frame_from(self, sql, engine):
+        if self._reader == "copy":
+            return self._governed(lambda: self._copy_frame(sql, engine))
+        return self._governed(
+            lambda: pandas.read_sql(sql, engine, index_col=self._index_col))
+
+    #######################################################
+
+    # The engine heavy reads go to: a healthy replica, or the primary.
+    def _read_engine(self):
+        if self._replicas is None:
+            return self._engine
+        return self._replicas.engine() or self._engine
+
+    #######################################################
+
+    def _replica_failed(self, engine, error):
+        self._replicas.mark_down(engine)
+        self._ios.log_and_print(
+            "Replica read failed, using the primary: " + str(error).splitlines()[0],
+            ios.Severity.WARNING)
+
+    #######################################################
+
+    # Helper to the query methods
+    # Returns read(), a function that reads a DataFrame. If the table has a
+    # governor, read() runs in one of its query slots and the read is
+    # recorded with it, which may sleep to slow the reads down.
+    def _governed(self, read):
+        if self._governor is None:
+            return read()
+
+        with self._governor.query():
+            started = time.monotonic()
+            df = read()
+            seconds = time.monotonic() - started
+        self._governor.record(len(df.index), seconds)
+        return df
+
+    #######################################################
+
+    # Helper to _read_frame()
+    # Runs sql through COPY (sql) TO STDOUT as CSV into memory and parses it.
+    # Columns are typed as read_sql would type them: numbers by their values,
+    # text as strings, and dates as datetime.date objects unless typed
+    # ingestion is on.
+    def _copy_frame(self, sql, engine):
+        copy_sql = "".join(["COPY (", sql.strip().rstrip(";"),
+                            ") TO STDOUT WITH (FORMAT csv, HEADER true)"])
+        buffer = io.StringIO()
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert(copy_sql, buffer)
+            cursor.close()
+        finally:
+            conn.close()
+
+        buffer.seek(0)
+        header = next(csv.reader([buffer.readline()]), [])
+        buffer.seek(0)
+        return self._read_csv_frame(buffer, header)
+
+    #######################################################
+
+    # Helper to _copy_frame() and to reading a table's rows from files
+    # Parses the CSV source (a file path or buffer) whose columns are header,
+    # typing its columns as _copy_frame() does. Pass usecols to parse only
+    # some of them. Raises the errors of pandas.read_csv.
+    def _read_csv_frame(self, source, header, usecols=None):
+        if usecols is not None:
+            header = [col for col in header if col in usecols]
+        dates = [col for col in header
+                 if self._dtypes.get(col, "").startswith("datetime64")]
+        text = {col: object for col in header if self._dtypes.get(col) == "category"}
+        df = pandas.read_csv(source, index_col=self._index_col, dtype=text,
+                             parse_dates=dates, usecols=usecols)
+        if not self._typed:
+            # An empty result is not parsed as dates, so it is converted first.
+            for col in dates:
+                df[col] = pandas.to_datetime(df[col]).dt.date
+        return df
+
+    #######################################################
+
+    """
+    Queries the table like _query_table, but yields the result in DataFrames
+    of about chunksize rows so that only one chunk is held in memory at once.
+    The query runs on a server-side cursor (stream_results), so the database
+    driver fetches chunksize rows at a time rather than buffering the whole
+    result first. sql should be ordered by group_columns, if given; rows
+    sharing the values of group_columns are then never split across chunks
+    (the trailing group of a chunk is carried over into the next one).
+    columns is as for _query_table.
+
+    :argument   a SQL query string, the number of rows per chunk, and optional
+                lists of group and read column names
+    :yields     DataFrames of query results, or None if an exception occurred,
+                after which nothing more is yielded.
+    """
+    def _query_table_chunks(self, sql, chunksize, group_columns=None, columns=None):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
+            yield None
+            return
+
+        self._ios.log_and_print(sql)
+        slot = contextlib.ExitStack()
+        engine = self._read_engine()
+        conn = None
+        carry = None
+        try:
+            if self._governor is not None:
+                slot.enter_context(self._governor.query())
+            conn = engine.connect().execution_options(stream_results=True)
+            frames = pandas.read_sql(sql, conn, index_col=self._index_col, chunksize=chunksize)
+            if self._governor is not None:
+                frames = self._governor.chunks(frames)
+            for df in frames:
+                if not self._check_cols(df, columns):
+                    self._ios.log_and_print("the columns of read data does not match the specified columns" , ios.Severity.ERROR)
+                    yield None
+                    return
+
+                if carry is not None:
+                    df = pandas.concat([carry, df])
+                if group_columns:
+                    df, carry = self._split_last_group(df, group_columns)
+                    if df.empty:
+                        continue
+
+                yield self._clean_frame(df)
+
+        except SQLAlchemyError as error:
+            if engine is not self._engine:
+                self._replicas.mark_down(engine)
+            self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
+            yield None
+            return
+        except (ValueError, KeyError) as error:
+            self._ios.log_and_print("Pandas: " + str(error), ios.Severity.ERROR)
+            yield None
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+            slot.close()
+
+        if carry is not None and not carry.empty:
+            yield self._clean_frame(carry)
+
+    #######################################################
+
+    """
+    Queries the table a page at a time using keyset pagination on the index
+    column: each page is "WHERE <where> AND <index> > <last> ORDER BY <index>
+    LIMIT page_size", so no cursor is held open between pages and each page
+    costs an index seek however far into the scan it is. If a page fails, it
+    is retried from the last row read up to retries times, which lets a long
+    scan survive a dropped connection. Only the projection of columns is read
+    (see _select_list()), or every column if columns is None.
+
+    :argument   a SQL condition (or None for the whole table), the number of
+                rows per page, the index value to start after (or None to
+                start at the beginning), the number of retries per page, and
+                optionally the list of columns to read
+    :yields     DataFrames of query results, or None if an exception occurred,
+                after which nothing more is yielded.
+    """
+    def _query_table_keyset(self, where, page_size, last_key=None, retries=0, columns=None):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
+            yield None
+            return
+
+        attempts = 0
+        while True:
+            conditions = [] if where is None else ["(" + where + ")"]
+            if last_key is not None:
+                conditions.append(self._index_col + " > %(last_key)s")
+
+            sql = "".join(["SELECT ", self._select_list(columns), " FROM ",
+                           self._schema, ".", self._table_name,
+                           " WHERE " if conditions else "",
+                           " AND ".join(conditions),
+                           " ORDER BY ", self._index_col,
+                           " LIMIT %(page_size)s;"])
+            params = {"last_key": last_key, "page_size": int(page_size)}
+            self._ios.log_and_print(sql.replace("%(last_key)s", str(last_key)))
+            engine = self._read_engine()
+            try:
+                df = self._governed(lambda: pandas.read_sql(
+                    sql, engine, index_col=self._index_col, params=params))
+
+            except SQLAlchemyError as error:
+                if engine is not self._engine:
+                    # Try the next replica, or the primary, without using up
+                    # a retry.
+                    self._replica_failed(engine, error)
+                    continue
+                if attempts < retries:
+                    attempts += 1
+                    self._ios.log_and_print(
+                        "SQLAlchemy: {}; retrying after {} ({}/{}).".format(
+                            str(error).splitlines()[0], last_key, attempts, retries),
+                        ios.Severity.WARNING)
+                    # Drop pooled connections that may have gone stale.
+                    self._engine.dispose()
+                    continue
+                self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
+                yield None
+                return
+            except (ValueError, KeyError) as error:
+                self._ios.log_and_print("Pandas: " + str(error), ios.Severity.ERROR)
+                yield None
+                return
+
+            if not self._check_cols(df, columns):
+                self._ios.log_and_print("the columns of read data does not match the specified columns" , ios.Severity.ERROR)
+                yield None
+                return
+
+            attempts = 0
+            if df.empty:
+                return
+
+            last_key = df.index[-1]
+            yield self._clean_frame(df)
+            if len(df.index) < page_size:
+                return
+
+    #######################################################
+
+    """
+    Runs each query of sqls on its own connection, up to readers at a time,
+    and yields their results in the order of sqls. Every reader joins one
+    snapshot exported by a coordinating transaction (pg_export_snapshot and
+    SET TRANSACTION SNAPSHOT), so together the results are as consistent as
+    a single query, even while the table is being written to. At most readers
+    results are read ahead of the one being consumed. columns is as for
+    _query_table.
+
+    :argument   a list of SQL query strings, the number of connections to read
+                with, and optionally the list of columns read
+    :yields     a DataFrame per query, or None if an exception occurred, after
+                which nothing more is yielded.
+    """
+    def _query_table_shards(self, sqls, readers, columns=None):
+        if not isinstance(self._engine, Engine):
+            self._ios.log_and_print("invalid engine", ios.Severity.ERROR)
+            yield None
+            return
+
+        coordinator = None
+        executor = ThreadPoolExecutor(max_workers=readers)
+        pending = collections.deque()
+        try:
+            coordinator = self._engine.connect()
+            transaction = coordinator.begin()
+            coordinator.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            snapshot = coordinator.execute("SELECT pg_export_snapshot();").scalar()
+            self._ios.log_and_print(
+                "Reading {} shards over {} connections in snapshot {}.".format(
+                    len(sqls), readers, snapshot))
+
+            sqls = iter(sqls)
+            for sql in sqls:
+                pending.append(executor.submit(self._read_shard, sql, snapshot))
+                if len(pending) == readers:
+                    break
+
+            while pending:
+                df = pending.popleft().result()
+                for sql in sqls:
+                    pending.append(executor.submit(self._read_shard, sql, snapshot))
+                    break
+
+                if not self._check_cols(df, columns):
+                    self._ios.log_and_print("the columns of read data does not match the specified columns" , ios.Severity.ERROR)
+                    yield None
+                    return
+                yield self._clean_frame(df)
+
+            transaction.commit()
+
+        except SQLAlchemyError as error:
+            self._ios.log_and_print("SQLAlchemy: " + str(error), ios.Severity.ERROR)
+            yield None
+            return
+        except (ValueError, KeyError) as error:
+            self._ios.log_and_print("Pandas: " + str(error), ios.Severity.ERROR)
+            yield None
+            return
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if coordinator is not None:
+                coordinator.close()
+
+    #######################################################
+
+    # Helper to _query_table_shards()
+    # Reads sql in a read-only transaction that has joined snapshot.
+    def _read_shard(self, sql, snapshot):
+        self._ios.log_and_print(sql)
+        with self._engine.connect() as conn:
+            transaction = conn.begin()
+            try:
+                conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+                conn.execute("SET TRANSACTION SNAPSHOT '{}';".format(snapshot))
+                return self._governed(
+                    lambda: pandas.read_sql(sql, conn, index_col=self._index_col))
+            finally:
+                transaction.rollback()
+    #######################################################
+
+    # Helper to _query_table_chunks()
+    # Splits df, which is ordered by group_columns, into the rows before its
+    # last group and the last group itself.
+    def _split_last_group(self, df, group_columns):
+        if df.empty:
+            return df, None
+        keys = df[group_columns].values
+        different = np.flatnonzero((keys != keys[-1]).any(axis=1))
+        split = different[-1] + 1 if len(different) else 0
+        return df.iloc[:split], df.iloc[split:]
+
+    #######################################################
+
+    def _clean_frame(self, df):
+        if self._typed:
+            return self._typed_frame(df)
+
         #Converts NaN to None, can't do the same with NaT: null flagger takes care
-        df1 = df.where(df.notnull(), None)
+        return df.where(df.notnull(), None)
+
+    #######################################################
 
-        return df1
+    # Helper to _clean_frame()
+    # Converts the columns of df named in self._dtypes to their dtype. A column
+    # that cannot be converted is logged and left as it was read.
+    def _typed_frame(self, df):
+        columns = {}
+        for col, dtype in self._dtypes.items():
+            if col not in df:
+                continue
+            try:
+                if dtype.startswith("datetime64"):
+                    columns[col] = pandas.to_datetime(df[col]).astype(dtype)
+                elif dtype == "category":
+                    columns[col] = df[col].astype(dtype)
+                else:
+                    columns[col] = pandas.to_numeric(df[col]).astype(dtype)
+            except (ValueError, TypeError) as error:
+                self._ios.log_and_print(
+                    "Cannot read {} as {}: {}".format(col, dtype, error),
+                    ios.Severity.WARNING)
+        return df.assign(**columns)
 
     ###########################################################################
     # Private Methods
@@ -1,6 +1,7 @@
 import pytest
 import os
 import json
+import numpy as np
 from datetime import datetime
 from src.config import Config
 from src.config import BoundsResult
@@ -111,3 +112,15 @@ def test_save_config(loaded_config, tmp_path):
 
     return loaded_config
 
+
+def test_typed_bounds(loaded_config):
+    bounds = loaded_config.typed_bounds()
+    assert bounds["vehicle_number"] == (0.0, None)
+    assert bounds["maximum_speed"] == (0.0, 150.0)
+    assert bounds["service_date"] == (np.datetime64("1990-01-01", "ns"), None)
+    assert bounds["no_bounds"] == (None, None)
+
+def test_typed_bounds_cached_until_set(loaded_config):
+    assert loaded_config.typed_bounds() is loaded_config.typed_bounds()
+    loaded_config.set_bounds("maximum_speed", 1, 2)
+    assert loaded_config.typed_bounds()["maximum_speed"] == (1.0, 2.0)
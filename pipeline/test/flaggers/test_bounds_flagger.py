@@ -0,0 +1,55 @@
+from flaggers.flagger import flaggers, Flags
+from src.config import Config
+from datetime import date
+import pytest
+import pandas
+
+@pytest.fixture
+def bounds_flagger():
+	return [f for f in flaggers if f.name == 'Bounds'][0]
+
+@pytest.fixture
+def bounds_config():
+	config = Config()
+	config._data["columns"] = {
+		"vehicle_number": {"max": "NA", "min": 0},
+		"maximum_speed": {"max": 150, "min": 0},
+		"service_date": {"max": "NA", "min": "1990-01-01"},
+		"not_a_column": {"max": 1, "min": 0},
+	}
+	return config
+
+@pytest.fixture
+def bounds_frame():
+	return pandas.DataFrame({
+		"vehicle_number": [-1, 5, None],
+		"maximum_speed": [10, 151, None],
+		"service_date": [date(1989, 12, 31), date(2020, 1, 1), None],
+	}, dtype=object)
+
+def test_bounds_flag_frame(bounds_flagger, bounds_frame, bounds_config):
+	masks = bounds_flagger.flag_frame(bounds_frame, bounds_config)
+	assert set(masks) == {
+		Flags.VEHICLE_NUMBER_BELOW_MIN,
+		Flags.MAXIMUM_SPEED_BELOW_MIN,
+		Flags.MAXIMUM_SPEED_ABOVE_MAX,
+		Flags.SERVICE_DATE_BELOW_MIN,
+	}
+	assert masks[Flags.VEHICLE_NUMBER_BELOW_MIN].tolist() == [True, False, False]
+	assert masks[Flags.MAXIMUM_SPEED_BELOW_MIN].tolist() == [False, False, False]
+	assert masks[Flags.MAXIMUM_SPEED_ABOVE_MAX].tolist() == [False, True, False]
+	assert masks[Flags.SERVICE_DATE_BELOW_MIN].tolist() == [True, False, False]
+
+def test_bounds_flag(bounds_flagger, bounds_config):
+	row = {"vehicle_number": 3, "maximum_speed": 200, "service_date": date(2020, 1, 1)}
+	assert bounds_flagger.flag(row, bounds_config) == [Flags.MAXIMUM_SPEED_ABOVE_MAX]
+
+def test_bounds_flag_frame_no_bounds(bounds_flagger, bounds_frame):
+	assert bounds_flagger.flag_frame(bounds_frame, Config()) == {}
+
+def test_bounds_flags_match_config(bounds_flagger):
+	# Every column bounded in assets/config.json has its pair of flags, and
+	# no other column has one.
+	config = Config()
+	assert config.load()
+	assert set(bounds_flagger.bound_flags) == set(config._data["columns"])
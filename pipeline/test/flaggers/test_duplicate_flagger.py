@@ -1,4 +1,7 @@
 from flaggers.flagger import flaggers, Flags
+from flaggers.duplicate import fingerprint
+from src.config import Config
+from datetime import date
 import pytest
 import pandas
 import numpy as np
@@ -66,3 +69,55 @@ def test_duplicate_flagger_sad(duplicate_flagger, no_duplications):
 def test_duplicate_flagger_bad(duplicate_flagger):
     with pytest.raises(ValueError):
         duplicate_flagger.flag(pandas.DataFrame(), "config")
+
+# The batch interface marks both copies of a duplicated row.
+def test_duplicate_flagger_frame(duplicate_flagger, duplications):
+    masks = duplicate_flagger.flag_frame(duplications, Config())
+    assert masks[Flags.DUPLICATE].tolist() == [True, True]
+
+def test_duplicate_flagger_frame_sad(duplicate_flagger, no_duplications):
+    masks = duplicate_flagger.flag_frame(no_duplications, Config())
+    assert not masks[Flags.DUPLICATE].any()
+
+@pytest.fixture
+def key_config():
+    key_config = Config()
+    key_config.set_value("duplicate_key_columns", ["vehicle_number", "arrive_time"])
+    return key_config
+
+# Only the configured key columns are compared.
+def test_duplicate_flagger_frame_key_columns(duplicate_flagger, key_config):
+    df = pandas.DataFrame({
+        "vehicle_number": [1, 1, 2],
+        "arrive_time": [100, 100, 100],
+        "dwell": [5, 6, 7],
+    })
+    masks = duplicate_flagger.flag_frame(df, key_config)
+    assert masks[Flags.DUPLICATE].tolist() == [True, True, False]
+
+def test_duplicate_flagger_frame_missing_key_column(duplicate_flagger, key_config):
+    with pytest.raises(ValueError):
+        duplicate_flagger.flag_frame(pandas.DataFrame({"vehicle_number": [1]}), key_config)
+
+# Rows with equal fingerprints that differ are not flagged.
+def test_duplicate_flagger_frame_collision(monkeypatch, duplicate_flagger, no_duplications):
+    df = pandas.concat([no_duplications, no_duplications.assign(row_id="other")])
+    monkeypatch.setattr("flaggers.duplicate.fingerprint",
+                        lambda data, columns: pandas.Series([1, 1], dtype="uint64"))
+    masks = duplicate_flagger.flag_frame(df, Config())
+    assert not masks[Flags.DUPLICATE].any()
+
+# Object and typed columns holding the same values hash the same.
+def test_fingerprint_is_type_stable():
+    objects = pandas.DataFrame({
+        "service_date": [date(2020, 1, 2), None],
+        "vehicle_number": [3, None],
+        "service_key": ["W", None],
+    }, dtype=object)
+    typed = pandas.DataFrame({
+        "service_date": pandas.to_datetime(["2020-01-02", None]),
+        "vehicle_number": pandas.array([3, None], dtype="Int32"),
+        "service_key": pandas.Series(["W", None], dtype="category"),
+    })
+    columns = list(objects.columns)
+    assert fingerprint(objects, columns).tolist() == fingerprint(typed, columns).tolist()
@@ -0,0 +1,58 @@
+from flaggers.flagger import Flagger, Flags, invalid_overrides, threshold_values
+from src.config import Config
+import pytest
+import pandas
+
+# Only implements the per-row interface, like a third-party flagger would.
+class RowOnlyFlagger(Flagger):
+  name = 'Row Only'
+  def flag(self, data, config):
+    if data['door'] == 0:
+      return [Flags.UNOPENED_DOOR]
+    return []
+
+@pytest.fixture
+def row_only_flagger():
+  return RowOnlyFlagger()
+
+@pytest.fixture
+def sample_df():
+  return pandas.DataFrame({'door': [1, 0, 2, 0]}, index=[10, 11, 12, 13])
+
+
+def test_flag_frame_falls_back_to_flag(row_only_flagger, sample_df):
+  masks = row_only_flagger.flag_frame(sample_df, "config")
+  assert list(masks) == [Flags.UNOPENED_DOOR]
+  assert masks[Flags.UNOPENED_DOOR].tolist() == [False, True, False, True]
+
+def test_flag_frame_fallback_no_flags(row_only_flagger):
+  masks = row_only_flagger.flag_frame(pandas.DataFrame({'door': [1, 2]}), "config")
+  assert masks == {}
+
+def test_read_columns_defaults_to_every_column(row_only_flagger):
+  assert row_only_flagger.read_columns("config") is None
+
+
+# A route_number that is not a number must not match rows with no route.
+def test_threshold_values_skips_invalid_keys():
+  config = Config()
+  config.set_value("threshold_overrides", [
+    {"route_number": "abc", "name": "unobserved_stop_distance", "value": 500},
+    {"route_number": 4, "name": "unobserved_stop_distance", "value": 100},
+  ])
+  data = pandas.DataFrame({"route_number": [None, 4, 1], "location_id": [1, 1, 1]})
+  thresholds = threshold_values(data, config, "unobserved_stop_distance", 50)
+  assert thresholds.tolist() == [50.0, 100.0, 50.0]
+
+def test_invalid_overrides():
+  config = Config()
+  bad_key = {"route_number": "abc", "name": "unobserved_stop_distance", "value": 500}
+  bad_value = {"location_id": 9, "name": "unobserved_stop_distance", "value": "far"}
+  config.set_value("threshold_overrides", [
+    bad_key,
+    {"route_number": 4, "location_id": "9", "name": "unobserved_stop_distance", "value": 5},
+    bad_value,
+  ])
+  assert invalid_overrides(config) == [bad_key, bad_value]
+  config.set_value("threshold_overrides", None)
+  assert invalid_overrides(config) == []
@@ -0,0 +1,72 @@
+from flaggers.flagger import GroupFlagger, TripIndex, Flags
+import pytest
+import numpy as np
+import pandas
+
+# Flags stops with fewer ons than the previous stop of the trip.
+class FewerOns(GroupFlagger):
+  name = 'Fewer Ons'
+  def flag_groups(self, index, config):
+    return {Flags.UNOPENED_DOOR: index.diff('ons') < 0}
+
+@pytest.fixture
+def trip_frame():
+  # Two trips of vehicle 1 and one of vehicle 2, out of order.
+  return pandas.DataFrame({
+    'vehicle_number': [2, 1, 1, 1, 1, 2],
+    'trip_id': [7, 5, 6, 5, 5, 7],
+    'arrive_time': [300, 120, 50, 100, 110, 200],
+    'ons': [8, 2, 3, 4, None, 6],
+  }, index=[10, 11, 12, 13, 14, 15])
+
+@pytest.fixture
+def trip_index(trip_frame):
+  return TripIndex(trip_frame)
+
+def test_trip_index_order(trip_index, trip_frame):
+  assert trip_frame.index[trip_index.order].tolist() == [13, 14, 11, 12, 15, 10]
+  assert trip_index.offsets.tolist() == [0, 3, 4, 6]
+  assert trip_index.group_ids.tolist() == [0, 0, 0, 1, 2, 2]
+
+def test_trip_index_shift_and_diff(trip_index):
+  shifted = trip_index.shift('arrive_time')
+  assert np.isnan(shifted[[0, 3, 4]]).all()
+  assert shifted[[1, 2, 5]].tolist() == [100, 110, 200]
+  assert trip_index.diff('arrive_time')[[1, 2, 5]].tolist() == [10, 10, 100]
+
+def test_trip_index_cumsum(trip_index):
+  assert trip_index.cumsum('ons').tolist() == [4, 4, 6, 3, 6, 14]
+
+def test_trip_index_rolling_sum(trip_index):
+  assert trip_index.rolling_sum('ons', 2).tolist() == [4, 4, 2, 3, 6, 14]
+
+def test_trip_index_null_keys_are_own_groups():
+  index = TripIndex(pandas.DataFrame({
+    'vehicle_number': [None, None],
+    'trip_id': [1, 1],
+    'arrive_time': [1, 2],
+  }, dtype=object))
+  assert index.offsets.tolist() == [0, 1, 2]
+
+def test_group_flagger_flag_frame(trip_frame):
+  trip_frame.loc[14, 'ons'] = 5
+  masks = FewerOns().flag_frame(trip_frame, "config")
+  assert masks[Flags.UNOPENED_DOOR].tolist() == [False, True, False, False, False, False]
+
+def test_group_flagger_shared_index(trip_frame, trip_index):
+  masks = FewerOns().flag_frame(trip_frame, "config", trip_index)
+  assert not masks[Flags.UNOPENED_DOOR].any()
+
+def test_group_flagger_flag_is_empty():
+  assert FewerOns().flag({'arrive_time': 1}, "config") == []
+
+# A group flagger declares only its own columns; the index's sort columns are
+# added so the trips are never grouped on missing columns.
+def test_group_flagger_read_columns():
+  class OnsOnly(FewerOns):
+    def group_columns(self, config):
+      return ['ons', 'vehicle_number']
+
+  assert FewerOns().read_columns("config") is None
+  assert OnsOnly().read_columns("config") == [
+    'ons', 'vehicle_number', 'service_date', 'trip_id', 'arrive_time']
@@ -0,0 +1,79 @@
+from flaggers.flagger import flaggers, Flags
+from src.config import Config
+import pytest
+import pandas
+from datetime import date
+
+@pytest.fixture
+def near_duplicate_flagger():
+	return [f for f in flaggers if f.name == 'Near Duplicate'][0]
+
+@pytest.fixture
+def stops_frame():
+	# Rows 0 and 3 are the same stop reported 4 seconds apart; row 1 is the
+	# same stop 60 seconds later; rows 2 and 4 differ in vehicle and location.
+	return pandas.DataFrame({
+		'vehicle_number': [1, 1, 2, 1, 1],
+		'trip_id': [5, 5, 5, 5, 5],
+		'location_id': [9, 9, 9, 9, 8],
+		'arrive_time': [100, 164, 102, 104, 101],
+		'location_distance': [3.0, 3.0, 3.0, 10.0, 3.0],
+	})
+
+#Single rows can never be near duplicates
+def test_near_duplicate_flag_is_empty(near_duplicate_flagger):
+	assert near_duplicate_flagger.flag({'arrive_time': 1}, "config") == []
+
+def test_near_duplicate_flag_frame(near_duplicate_flagger, stops_frame):
+	masks = near_duplicate_flagger.flag_frame(stops_frame, Config())
+	assert masks[Flags.NEAR_DUPLICATE].tolist() == [True, False, False, True, False]
+
+#Tolerances come from config
+def test_near_duplicate_flag_frame_tolerances(near_duplicate_flagger, stops_frame):
+	config = Config()
+	config.set_value("near_duplicate_seconds", 2)
+	masks = near_duplicate_flagger.flag_frame(stops_frame, config)
+	assert not masks[Flags.NEAR_DUPLICATE].any()
+
+	config.set_value("near_duplicate_seconds", 60)
+	masks = near_duplicate_flagger.flag_frame(stops_frame, config)
+	assert masks[Flags.NEAR_DUPLICATE].tolist() == [True, True, False, True, False]
+
+	config.set_value("near_duplicate_feet", 5)
+	masks = near_duplicate_flagger.flag_frame(stops_frame, config)
+	assert not masks[Flags.NEAR_DUPLICATE].any()
+
+#Null keys are never paired
+def test_near_duplicate_flag_frame_nulls(near_duplicate_flagger):
+	df = pandas.DataFrame({
+		'vehicle_number': [None, None],
+		'trip_id': [5, 5],
+		'location_id': [9, 9],
+		'arrive_time': [100, 100],
+		'location_distance': [3.0, 3.0],
+	})
+	masks = near_duplicate_flagger.flag_frame(df, Config())
+	assert not masks[Flags.NEAR_DUPLICATE].any()
+
+#Stops on different service dates are never paired
+def test_near_duplicate_flag_frame_dates(near_duplicate_flagger, stops_frame):
+	stops_frame['service_date'] = [date(2020, 1, 1), date(2020, 1, 1), date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 1)]
+	masks = near_duplicate_flagger.flag_frame(stops_frame, Config())
+	assert not masks[Flags.NEAR_DUPLICATE].any()
+
+#The same trip on consecutive days sorts next to itself without service_date
+def test_near_duplicate_flag_frame_consecutive_days(near_duplicate_flagger):
+	df = pandas.DataFrame({
+		'service_date': [date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 2), date(2020, 1, 1)],
+		'vehicle_number': [1, 1, 1, 1],
+		'trip_id': [5, 5, 5, 5],
+		'location_id': [9, 9, 9, 7],
+		'arrive_time': [100, 103, 300, 50],
+		'location_distance': [3.0, 3.0, 3.0, 3.0],
+	})
+	masks = near_duplicate_flagger.flag_frame(df, Config())
+	assert not masks[Flags.NEAR_DUPLICATE].any()
+
+	df['arrive_time'] = [100, 103, 106, 50]
+	masks = near_duplicate_flagger.flag_frame(df, Config())
+	assert masks[Flags.NEAR_DUPLICATE].tolist() == [False, True, True, False]
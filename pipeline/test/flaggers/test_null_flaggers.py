@@ -1,5 +1,7 @@
 from flaggers.flagger import flaggers, Flags
 import pytest
+import pandas
+import numpy as np
 
 class DataRowNull():
   def __init__(self):
@@ -111,3 +113,35 @@ def test_null_flaggers_on_null_data(null_flagger, null_data_row):
   assert Flags.DATA_SOURCE_NULL in flags
   assert Flags.SCHEDULE_STATUS_NULL in flags
   assert Flags.TRIP_ID_NULL in flags
+
+
+@pytest.fixture
+def mixed_frame():
+  return pandas.DataFrame({
+    'service_date': [pandas.NaT, pandas.Timestamp('2020-01-01')],
+    'door': [1, None],
+    'dwell': [np.nan, 5.0],
+  })
+
+
+def test_null_bitmask(null_flagger, mixed_frame):
+  bits = null_flagger.null_bitmask(mixed_frame)
+  assert bits.dtype == np.uint32
+  date_bit = 1 << null_flagger.bit_flags.index(Flags.SERVICE_DATE_NULL)
+  door_bit = 1 << null_flagger.bit_flags.index(Flags.DOOR_NULL)
+  dwell_bit = 1 << null_flagger.bit_flags.index(Flags.DWELL_NULL)
+  assert bits.tolist() == [date_bit | dwell_bit, door_bit]
+
+
+def test_null_flag_frame(null_flagger, mixed_frame):
+  masks = null_flagger.flag_frame(mixed_frame, "config")
+  assert set(masks) == {Flags.SERVICE_DATE_NULL, Flags.DOOR_NULL, Flags.DWELL_NULL}
+  assert masks[Flags.DOOR_NULL].tolist() == [False, True]
+
+
+def test_null_flag_frame_matches_flag(null_flagger, null_data_row, good_data_row):
+  df = pandas.DataFrame([null_data_row, good_data_row])
+  masks = null_flagger.flag_frame(df, "config")
+  assert set(masks) == set(null_flagger.flag(null_data_row, "config"))
+  assert all(mask.tolist() == [True, False] for mask in masks.values())
+
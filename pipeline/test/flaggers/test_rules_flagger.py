@@ -0,0 +1,95 @@
+from flaggers.flagger import flaggers
+from flaggers.rules import Rules, compile_rule
+from src.config import Config
+import pytest
+import numpy as np
+import pandas
+
+@pytest.fixture
+def rule_config():
+  config = Config()
+  config.set_value("rules", [
+    {"flag_id": 1000, "name": "long-closed-dwell", "expression": "dwell > 600 and door == 0"},
+    {"flag_id": 1001, "name": "fast", "expression": "maximum_speed - 10 >= 60",
+     "description": "Faster than 70"},
+  ])
+  return config
+
+@pytest.fixture
+def rules_flagger(rule_config):
+  rules = Rules()
+  rules.load(rule_config)
+  return rules
+
+@pytest.fixture
+def stops_frame():
+  return pandas.DataFrame({
+    "dwell": [700, 700, None],
+    "door": [0, 1, 0],
+    "maximum_speed": [80, 20, None],
+  }, dtype=object)
+
+
+def test_rules_flagger_registered():
+  assert [f for f in flaggers if f.name == 'Rules']
+
+def test_rules_flag_frame(rules_flagger, stops_frame, rule_config):
+  masks = rules_flagger.flag_frame(stops_frame, rule_config)
+  assert masks[1000].tolist() == [True, False, False]
+  assert masks[1001].tolist() == [True, False, False]
+
+def test_rules_flag(rules_flagger, rule_config):
+  assert rules_flagger.flag({"dwell": 700, "door": 0, "maximum_speed": 5}, rule_config) == [1000]
+
+def test_rules_flag_rows(rules_flagger):
+  assert rules_flagger.flag_rows() == [
+    [1000, "dwell > 600 and door == 0", "long-closed-dwell"],
+    [1001, "Faster than 70", "fast"],
+  ]
+
+def test_rules_missing_column_is_null(rules_flagger, rule_config):
+  masks = rules_flagger.flag_frame(pandas.DataFrame({"dwell": [700]}), rule_config)
+  assert not masks[1000].any()
+
+def test_compile_rule_chained_comparison():
+  evaluate, columns = compile_rule("0 < dwell <= 10 or not door != 1")
+  assert columns == ["door", "dwell"]
+  result = evaluate({"dwell": np.array([5.0, 11.0, 11.0]), "door": np.array([0.0, 1.0, 0.0])})
+  assert result.tolist() == [True, True, False]
+
+@pytest.mark.parametrize("expression", [
+  "dwell >",
+  "unknown > 1",
+  "dwell",
+  "1 < 2",
+  "dwell > (door > 1)",
+  "dwell > 'a'",
+  "__import__('os').system('ls')",
+  "dwell is None",
+])
+def test_compile_rule_invalid(expression):
+  with pytest.raises(ValueError):
+    compile_rule(expression)
+
+@pytest.mark.parametrize("entry", [
+  {"name": "no-id", "expression": "dwell > 1"},
+  {"flag_id": 5, "name": "enum-id", "expression": "dwell > 1"},
+  {"flag_id": 1000, "name": "x" * 31, "expression": "dwell > 1"},
+])
+def test_rules_load_invalid(entry):
+  config = Config()
+  config.set_value("rules", [entry])
+  with pytest.raises(ValueError):
+    Rules().load(config)
+
+def test_rules_load_duplicate_flag_id():
+  config = Config()
+  config.set_value("rules", [
+    {"flag_id": 1000, "name": "a", "expression": "dwell > 1"},
+    {"flag_id": 1000, "name": "b", "expression": "dwell > 2"},
+  ])
+  with pytest.raises(ValueError):
+    Rules().load(config)
+
+def test_rules_read_columns(rules_flagger, rule_config):
+  assert rules_flagger.read_columns(rule_config) == ["door", "dwell", "maximum_speed"]
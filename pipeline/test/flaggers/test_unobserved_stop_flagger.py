@@ -1,6 +1,7 @@
 from flaggers.flagger import flaggers, Flags
-from src.config import config
+from src.config import config, Config
 import pytest
+import pandas
 
 class GoodData():
 	def __init__(self):
@@ -39,3 +40,43 @@ def test_unobserved_stop_flagger_on_bad_data(unobserved_stop_flagger, bad_data,
 	assert len(flags) == 1
 	assert Flags.UNOBSERVED_STOP in flags
 
+
+@pytest.fixture
+def override_config():
+	override = Config()
+	override.set_value("unobserved_stop_distance", 50)
+	override.set_value("threshold_overrides", [
+		{"route_number": 4, "name": "unobserved_stop_distance", "value": 500},
+		{"location_id": 9, "name": "unobserved_stop_distance", "value": 10},
+		{"route_number": 4, "location_id": 9, "name": "unobserved_stop_distance", "value": 5},
+		{"location_id": 8, "name": "unopened_door_min_openings", "value": 0},
+	])
+	return override
+
+@pytest.fixture
+def stops_frame():
+	return pandas.DataFrame({
+		"route_number": [1, 4, 1, 4, 1],
+		"location_id": [7, 7, 9, 9, 8],
+		"location_distance": [60.0, 60.0, 20.0, 6.0, None],
+	})
+
+#Without overrides every row is compared against unobserved_stop_distance
+def test_unobserved_stop_flag_frame(unobserved_stop_flagger, stops_frame, config_instance):
+	masks = unobserved_stop_flagger.flag_frame(stops_frame, config_instance)
+	assert masks[Flags.UNOBSERVED_STOP].tolist() == [True, True, False, False, False]
+
+#Route, stop and route-and-stop overrides apply in increasing precedence
+def test_unobserved_stop_flag_frame_overrides(unobserved_stop_flagger, stops_frame, override_config):
+	masks = unobserved_stop_flagger.flag_frame(stops_frame, override_config)
+	assert masks[Flags.UNOBSERVED_STOP].tolist() == [True, False, True, True, False]
+
+#flag() and flag_frame() agree on every row, overrides included
+def test_unobserved_stop_flag_matches_flag_frame(unobserved_stop_flagger, stops_frame, override_config):
+	masks = unobserved_stop_flagger.flag_frame(stops_frame, override_config)
+	flags = [Flags.UNOBSERVED_STOP in unobserved_stop_flagger.flag(row, override_config)
+			 for _, row in stops_frame.iterrows()]
+	assert flags == masks[Flags.UNOBSERVED_STOP].tolist() == [True, False, True, True, False]
+
+def test_unobserved_stop_flag_frame_no_column(unobserved_stop_flagger, config_instance):
+	assert unobserved_stop_flagger.flag_frame(pandas.DataFrame({"door": [1]}), config_instance) == {}
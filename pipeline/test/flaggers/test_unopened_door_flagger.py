@@ -1,5 +1,7 @@
 from flaggers.flagger import flaggers, Flags
+from src.config import Config
 import pytest
+import pandas
 
 #Data is good when door opens at least once during the stop
 class GoodData():
@@ -25,11 +27,51 @@ def bad_data():
 
 #Should NOT return a flags, since data is good [returns empty list]
 def test_unopened_door_flagger_on_good_data(unopened_door_flagger, good_data):
-	flags = unopened_door_flagger.flag(good_data, "config")
+	flags = unopened_door_flagger.flag(good_data, Config())
 	assert len(flags) == 0
 
 #Should return flags, since data is bad [returns list with 1 flag]
 def test_unopened_door_flagger_on_bad_data(unopened_door_flagger, bad_data):
-	flags = unopened_door_flagger.flag(bad_data, "config")
+	flags = unopened_door_flagger.flag(bad_data, Config())
 	assert len(flags) == 1
 	assert Flags.UNOPENED_DOOR in flags
+
+@pytest.fixture
+def door_frame():
+	return pandas.DataFrame({
+		"route_number": [1, 1, 1, 1],
+		"location_id": [7, 8, 7, None],
+		"door": [0, 0, 2, None],
+	})
+
+def test_unopened_door_flag_frame(unopened_door_flagger, door_frame):
+	masks = unopened_door_flagger.flag_frame(door_frame, Config())
+	assert masks[Flags.UNOPENED_DOOR].tolist() == [True, True, False, False]
+
+#A stop override of 0 openings turns the flag off for that stop only
+def test_unopened_door_flag_frame_override(unopened_door_flagger, door_frame):
+	override = Config()
+	override.set_value("threshold_overrides", [
+		{"location_id": 8, "name": "unopened_door_min_openings", "value": 0},
+	])
+	masks = unopened_door_flagger.flag_frame(door_frame, override)
+	assert masks[Flags.UNOPENED_DOOR].tolist() == [True, False, False, False]
+
+#flag() and flag_frame() agree on every row, overrides included
+def test_unopened_door_flag_matches_flag_frame(unopened_door_flagger, door_frame):
+	config = Config()
+	config.set_value("unopened_door_min_openings", 3)
+	config.set_value("threshold_overrides", [
+		{"location_id": 8, "name": "unopened_door_min_openings", "value": 0},
+	])
+	masks = unopened_door_flagger.flag_frame(door_frame, config)
+	flags = [Flags.UNOPENED_DOOR in unopened_door_flagger.flag(row, config)
+			 for _, row in door_frame.iterrows()]
+	assert flags == masks[Flags.UNOPENED_DOOR].tolist() == [True, False, True, False]
+
+def test_unopened_door_read_columns(unopened_door_flagger):
+	config = Config()
+	config.set_value("threshold_overrides", [])
+	assert unopened_door_flagger.read_columns(config) == ['door']
+	config.set_value("threshold_overrides", [{"route_number": 4, "name": "unopened_door_min_openings", "value": 0}])
+	assert unopened_door_flagger.read_columns(config) == ['door', 'route_number', 'location_id']
@@ -0,0 +1,94 @@
+import pytest
+import numpy as np
+import pandas
+from datetime import date
+
+from flaggers.flagger import flaggers, Flags
+from src.config import Config
+from src.parallel import flag_partitions, flagging_pool, partition_positions, run_flaggers
+
+
+@pytest.fixture
+def sample_config():
+    config = Config()
+    config.set_value("unobserved_stop_distance", 50)
+    config._data["columns"] = {"maximum_speed": {"max": 150, "min": 0}}
+    return config
+
+@pytest.fixture
+def sample_df():
+    rng = np.random.RandomState(0)
+    n = 400
+    df = pandas.DataFrame({
+        "service_date": [date(2020, 1, 1 + i % 3) for i in range(n)],
+        "vehicle_number": rng.randint(0, 12, n),
+        "trip_id": rng.randint(0, 4, n),
+        "location_id": rng.randint(0, 5, n),
+        "arrive_time": rng.randint(0, 200, n),
+        "door": rng.randint(0, 3, n),
+        "maximum_speed": rng.randint(-5, 160, n),
+        "location_distance": rng.uniform(0, 80, n),
+    }, index=pandas.RangeIndex(1000, 1000 + n, name="row_id"))
+    df.loc[df.index[::7], "door"] = None
+    return df
+
+@pytest.fixture
+def partitionable_ids():
+    return [i for i, flagger in enumerate(flaggers) if flagger.partitionable]
+
+
+def test_partition_positions_cover_every_row(sample_df):
+    partitions = partition_positions(sample_df, 8)
+    assert 1 < len(partitions) <= 8
+    assert sorted(np.concatenate(partitions).tolist()) == list(range(len(sample_df.index)))
+
+def test_partition_positions_keep_vehicle_days_together(sample_df):
+    for positions in partition_positions(sample_df, 8):
+        keys = set(zip(sample_df["service_date"].iloc[positions], sample_df["vehicle_number"].iloc[positions]))
+        for other in partition_positions(sample_df, 8):
+            if other is not positions:
+                other_keys = set(zip(sample_df["service_date"].iloc[other], sample_df["vehicle_number"].iloc[other]))
+                assert not keys & other_keys or other_keys == keys
+
+def test_flag_partitions_matches_sequential(sample_df, sample_config, partitionable_ids):
+    expected, _ = run_flaggers([flaggers[i] for i in partitionable_ids], sample_df, sample_config)
+    masks, errors = flag_partitions(sample_df, partitionable_ids, sample_config, 2, 3)
+    assert errors == []
+    flagged = {flag for flag, mask in expected.items() if mask.any()}
+    assert flagged == {flag for flag, mask in masks.items() if mask.any()}
+    assert Flags.UNOPENED_DOOR in flagged
+    for flag in flagged:
+        assert masks[flag].tolist() == expected[flag].tolist()
+
+def test_run_flaggers_reports_errors(sample_df, sample_config):
+    class Broken():
+        name = "Broken"
+        def flag_frame(self, data, config):
+            raise RuntimeError("boom")
+
+    masks, errors = run_flaggers([Broken()], sample_df, sample_config)
+    assert masks == {}
+    assert errors == ["Error in flagger Broken. Skipping.\nboom"]
+
+def test_flag_partitions_reuses_pool(sample_df, sample_config, partitionable_ids):
+    class Counter():
+        max = None
+        ticks = 0
+        def next(self):
+            self.ticks += 1
+
+    # One pool flags every chunk of a run, as the client does.
+    chunks = [sample_df.iloc[:150], sample_df.iloc[150:]]
+    with flagging_pool(partitionable_ids, sample_config, 2) as pool:
+        for chunk in chunks:
+            expected, _ = run_flaggers([flaggers[i] for i in partitionable_ids], chunk, sample_config)
+            progress_bar = Counter()
+            masks, errors = flag_partitions(chunk, partitionable_ids, sample_config, 2, 50,
+                                            progress_bar, pool)
+            assert errors == []
+            for flag, mask in expected.items():
+                if mask.any():
+                    assert masks[flag].tolist() == mask.tolist()
+            # Empty partitions are dropped, so the bar counts the partitions made.
+            assert progress_bar.max == len(partition_positions(chunk, 100)) < 100
+            assert progress_bar.ticks == progress_bar.max
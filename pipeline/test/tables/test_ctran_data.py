@@ -1,6 +1,7 @@
 import io
 import pytest
 import pandas
+from datetime import date
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
 from src.tables import CTran_Data
@@ -98,6 +99,178 @@ def test_expected_cols(instance_fixture):
     ]
     assert instance_fixture._expected_cols == expected_cols
 
+def test_dtypes_cover_expected_cols(instance_fixture):
+    assert set(instance_fixture._dtypes) == set(instance_fixture._expected_cols)
+
+def test_typed_frame(instance_fixture):
+    df = pandas.read_csv("assets/ctran_ete_test.csv")
+    assert instance_fixture.set_typed(True)
+    typed = instance_fixture._clean_frame(df)
+    assert str(typed["door"].dtype) == "Int32"
+    assert str(typed["direction"].dtype) == "Int16"
+    assert str(typed["train_mileage"].dtype) == "float64"
+    assert str(typed["service_key"].dtype) == "category"
+    assert str(typed["service_date"].dtype) == "datetime64[ns]"
+    assert typed["vehicle_number"].isna().tolist() == df["vehicle_number"].isna().tolist()
+
+@pytest.fixture
+def copy_connection():
+    class Custom_Cursor():
+        def __init__(self, connection):
+            self.connection = connection
+
+        def copy_expert(self, sql, buffer):
+            self.connection.sql = sql
+            with open("assets/ctran_ete_test.csv") as f:
+                buffer.write("row_id," + f.readline())
+                if self.connection.header_only:
+                    return
+                for i, line in enumerate(f):
+                    buffer.write(str(i) + "," + line)
+
+        def close(self):
+            pass
+
+    class Custom_Connection():
+        def __init__(self):
+            self.sql = None
+            self.closed = False
+            self.header_only = False
+
+        def cursor(self):
+            return Custom_Cursor(self)
+
+        def close(self):
+            self.closed = True
+
+    connection = Custom_Connection()
+    return connection, lambda: connection
+
+def test_set_reader(instance_fixture):
+    assert instance_fixture.set_reader("copy")
+    assert not instance_fixture.set_reader("binary")
+    assert instance_fixture._reader == "copy"
+
+def test_query_date_range_copy(copy_connection, instance_fixture):
+    instance_fixture._engine.raw_connection = copy_connection[1]
+    instance_fixture.set_reader("copy")
+    df = instance_fixture.query_date_range(date(2020, 1, 2), date(2020, 1, 3))
+    assert copy_connection[0].sql == "".join([
+        "COPY (SELECT * FROM aperture.ctran_data WHERE service_date BETWEEN ",
+        "'2020-01-02' AND '2020-01-03') TO STDOUT WITH (FORMAT csv, HEADER true)"])
+    assert copy_connection[0].closed
+    assert df.index.name == "row_id"
+    assert df["service_date"].iloc[0] == date(1900, 6, 6)
+    assert pandas.isna(df["vehicle_number"].iloc[0])
+    assert df["service_key"].iloc[1] == "W"
+
+def test_query_date_range_copy_empty(copy_connection, instance_fixture):
+    instance_fixture._engine.raw_connection = copy_connection[1]
+    instance_fixture.set_reader("copy")
+    copy_connection[0].header_only = True
+    df = instance_fixture.query_date_range(date(2020, 1, 2), date(2020, 1, 3))
+    assert df.empty
+    assert list(df.columns) == instance_fixture._expected_cols
+
+def test_query_date_range_copy_mismatch_cols(copy_connection, instance_fixture):
+    instance_fixture._engine.raw_connection = copy_connection[1]
+    instance_fixture.set_reader("copy")
+    assert instance_fixture.query_date_range(date(2020, 1, 2), date(2020, 1, 3), ["door"]) is None
+
+def test_get_full_table_copy(copy_connection, instance_fixture):
+    instance_fixture._engine.raw_connection = copy_connection[1]
+    instance_fixture.set_reader("copy")
+    instance_fixture.set_typed(True)
+    df = instance_fixture.get_full_table()
+    assert copy_connection[0].sql.startswith("COPY (SELECT * FROM aperture.ctran_data) TO STDOUT")
+    assert str(df["service_date"].dtype) == "datetime64[ns]"
+
+def test_query_date_range_shards_per_day(monkeypatch, instance_fixture):
+    def custom_shards(sqls, readers, columns=None):
+        return sqls, readers, columns
+
+    monkeypatch.setattr(instance_fixture, "_query_table_shards", custom_shards)
+    sqls, readers, columns = instance_fixture.query_date_range_shards(
+        date(2020, 1, 31), date(2020, 2, 1), 4, ["door"])
+    assert sqls == [
+        "SELECT row_id, door FROM aperture.ctran_data WHERE service_date = '2020-01-31';",
+        "SELECT row_id, door FROM aperture.ctran_data WHERE service_date = '2020-02-01';"]
+    assert readers == 4 and columns == ["door"]
+
+class Dict_Cache():
+    def __init__(self, days=None):
+        self.days = days or {}
+        self.puts = []
+
+    def get(self, day, index_col, columns=None):
+        df = self.days.get(day)
+        if df is None or columns is None:
+            return df
+        return df[columns]
+
+    def put(self, day, df):
+        self.puts.append(day)
+        self.days[day] = df
+        return True
+
+def day_frame(day, row_ids, instance):
+    df = pandas.DataFrame({col: [1] * len(row_ids) for col in instance._expected_cols})
+    df["service_date"] = day
+    df["row_id"] = row_ids
+    return df.set_index("row_id")
+
+def test_query_date_range_day_cache(monkeypatch, instance_fixture):
+    sqls = []
+    def custom_fetch(sql, columns=None):
+        sqls.append(sql)
+        return pandas.concat([day_frame(date(2020, 1, 1), [1, 2], instance_fixture),
+                              day_frame(date(2020, 1, 3), [5], instance_fixture)])
+
+    monkeypatch.setattr(instance_fixture, "_fetch_table", custom_fetch)
+    monkeypatch.setattr(instance_fixture, "get_latest_day", lambda: date(2020, 1, 4))
+    cache = Dict_Cache({date(2020, 1, 2): day_frame(date(2020, 1, 2), [3, 4], instance_fixture)})
+    instance_fixture.set_day_cache(cache)
+    df = instance_fixture.query_date_range(date(2020, 1, 1), date(2020, 1, 4), ["door"])
+    assert sqls == ["".join([
+        "SELECT * FROM aperture.ctran_data WHERE service_date IN ",
+        "('2020-01-01', '2020-01-03', '2020-01-04');"])]
+    assert list(df.index) == [1, 2, 3, 4, 5]
+    assert list(df.columns) == ["door"]
+    # The empty day is not cached, since it may not have been loaded yet.
+    assert cache.puts == [date(2020, 1, 1), date(2020, 1, 3)]
+    assert list(cache.days[date(2020, 1, 1)].columns) == instance_fixture._expected_cols
+
+    sqls.clear()
+    df = instance_fixture.query_date_range(date(2020, 1, 1), date(2020, 1, 3))
+    assert sqls == []
+    assert list(df.index) == [1, 2, 3, 4, 5]
+
+def test_query_date_range_day_cache_latest_day(monkeypatch, instance_fixture):
+    # The latest day may be partially loaded, so it is read but not cached.
+    monkeypatch.setattr(instance_fixture, "_fetch_table", lambda sql, columns=None: pandas.concat([
+        day_frame(date(2020, 1, 1), [1, 2], instance_fixture),
+        day_frame(date(2020, 1, 2), [3], instance_fixture)]))
+    monkeypatch.setattr(instance_fixture, "get_latest_day", lambda: date(2020, 1, 2))
+    cache = Dict_Cache()
+    instance_fixture.set_day_cache(cache)
+    df = instance_fixture.query_date_range(date(2020, 1, 1), date(2020, 1, 2))
+    assert list(df.index) == [1, 2, 3]
+    assert cache.puts == [date(2020, 1, 1)]
+
+    # Without the latest day, nothing is known to be complete.
+    monkeypatch.setattr(instance_fixture, "get_latest_day", lambda: None)
+    cache = Dict_Cache()
+    instance_fixture.set_day_cache(cache)
+    assert len(instance_fixture.query_date_range(date(2020, 1, 1), date(2020, 1, 2)).index) == 3
+    assert cache.puts == []
+
+def test_query_date_range_day_cache_error(monkeypatch, instance_fixture):
+    monkeypatch.setattr(instance_fixture, "_fetch_table", lambda sql, columns=None: None)
+    cache = Dict_Cache()
+    instance_fixture.set_day_cache(cache)
+    assert instance_fixture.query_date_range(date(2020, 1, 1), date(2020, 1, 2)) is None
+    assert cache.puts == []
+
 def test_creation_sql(instance_fixture):
     # This tabbing is not accidental.
     expected = "".join(["""
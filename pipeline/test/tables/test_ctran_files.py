@@ -0,0 +1,80 @@
+import os
+import pytest
+import pandas
+from datetime import date
+from src.tables import CTran_Data, CTran_Files
+
+
+@pytest.fixture
+def ctran():
+    return CTran_Data("sw23", "invalid", "localhost", "aperture")
+
+def write_extract(ctran, file_path, days, first_row_id):
+    rows = []
+    for i, day in enumerate(days):
+        row = {col: 1 for col in ctran._expected_cols}
+        row["service_date"] = day.strftime("%Y-%m-%d")
+        row["service_key"] = "W"
+        row["door"] = None if i == 0 else 1
+        row["row_id"] = first_row_id + i
+        rows.append(row)
+    df = pandas.DataFrame(rows, columns=["row_id"] + ctran._expected_cols)
+    df.to_csv(file_path, index=False)
+
+@pytest.fixture
+def extracts(tmp_path, ctran):
+    write_extract(ctran, str(tmp_path / "jan.csv.gz"),
+                  [date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 3)], 1)
+    write_extract(ctran, str(tmp_path / "day_2020-01-04.csv"), [date(2020, 1, 4)], 4)
+    (tmp_path / "notes.txt").write_text("not an extract")
+    return str(tmp_path)
+
+def test_files_skip_dated_names(extracts, ctran):
+    files = CTran_Files(extracts, ctran)._files(date(2020, 1, 1), date(2020, 1, 3))
+    assert [os.path.basename(f) for f in files] == ["jan.csv.gz"]
+
+def test_query_date_range(extracts, ctran):
+    df = CTran_Files(extracts, ctran, workers=2).query_date_range(date(2020, 1, 2), date(2020, 1, 4))
+    assert df.index.name == "row_id"
+    assert sorted(df.index) == [2, 3, 4]
+    assert list(df.columns) == ctran._expected_cols
+    assert df["service_date"].loc[2] == date(2020, 1, 2)
+    assert df["service_key"].iloc[0] == "W"
+
+def test_query_date_range_columns(extracts, ctran):
+    df = CTran_Files(extracts, ctran).query_date_range(date(2020, 1, 1), date(2020, 1, 1), ["door"])
+    assert list(df.columns) == ["door"]
+    assert list(df.index) == [1]
+    assert pandas.isna(df["door"].iloc[0])
+
+def test_query_date_range_typed(extracts, ctran):
+    ctran.set_typed(True)
+    df = CTran_Files(extracts, ctran).query_date_range(date(2020, 1, 1), date(2020, 1, 4))
+    assert str(df["door"].dtype) == "Int32"
+    assert str(df["service_date"].dtype) == "datetime64[ns]"
+    assert pandas.isna(df["door"].iloc[0])
+
+def test_query_date_range_missing_row_id(tmp_path, ctran):
+    pandas.DataFrame({col: [1] for col in ctran._expected_cols}).to_csv(
+        str(tmp_path / "extract.csv"), index=False)
+    assert CTran_Files(str(tmp_path), ctran).query_date_range(date(2020, 1, 1), date(2020, 1, 1)) is None
+
+def test_query_date_range_header_only(tmp_path, ctran):
+    write_extract(ctran, str(tmp_path / "extract.csv"), [], 1)
+    df = CTran_Files(str(tmp_path), ctran).query_date_range(date(2020, 1, 1), date(2020, 1, 1))
+    assert df.empty
+    assert list(df.columns) == ctran._expected_cols
+
+def test_query_date_range_no_files(tmp_path, ctran):
+    assert CTran_Files(str(tmp_path / "missing"), ctran).query_date_range(
+        date(2020, 1, 1), date(2020, 1, 1)) is None
+
+def test_query_date_range_parquet(tmp_path, ctran):
+    pytest.importorskip("pyarrow")
+    write_extract(ctran, str(tmp_path / "jan.csv"), [date(2020, 1, 1), date(2020, 1, 2)], 1)
+    pandas.read_csv(str(tmp_path / "jan.csv"), parse_dates=["service_date"]).to_parquet(
+        str(tmp_path / "jan.parquet"), index=False)
+    os.remove(str(tmp_path / "jan.csv"))
+    df = CTran_Files(str(tmp_path), ctran).query_date_range(date(2020, 1, 2), date(2020, 1, 2))
+    assert list(df.index) == [2]
+    assert df["service_date"].loc[2] == date(2020, 1, 2)
@@ -0,0 +1,59 @@
+import os
+import pytest
+import pandas
+from datetime import date
+from src.tables import DayCache
+
+pytest.importorskip("pyarrow")
+
+
+def day_frame(day, row_ids):
+    return pandas.DataFrame({
+        "row_id": row_ids,
+        "service_date": [day] * len(row_ids),
+        "vehicle_number": [7] * len(row_ids),
+        "door": [None] + [1] * (len(row_ids) - 1),
+    }).set_index("row_id")
+
+def test_get_missing(tmp_path):
+    cache = DayCache(str(tmp_path), 1 << 20)
+    assert cache.get(date(2020, 1, 1), "row_id") is None
+
+def test_put_get(tmp_path):
+    cache = DayCache(str(tmp_path), 1 << 20)
+    assert cache.put(date(2020, 1, 1), day_frame(date(2020, 1, 1), [1, 2, 3]))
+    assert os.path.exists(os.path.join(str(tmp_path), "2020-01-01.arrow"))
+
+    df = cache.get(date(2020, 1, 1), "row_id")
+    assert df.index.name == "row_id"
+    assert list(df.index) == [1, 2, 3]
+    assert df["service_date"].iloc[0] == date(2020, 1, 1)
+    assert pandas.isna(df["door"].iloc[0])
+
+    df = cache.get(date(2020, 1, 1), "row_id", ["door"])
+    assert list(df.columns) == ["door"]
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DayCache(str(tmp_path), 1 << 20)
+    for day in range(1, 4):
+        cache.put(date(2020, 1, day), day_frame(date(2020, 1, day), [day]))
+        os.utime(cache._file(date(2020, 1, day)), (day, day))
+    size = os.path.getsize(cache._file(date(2020, 1, 1)))
+
+    # Reading day 1 makes day 2 the least recently used.
+    cache.get(date(2020, 1, 1), "row_id")
+    cache.max_bytes = 3 * size
+    cache.put(date(2020, 1, 4), day_frame(date(2020, 1, 4), [4]))
+    assert cache.get(date(2020, 1, 2), "row_id") is None
+    assert cache.get(date(2020, 1, 1), "row_id") is not None
+    assert cache.get(date(2020, 1, 3), "row_id") is not None
+
+def test_invalidate(tmp_path):
+    cache = DayCache(str(tmp_path), 1 << 20)
+    for day in range(1, 5):
+        cache.put(date(2020, 1, day), day_frame(date(2020, 1, day), [day]))
+
+    assert cache.invalidate(date(2020, 1, 2), date(2020, 1, 3)) == 2
+    assert cache.get(date(2020, 1, 2), "row_id") is None
+    assert cache.get(date(2020, 1, 4), "row_id") is not None
+    assert cache.invalidate() == 2
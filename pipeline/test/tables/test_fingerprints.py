@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+import numpy as np
+import pandas
+from src.tables import Fingerprints
+
+@pytest.fixture
+def instance_fixture():
+    instance = Fingerprints("sw23", "invalid", "localhost", "aperture")
+    return instance
+
+@pytest.fixture
+def mock_connection():
+    class mock_connection():
+        def __init__(self):
+            self.sql = None
+        def __enter__(self):
+            return self
+        def __exit__(self, type, value, traceback):
+            return
+        def execute(self, sql):
+            self.sql = sql
+
+    return mock_connection()
+
+
+def test_table_name(instance_fixture):
+    assert instance_fixture._table_name == "row_fingerprints"
+
+def test_expected_cols(instance_fixture):
+    assert instance_fixture._expected_cols == ["fingerprint", "row_id", "service_date"]
+
+def test_write_table(monkeypatch, instance_fixture):
+    written = {}
+    def _write_table(df, conflict_columns=None):
+        written["df"] = df
+        written["conflict_columns"] = conflict_columns
+        return True
+    monkeypatch.setattr(instance_fixture, "_write_table", _write_table)
+
+    big = np.uint64(2**63 + 5)
+    assert instance_fixture.write_table(np.array([big, 3], dtype=np.uint64), [1, 2], ["2020/1/2", "2020/1/3"])
+    assert written["df"]["fingerprint"].tolist() == [-(2**63) + 5, 3]
+    assert written["conflict_columns"] == ["fingerprint", "row_id"]
+
+def test_write_table_empty(instance_fixture):
+    assert instance_fixture.write_table(np.array([], dtype=np.uint64), [], [])
+
+def test_query_fingerprints(monkeypatch, instance_fixture):
+    queried = []
+    def read_sql(sql, engine, params):
+        queried.append(params["fingerprints"])
+        return pandas.DataFrame({
+            "fingerprint": [-(2**63) + 5],
+            "row_id": [1],
+            "service_date": [datetime.date(2020, 1, 2)],
+        })
+    monkeypatch.setattr("pandas.read_sql", read_sql)
+    instance_fixture._lookup_chunksize = 1
+
+    big = np.uint64(2**63 + 5)
+    df = instance_fixture.query_fingerprints(np.array([big, big, 3], dtype=np.uint64))
+    assert queried == [[3], [-(2**63) + 5]]
+    assert df["fingerprint"].dtype == np.uint64
+    assert df["fingerprint"].tolist() == [2**63 + 5, 2**63 + 5]
+
+def test_query_fingerprints_bad_engine(instance_fixture):
+    instance_fixture._engine = None
+    assert instance_fixture.query_fingerprints(np.array([1], dtype=np.uint64)) is None
+
+def test_delete_date_range(mock_connection, instance_fixture):
+    instance_fixture._engine.connect = lambda: mock_connection
+    start = datetime.datetime(2020, 1, 2)
+    end = datetime.datetime(2020, 1, 3)
+    assert instance_fixture.delete_date_range(start, end)
+    assert mock_connection.sql == "".join([
+        "DELETE FROM ", instance_fixture._schema, ".", instance_fixture._table_name,
+        " WHERE service_date BETWEEN '2020-01-02' AND '2020-01-03';"])
@@ -141,3 +141,22 @@ def test_create_view(monkeypatch, instance_fixture):
     ])
     instance_fixture.create_view_for_flag(mock_flag.test)
     assert mock.sql == expected
+
+def test_write_table_streams(monkeypatch, instance_fixture):
+    calls = []
+    def custom_streams(df, partition_column, streams, conflict_columns=None, retries=1):
+        calls.append((len(df.index), partition_column, streams, conflict_columns))
+        return []
+
+    monkeypatch.setattr(instance_fixture, "_write_table_streams", custom_streams)
+    rows = [[1, 7, 2, "2020/1/2"], [2, 7, 2, "2020/1/3"]]
+    assert instance_fixture.write_table(rows, streams=4)
+    assert calls == [(2, "service_date", 4, ["row_id", "flag_id", "service_key"])]
+
+    monkeypatch.setattr(instance_fixture, "_write_table_streams", lambda *args, **kwargs: ["2020/1/3"])
+    assert not instance_fixture.write_table(rows, streams=4)
+    assert instance_fixture.write_table_days(rows, 4) == ["2020/1/3"]
+
+    # If nothing could be written, every day is reported.
+    monkeypatch.setattr(instance_fixture, "_write_table_streams", lambda *args, **kwargs: None)
+    assert instance_fixture.write_table_days(rows, 4) == ["2020/1/2", "2020/1/3"]
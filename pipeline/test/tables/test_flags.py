@@ -2,7 +2,10 @@ import io
 import pytest
 import pandas
 from sqlalchemy import create_engine
-from src.tables import Flags
+from src.tables import Flags, Table
+from src.config import Config
+from flaggers.rules import rules_flagger
+import flaggers.flagger as flagger
 
 @pytest.fixture
 def instance_fixture():
@@ -50,3 +53,26 @@ def test_creation_sql(instance_fixture):
                 name VARCHAR(30)
             );"""])
     assert expected == instance_fixture._creation_sql
+
+def test_create_table_updates_flags(monkeypatch, instance_fixture):
+    written = []
+    def custom_upsert(df, conflict_columns, update=False):
+        written.append((list(df), conflict_columns, update))
+        return None
+
+    monkeypatch.setattr(Table, "create_table", lambda self: True)
+    monkeypatch.setattr(instance_fixture, "_upsert_table", custom_upsert)
+    instance_fixture.create_table()
+    assert written == [(["flag_id", "description", "name"], ["flag_id"], True)]
+
+def test_write_csv_includes_rule_flags(monkeypatch, tmp_path, instance_fixture):
+    config = Config()
+    config.set_value("rules", [{"flag_id": 1000, "name": "closed", "expression": "door == 0"}])
+    monkeypatch.setattr(rules_flagger, "rules", None)
+    rules_flagger.load(config)
+    assert instance_fixture.write_csv(str(tmp_path) + "/")
+
+    df = pandas.read_csv(str(tmp_path / "flags.csv"), skiprows=1, dtype=str)
+    assert list(df.columns) == ["flag_id", "description", "name"]
+    assert df["flag_id"].tolist() == [str(int(flag)) for flag in flagger.Flags] + ["1000"]
+    assert df.iloc[-1].tolist() == ["1000", "door == 0", "closed"]
@@ -0,0 +1,66 @@
+import threading
+import pytest
+import pandas
+from src.tables import ReadGovernor
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+def test_rate_limit_sleeps(sleeps):
+    governor = ReadGovernor(max_rows_per_second=1000, sleep=sleeps.append)
+    governor.record(500, 0.1)
+    governor.record(500, 0.6)
+    assert sleeps == [pytest.approx(0.4)]
+
+def test_no_limits_never_sleeps(sleeps):
+    governor = ReadGovernor(sleep=sleeps.append)
+    governor.record(10 ** 6, 0.01)
+    assert sleeps == []
+
+def test_adaptive_backs_off_and_recovers(sleeps):
+    governor = ReadGovernor(adaptive=True, sleep=sleeps.append)
+    governor.record(1000, 1.0)
+    assert governor.speed == 1.0
+
+    # Three times slower than the best read: halve the speed, which doubles
+    # the time this read takes up.
+    governor.record(1000, 3.0)
+    assert governor.speed == 0.5
+    assert sleeps == [pytest.approx(3.0)]
+
+    governor.record(1000, 1.0)
+    assert governor.speed == 0.625
+
+def test_adaptive_min_speed(sleeps):
+    governor = ReadGovernor(adaptive=True, sleep=sleeps.append)
+    governor.record(1000, 1.0)
+    for _ in range(10):
+        governor.record(1000, 10.0)
+    assert governor.speed == ReadGovernor.min_speed
+
+def test_max_concurrent():
+    governor = ReadGovernor(max_concurrent=1)
+    with governor.query():
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(governor._slots.acquire(timeout=0.01)))
+        thread.start()
+        thread.join()
+        assert acquired == [False]
+
+    with governor.query():
+        pass
+
+def test_chunks_records_each_frame(sleeps):
+    ticks = iter(range(100))
+    governor = ReadGovernor(max_rows_per_second=1, clock=lambda: next(ticks), sleep=sleeps.append)
+    frames = [pandas.DataFrame({"a": range(3)}), pandas.DataFrame({"a": range(2)})]
+    assert len(list(governor.chunks(frames))) == 2
+    # Each frame took one tick to arrive.
+    assert sleeps == [2, 1]
+
+def test_session_sql():
+    assert ReadGovernor().session_sql() is None
+    assert ReadGovernor(statement_timeout=30000).session_sql() == "SET statement_timeout = 30000;"
@@ -0,0 +1,63 @@
+import pytest
+from types import SimpleNamespace
+from sqlalchemy.exc import SQLAlchemyError
+from src.tables.replicas import Replicas
+
+
+class Custom_Engine():
+    def __init__(self, name, healthy=True):
+        self.name = name
+        self.url = SimpleNamespace(host=name)
+        self.healthy = healthy
+        self.checks = 0
+
+    def connect(self):
+        engine = self
+        class Connection():
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, sql):
+                engine.checks += 1
+                if not engine.healthy:
+                    raise SQLAlchemyError("down")
+
+        return Connection()
+
+@pytest.fixture
+def clock():
+    now = [0]
+    return now, lambda: now[0]
+
+@pytest.fixture
+def replicas(clock):
+    engines = [Custom_Engine("a"), Custom_Engine("b")]
+    return Replicas(engines, recheck_seconds=30, clock=clock[1])
+
+def test_round_robin(replicas):
+    assert [replicas.engine().name for _ in range(3)] == ["a", "b", "a"]
+
+def test_mark_down_skips_replica(replicas):
+    replicas.mark_down(replicas.engines[0])
+    assert [replicas.engine().name for _ in range(3)] == ["b", "b", "b"]
+
+def test_recheck_after_timeout(replicas, clock):
+    replicas.mark_down(replicas.engines[0])
+    replicas.engines[0].healthy = False
+    clock[0][0] = 31
+    # The failed health check keeps it down for another recheck_seconds.
+    assert replicas.engine().name == "b"
+    assert replicas.engines[0].checks == 1
+
+    replicas.engines[0].healthy = True
+    clock[0][0] = 62
+    assert [replicas.engine().name for _ in range(2)] == ["a", "b"]
+    assert replicas.engines[0].checks == 2
+
+def test_no_healthy_replica(replicas):
+    for engine in replicas.engines:
+        replicas.mark_down(engine)
+    assert replicas.engine() is None
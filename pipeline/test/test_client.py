@@ -1,5 +1,15 @@
 import pytest
+import numpy
+import pandas
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime
 from src.client import _Client
+from src.tables import DayCache, Flagged_Data
+from src.config import config
+from src.parallel import flagging_pool
+from flaggers.flagger import Flags
+from flaggers.duplicate import fingerprint
+from flaggers.rules import rules_flagger
 
 @pytest.fixture
 def mock_config():
@@ -45,10 +55,454 @@ def test_create_hive(instance_fixture):
         def create_table(self):
             self.value += 1
 
+        def write_table(self, flags, update=False):
+            return True
+
     custom = Custom_Table()
 
     instance_fixture.flags = custom
     instance_fixture.service_periods = custom
     instance_fixture.flagged = custom
+    instance_fixture.fingerprints = custom
     instance_fixture.create_hive()
-    assert custom.value == 3
+    assert custom.value == 4
+
+# Records the write settings, staging and constraint suspensions the client
+# sets on flagged_data.
+class Flagged_Settings():
+    settings = {}
+    staging = "temporary"
+    suspended = False
+
+    def suspend_constraints(self):
+        self.suspended = True
+        return True
+
+    def restore_constraints(self):
+        self.suspended = False
+        return True
+
+    def set_write_settings(self, settings):
+        self.settings = dict(settings)
+        return True
+
+    def set_staging(self, staging):
+        self.staging = staging
+        return True
+
+@pytest.fixture
+def custom_process_tables(instance_fixture):
+    class Custom_CTran():
+        def query_date_range(self, start_date, end_date, columns=None):
+            df = pandas.DataFrame({
+                "service_date": [date(2020, 1, 2), date(2020, 1, 2), date(2020, 1, 3)],
+                "door": [1, 0, 1],
+                "location_distance": [0.0, 0.0, None],
+            }, index=pandas.Index([100, 101, 102], name="row_id"))
+            # Mirrors Table._query_table converting NaN to None.
+            return df.astype(object).where(df.notnull(), None)
+
+    class Custom_Service_Periods():
+        def query_or_insert(self, date):
+            return 7
+
+    class Custom_Flagged(Flagged_Settings):
+        def __init__(self):
+            self.written = None
+
+        def write_table(self, data):
+            self.written = data
+            return True
+
+    instance_fixture.ctran = Custom_CTran()
+    instance_fixture.service_periods = Custom_Service_Periods()
+    instance_fixture.flagged = Custom_Flagged()
+    instance_fixture._output_type = "aperture"
+    return instance_fixture
+
+def test_process_data(custom_process_tables):
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    written = custom_process_tables.flagged.written
+    assert [101, 7, int(Flags.UNOPENED_DOOR), "2020/1/2"] in written
+    assert [102, 7, int(Flags.LOCATION_DISTANCE_NULL), "2020/1/3"] in written
+    assert len(written) == 2
+
+def test_process_data_chunked(monkeypatch, custom_process_tables):
+    def query_date_range_chunks(start_date, end_date, chunksize, columns=None):
+        df = custom_process_tables.ctran.query_date_range(start_date, end_date)
+        yield df.iloc[:2]
+        yield df.iloc[2:]
+
+    class Custom_Flagged(Flagged_Settings):
+        def __init__(self):
+            self.written = []
+
+        def write_table(self, data):
+            self.written.append(data)
+            return True
+
+    monkeypatch.setitem(config._data, "chunk_rows", 2)
+    custom_process_tables.ctran.query_date_range_chunks = query_date_range_chunks
+    custom_process_tables.flagged = Custom_Flagged()
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.written == [
+        [[101, 7, int(Flags.UNOPENED_DOOR), "2020/1/2"]],
+        [[102, 7, int(Flags.LOCATION_DISTANCE_NULL), "2020/1/3"]],
+    ]
+
+def test_process_data_one_flagging_pool(monkeypatch, custom_process_tables):
+    # The worker processes are started once per run and flag every chunk.
+    def query_date_range_chunks(start_date, end_date, chunksize, columns=None):
+        assert len(pools) == 1
+        df = custom_process_tables.ctran.query_date_range(start_date, end_date)
+        yield df.iloc[:2]
+        yield df.iloc[2:]
+
+    pools = []
+    def counting_pool(flagger_ids, config, workers):
+        pools.append(flagging_pool(flagger_ids, config, workers))
+        return pools[-1]
+
+    class Custom_Flagged(Flagged_Settings):
+        def __init__(self):
+            self.written = []
+
+        def write_table(self, data):
+            self.written.append(data)
+            return True
+
+    monkeypatch.setattr("src.client.flagging_pool", counting_pool)
+    monkeypatch.setitem(config._data, "chunk_rows", 2)
+    monkeypatch.setitem(config._data, "flagging_workers", 2)
+    custom_process_tables.ctran.query_date_range_chunks = query_date_range_chunks
+    custom_process_tables.flagged = Custom_Flagged()
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert len(pools) == 1
+    assert custom_process_tables._flagging_pool is None
+    assert custom_process_tables.flagged.written == [
+        [[101, 7, int(Flags.UNOPENED_DOOR), "2020/1/2"]],
+        [[102, 7, int(Flags.LOCATION_DISTANCE_NULL), "2020/1/3"]],
+    ]
+
+def test_process_data_registers_flags_once(monkeypatch, custom_process_tables):
+    def query_date_range_chunks(start_date, end_date, chunksize, columns=None):
+        df = custom_process_tables.ctran.query_date_range(start_date, end_date)
+        yield df.iloc[:2]
+        yield df.iloc[2:]
+
+    class Custom_Flags():
+        writes = 0
+
+        def write_table(self, flags, update=False):
+            self.writes += 1
+
+    monkeypatch.setitem(config._data, "chunk_rows", 2)
+    custom_process_tables.ctran.query_date_range_chunks = query_date_range_chunks
+    custom_process_tables.flags = Custom_Flags()
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flags.writes == 1
+
+def test_process_data_chunked_read_error(monkeypatch, custom_process_tables):
+    def query_date_range_chunks(start_date, end_date, chunksize, columns=None):
+        yield None
+
+    monkeypatch.setitem(config._data, "chunk_rows", 2)
+    custom_process_tables.ctran.query_date_range_chunks = query_date_range_chunks
+    assert not custom_process_tables.process_data("2020/01/02", "2020/01/03")
+
+def test_process_data_parallel_readers(monkeypatch, custom_process_tables):
+    def query_date_range_shards(start_date, end_date, readers, columns=None):
+        df = custom_process_tables.ctran.query_date_range(start_date, end_date)
+        yield df.iloc[:2]
+        yield df.iloc[:0]
+        yield df.iloc[2:]
+
+    monkeypatch.setitem(config._data, "parallel_readers", 2)
+    custom_process_tables.ctran.query_date_range_shards = query_date_range_shards
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/04")
+    written = custom_process_tables.flagged.written
+    assert written == [[102, 7, int(Flags.LOCATION_DISTANCE_NULL), "2020/1/3"]]
+
+def test_process_data_source_files(monkeypatch, custom_process_tables):
+    class Failing_CTran():
+        def query_date_range(self, start_date, end_date, columns=None):
+            raise AssertionError("ctran_data should not be read")
+
+    custom_process_tables._files = custom_process_tables.ctran
+    custom_process_tables.ctran = Failing_CTran()
+    monkeypatch.setitem(config._data, "parallel_readers", 2)
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert len(custom_process_tables.flagged.written) == 2
+
+def test_process_data_write_streams(monkeypatch, custom_process_tables):
+    class Custom_Flagged(Flagged_Settings):
+        def __init__(self, failed):
+            self.failed = failed
+
+        def write_table_days(self, data, streams):
+            self.written = data
+            self.streams = streams
+            return self.failed
+
+    custom_process_tables.flagged = Custom_Flagged([])
+    monkeypatch.setitem(config._data, "write_streams", 3)
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.streams == 3
+    assert len(custom_process_tables.flagged.written) == 2
+
+    # A day that was not written fails the run.
+    custom_process_tables.flagged = Custom_Flagged(["2020/1/3"])
+    assert not custom_process_tables.process_data("2020/01/02", "2020/01/03")
+
+def test_process_data_bulk_load_profile(monkeypatch, custom_process_tables):
+    class Custom_Flagged(Flagged_Settings):
+        def write_table(self, data):
+            self.during = (self.settings, self.staging)
+            return True
+
+    custom_process_tables.flagged = Custom_Flagged()
+    profile = {"synchronous_commit": "off", "work_mem": "256MB"}
+    monkeypatch.setitem(config._data, "bulk_load_profile", profile)
+    monkeypatch.setitem(config._data, "bulk_load_unlogged_staging", True)
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.during == (profile, "unlogged")
+    assert custom_process_tables.flagged.settings == {}
+    assert custom_process_tables.flagged.staging == "temporary"
+
+def test_process_data_backfill_mode(monkeypatch, custom_process_tables):
+    class Custom_Flagged(Flagged_Settings):
+        def write_table(self, data):
+            self.during = self.suspended
+            return True
+
+    custom_process_tables.flagged = Custom_Flagged()
+    monkeypatch.setitem(config._data, "backfill_mode", True)
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.during
+    assert not custom_process_tables.flagged.suspended
+
+def test_process_data_restore_fails(custom_process_tables):
+    custom_process_tables.flagged.restore_constraints = lambda: False
+    assert not custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.written is None
+
+def test_process_data_key_not_validated(custom_process_tables):
+    # A suspended foreign key that does not validate is still enforced on new
+    # rows, so the run goes on and the validation is retried next time.
+    class Result():
+        def __init__(self, rows):
+            self.rows = rows
+
+        def fetchall(self):
+            return self.rows
+
+        def scalar(self):
+            return self.rows[0][0] if self.rows else None
+
+    class Custom_Connection():
+        results = {
+            "SELECT to_regclass": [("hive.suspended_ddl",)],
+            "SELECT name, kind": [("fkey", "foreign key", "FOREIGN KEY (flag_id) REFERENCES hive.flags(flag_id)")],
+            "SELECT 1 FROM pg_constraint": [(1,)],
+        }
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def execution_options(self, **options):
+            return self
+
+        def execute(self, sql, **params):
+            sql = str(sql)
+            if "VALIDATE" in sql:
+                raise SQLAlchemyError("violates foreign key constraint")
+            return Result(next((rows for prefix, rows in self.results.items()
+                                if sql.startswith(prefix)), []))
+
+    class Custom_Flagged(Flagged_Data):
+        def write_table(self, data):
+            self.written = data
+            return True
+
+    flagged = Custom_Flagged("sw23", "invalid", "localhost", "aperture")
+    flagged._engine.connect = lambda: Custom_Connection()
+    custom_process_tables.flagged = flagged
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert len(flagged.written) == 2
+
+def test_read_columns(monkeypatch, instance_fixture):
+    monkeypatch.setitem(config._data, "enabled_flaggers", ["Unopened Door", "Unobserved Stop"])
+    monkeypatch.setitem(config._data, "threshold_overrides", [])
+    monkeypatch.setitem(config._data, "cross_day_duplicates", False)
+    assert instance_fixture._read_columns() == [
+        "door", "location_distance", "service_date", "vehicle_number"]
+
+    monkeypatch.setitem(config._data, "cross_day_duplicates", True)
+    monkeypatch.setitem(config._data, "duplicate_key_columns", ["trip_id"])
+    assert "trip_id" in instance_fixture._read_columns()
+
+    # Duplicate compares every column unless key columns are set.
+    monkeypatch.setitem(config._data, "enabled_flaggers", ["Duplicate"])
+    monkeypatch.setitem(config._data, "duplicate_key_columns", [])
+    assert instance_fixture._read_columns() is None
+
+def test_process_data_enabled_flaggers(monkeypatch, custom_process_tables):
+    monkeypatch.setitem(config._data, "enabled_flaggers", ["Unopened Door"])
+    assert custom_process_tables.process_data("2020/01/02", "2020/01/03")
+    assert custom_process_tables.flagged.written == [
+        [101, 7, int(Flags.UNOPENED_DOOR), "2020/1/2"]]
+
+def test_build_day_cache(monkeypatch, instance_fixture):
+    monkeypatch.setitem(config._data, "day_cache_max_mb", 0)
+    assert instance_fixture._build_day_cache() is None
+
+    monkeypatch.setitem(config._data, "day_cache_max_mb", 2)
+    monkeypatch.setattr(DayCache, "available", staticmethod(lambda: False))
+    assert instance_fixture._build_day_cache() is None
+
+    monkeypatch.setattr(DayCache, "available", staticmethod(lambda: True))
+    cache = instance_fixture._build_day_cache()
+    assert cache.max_bytes == 2 * 1024 * 1024
+    assert cache.path == config.get_value("day_cache_path")
+
+def test_invalidate_day_cache(instance_fixture):
+    class Custom_Cache():
+        def invalidate(self, start, end):
+            self.range = (start, end)
+            return 3
+
+    instance_fixture._day_cache = None
+    assert instance_fixture.invalidate_day_cache("2020/01/01") is False
+
+    instance_fixture._day_cache = Custom_Cache()
+    assert instance_fixture.invalidate_day_cache("2020/01/01", "2020/01/02") == 3
+    assert instance_fixture._day_cache.range == (datetime(2020, 1, 1), datetime(2020, 1, 2))
+
+def test_build_flagged_rows_skips_missing_service_key(instance_fixture):
+    df = pandas.DataFrame({
+        "service_date": [date(2020, 1, 2), date(2020, 1, 3)],
+    }, index=[5, 6])
+    masks = {Flags.DUPLICATE: numpy.array([True, True])}
+    date_codes = numpy.array([0, -1])
+    rows = instance_fixture._build_flagged_rows(df, masks, [3, None], date_codes)
+    assert rows == [[5, 3, int(Flags.DUPLICATE), "2020/1/2"]]
+
+@pytest.fixture
+def custom_fingerprints(monkeypatch, custom_process_tables):
+    class Custom_Fingerprints():
+        def __init__(self):
+            self.history = None
+            self.written = None
+
+        def query_fingerprints(self, fingerprints):
+            return self.history
+
+        def write_table(self, fingerprints, row_ids, service_dates):
+            self.written = (list(fingerprints), row_ids, service_dates)
+            return True
+
+    monkeypatch.setitem(config._data, "cross_day_duplicates", True)
+    monkeypatch.setitem(config._data, "duplicate_key_columns", ["door", "service_date"])
+    custom_process_tables.fingerprints = Custom_Fingerprints()
+    return custom_process_tables
+
+def test_process_data_cross_day_duplicates(custom_fingerprints):
+    df = custom_fingerprints.ctran.query_date_range(None, None)
+    hashes = fingerprint(df, ["door", "service_date"]).values
+    # Row 100 was processed before under another row_id; row 102 matches only
+    # itself, as when a day is reprocessed.
+    custom_fingerprints.fingerprints.history = pandas.DataFrame({
+        "fingerprint": [hashes[0], hashes[2]],
+        "row_id": [50, 102],
+        "service_date": [date(2020, 1, 1), date(2020, 1, 3)],
+    })
+    assert custom_fingerprints.process_data("2020/01/02", "2020/01/03")
+
+    written = custom_fingerprints.flagged.written
+    duplicates = [row[0] for row in written if row[2] == int(Flags.DUPLICATE)]
+    assert duplicates == [100]
+
+    indexed = custom_fingerprints.fingerprints.written
+    assert indexed[0] == hashes.tolist()
+    assert indexed[1] == [100, 101, 102]
+    assert indexed[2] == ["2020/1/2", "2020/1/2", "2020/1/3"]
+
+def test_process_data_failed_day_fingerprints(monkeypatch, custom_fingerprints):
+    # Rows of a day whose flags were not written are not fingerprinted, so
+    # rewriting the day does not flag them as duplicates of themselves.
+    class Custom_Flagged(Flagged_Settings):
+        def write_table_days(self, data, streams):
+            return ["2020/1/3"]
+
+    custom_fingerprints.flagged = Custom_Flagged()
+    monkeypatch.setitem(config._data, "write_streams", 2)
+    assert not custom_fingerprints.process_data("2020/01/02", "2020/01/03")
+    indexed = custom_fingerprints.fingerprints.written
+    assert indexed[1] == [100, 101]
+    assert indexed[2] == ["2020/1/2", "2020/1/2"]
+
+def test_process_data_cross_day_default_key(monkeypatch, custom_fingerprints):
+    # Without key columns, a row repeated on the next day still collides.
+    monkeypatch.setitem(config._data, "duplicate_key_columns", [])
+    df = custom_fingerprints.ctran.query_date_range(None, None)
+    earlier = df.iloc[[2]].assign(service_date=[date(2020, 1, 2)])
+    hashes = fingerprint(earlier, ["door", "location_distance"]).values
+    custom_fingerprints.fingerprints.history = pandas.DataFrame({
+        "fingerprint": hashes,
+        "row_id": [60],
+        "service_date": [date(2020, 1, 2)],
+    })
+    assert custom_fingerprints.process_data("2020/01/02", "2020/01/03")
+
+    written = custom_fingerprints.flagged.written
+    duplicates = [row[0] for row in written if row[2] == int(Flags.DUPLICATE)]
+    assert duplicates == [102]
+
+def test_process_data_cross_day_within_range(monkeypatch, custom_fingerprints):
+    # A row repeated on a later day of the range is flagged even when the index
+    # holds nothing, as when the range is reprocessed, matching a run per day.
+    monkeypatch.setitem(config._data, "duplicate_key_columns", [])
+    def query_date_range(start_date, end_date, columns=None):
+        return pandas.DataFrame({
+            "service_date": [date(2020, 1, 2), date(2020, 1, 2), date(2020, 1, 3)],
+            "door": [1, 0, 1],
+            "location_distance": [0.0, 0.0, 0.0],
+        }, index=pandas.Index([100, 101, 102], name="row_id")).astype(object)
+
+    monkeypatch.setattr(custom_fingerprints.ctran, "query_date_range", query_date_range)
+    custom_fingerprints.fingerprints.history = pandas.DataFrame(
+        columns=["fingerprint", "row_id", "service_date"])
+    assert custom_fingerprints.process_data("2020/01/02", "2020/01/03")
+
+    written = custom_fingerprints.flagged.written
+    duplicates = [row[0] for row in written if row[2] == int(Flags.DUPLICATE)]
+    assert duplicates == [102]
+
+def test_register_flags(monkeypatch, instance_fixture):
+    class Custom_Flags():
+        def __init__(self):
+            self.written = None
+            self.update = None
+
+        def write_table(self, flags, update=False):
+            self.written = flags
+            self.update = update
+
+    monkeypatch.setitem(config._data, "rules", [
+        {"flag_id": 1000, "name": "closed", "expression": "door == 0"}])
+    instance_fixture._load_rules()
+    instance_fixture.flags = Custom_Flags()
+    instance_fixture._register_flags()
+    # Every enum flag is registered too, so flags added since the table was
+    # created exist before flagged_data references them.
+    written = instance_fixture.flags.written
+    assert [row[0] for row in written[:-1]] == [int(flag) for flag in Flags]
+    assert written[-1] == [1000, "door == 0", "closed"]
+    assert not instance_fixture.flags.update
+
+    monkeypatch.setitem(config._data, "rules", [{"flag_id": 1, "name": "bad", "expression": "door"}])
+    instance_fixture._load_rules()
+    assert rules_flagger.rules == []